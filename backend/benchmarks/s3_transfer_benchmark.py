@@ -0,0 +1,92 @@
+"""
+S3 Transfer Profile Benchmark
+
+Measures upload_file/download_file throughput of the S3 helper with the boto3 default
+transfer settings and with the transfer profile of S3Functions, against a local S3
+stand-in (or any S3 compatible endpoint).
+
+Usage:
+    pip install "moto[server]"
+    moto_server -p 5000 &
+    python benchmarks/s3_transfer_benchmark.py --endpoint-url http://127.0.0.1:5000
+
+Transfer profile settings are read from the same environment variables as the Lambda
+functions (S3_MAX_POOL_CONNECTIONS, S3_MULTIPART_THRESHOLD_MB, S3_MULTIPART_CHUNKSIZE_MB,
+S3_MAX_CONCURRENCY), so alternative profiles can be compared by setting them.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'lambda'))
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+import S3Functions
+
+MB = 1024 * 1024
+
+def get_profiles() -> dict:
+    """boto3 defaults and the S3Functions transfer profile
+    """
+    return {
+        'default': (Config(), TransferConfig()),
+        'profile': (S3Functions.get_client_config(), S3Functions.get_transfer_config()),
+    }
+
+def run_profile(endpoint_url: str, bucket: str, files: list, client_config: Config, transfer_config: TransferConfig, parallel_files: int) -> tuple[float, float]:
+    """Uploads and downloads the files with a profile, returns upload and download throughput in MB/s
+    """
+    client = boto3.client('s3', endpoint_url=endpoint_url, config=client_config)
+    total_mb = sum(os.path.getsize(path) for path in files) / MB
+
+    def upload(path: str):
+        client.upload_file(path, bucket, os.path.basename(path), Config=transfer_config)
+
+    def download(path: str):
+        client.download_file(bucket, os.path.basename(path), f"{path}.out", Config=transfer_config)
+
+    timings = []
+    for operation in (upload, download):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=parallel_files) as pool:
+            list(pool.map(operation, files))
+        timings.append(total_mb / (time.perf_counter() - start))
+    return timings[0], timings[1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint-url', default=os.environ.get('S3_ENDPOINT_URL', 'http://127.0.0.1:5000'))
+    parser.add_argument('--bucket', default='transfer-benchmark')
+    parser.add_argument('--size-mb', type=int, default=64, help='size of every test file')
+    parser.add_argument('--files', type=int, default=4, help='number of test files')
+    parser.add_argument('--parallel-files', type=int, default=2, help='files transferred at the same time, like the redaction prefetch')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    client = boto3.client('s3', endpoint_url=args.endpoint_url)
+    client.create_bucket(Bucket=args.bucket)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        files = []
+        for idx in range(args.files):
+            path = os.path.join(work_dir, f"doc-{idx}.pdf")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(args.size_mb * MB))
+            files.append(path)
+
+        print(f"{args.files} files x {args.size_mb} MB, {args.parallel_files} files in parallel, best of {args.rounds} rounds")
+        print(f"{'profile':<10} {'upload MB/s':>12} {'download MB/s':>14}")
+        for name, (client_config, transfer_config) in get_profiles().items():
+            results = [run_profile(args.endpoint_url, args.bucket, files, client_config, transfer_config, args.parallel_files) for _ in range(args.rounds)]
+            print(f"{name:<10} {max(r[0] for r in results):>12.1f} {max(r[1] for r in results):>14.1f}")
+
+if __name__ == '__main__':
+    main()
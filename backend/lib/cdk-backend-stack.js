@@ -170,7 +170,10 @@ class PIIBackendStack extends Stack{
                                 "dynamodb:PartiQLInsert",
                                 "dynamodb:PartiQLUpdate",
                                 "dynamodb:PartiQLDelete",
-                                "dynamodb:PartiQLSelect"
+                                "dynamodb:PartiQLSelect",
+                                "dynamodb:GetItem",
+                                "dynamodb:PutItem",
+                                "dynamodb:UpdateItem"
                             ],
                             resources: ["*"]
                         })
@@ -199,6 +202,7 @@ class PIIBackendStack extends Stack{
                             effect: iam.Effect.ALLOW,
                             actions: [
                                 "sqs:SendMessage",
+                                "sqs:ChangeMessageVisibility",
                                 "sqs:ListQueues",
                                 "states:ListStateMachines",
                                 "states:ListActivities",
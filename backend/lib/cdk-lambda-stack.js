@@ -38,7 +38,7 @@ class PIILambdaStack extends Stack{
                         platform: "linux/amd64"
                     }),
             role: props.lambdaRole,
-            timeout: Duration.minutes(1),
+            timeout: Duration.minutes(5),
             memorySize: 128
         });
 
@@ -307,7 +307,12 @@ class PIILambdaStack extends Stack{
                     }),
             environment:{
                 LOG_LEVEL: 'DEBUG',
-                FORCE_RECREATE: 'true'
+                FORCE_RECREATE: 'true',
+                PDF_REDACTION_MODE: 'raster', // 'vector' keeps PDF pages as text and only rasterizes scanned pages
+                REDACT_WORKERS: '1', // 'auto' redacts the documents of a Map branch across all available vCPUs
+                REDACT_PREFETCH: '1', // documents downloaded/uploaded in the background while another one is redacted
+                RENDER_WORKERS: '1', // 'auto' renders the pages of large PDFs across all available vCPUs
+                REDACT_MEMORY_MB: '1024' // memory budget for rendered pages in flight, render workers then resolution are lowered to fit
             },
             role: props.lambdaRole,
             timeout: Duration.minutes(15),
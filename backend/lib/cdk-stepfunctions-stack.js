@@ -137,6 +137,7 @@ class PIIStepFunctionStack extends Stack{
             bucket: sfn.JsonPath.stringAt('$.bucket'),
             workflow_id: sfn.JsonPath.stringAt('$.workflow_id'),
             retain_docs: sfn.JsonPath.stringAt('$.retain_docs'),
+            redact_options: sfn.JsonPath.stringAt('$.redact_options'),
             doc_prefixes: sfn.JsonPath.stringAt('$.doc_prefixes'),
           }),
           outputPath: '$.Payload'
@@ -155,6 +156,7 @@ class PIIStepFunctionStack extends Stack{
             bucket: sfn.JsonPath.stringAt('$.bucket'),
             workflow_id: sfn.JsonPath.stringAt('$.workflow_id'),
             retain_docs: sfn.JsonPath.stringAt('$.retain_docs'),
+            redact_options: sfn.JsonPath.stringAt('$.redact_options'),
             redact_data: sfn.JsonPath.stringAt('$.redact_data'),
           }),
           outputPath: '$.Payload'
@@ -231,6 +233,7 @@ class PIIStepFunctionStack extends Stack{
                                                   parameters:{
                                                     "workflow_id": sfn.JsonPath.stringAt('$.workflow_id'),
                                                     "retain_docs": sfn.JsonPath.stringAt('$.retain_docs'),
+                                                    "redact_options": sfn.JsonPath.stringAt('$.redact_options'),
                                                     "bucket": sfn.JsonPath.stringAt('$.bucket'),
                                                     "doc_prefixes": sfn.JsonPath.stringAt("$$.Map.Item.Value")                                                    
                                                   },
@@ -355,6 +358,9 @@ class PIIStepFunctionStack extends Stack{
                     PII_TABLE: props.piiTable.tableName,
                     STATE_MACHINE: stateMachine.stateMachineArn,
                     PII_QUEUE: props.sqsQueue, 
+                    FANOUT_CHUNK_SIZE: '1000',
+                    FANOUT_TIME_MARGIN_MS: '30000',
+                    PRIORITY_WEIGHTS: JSON.stringify({ normal: 1, high: 4 }),
                 },
               },
             },
@@ -367,6 +373,20 @@ class PIIStepFunctionStack extends Stack{
             installLatestAwsSdk: true
         });
 
+        /**
+         * Textract submission limits shared by the Textract Processing and Bulk Processing Lambdas,
+         * see TextractSubmitter.py. Align them with the StartDocumentAnalysis TPS and concurrent job
+         * quotas of the account
+         */
+        const textractSubmitterEnv = {
+            TEXTRACT_TPS: '5',
+            TEXTRACT_MAX_CONCURRENT_JOBS: '100',
+            TEXTRACT_SUBMIT_WORKERS: '4',
+            THROTTLED_VISIBILITY_TIMEOUT: '60',
+            TEXTRACT_RECEIVE_VISIBILITY_TIMEOUT: '120',
+            TEXTRACT_SUBMIT_MAX_RECEIVES: '5'
+        };
+
         /**
          * Configure Textract Processing Lambda
          * Updates environment variables for the Lambda function that processes documents:
@@ -387,7 +407,8 @@ class PIIStepFunctionStack extends Stack{
                     PII_TABLE: props.piiTable.tableName,
                     INPUT_BKT: inputBucketName,
                     SNS_TOPIC: props.snsTopic.topicArn,
-                    SNS_ROLE: props.snsRole.roleArn
+                    SNS_ROLE: props.snsRole.roleArn,
+                    ...textractSubmitterEnv
                 },
               },
             },
@@ -420,7 +441,8 @@ class PIIStepFunctionStack extends Stack{
                     INPUT_BKT: inputBucketName,
                     SNS_TOPIC: props.snsTopic.topicArn,
                     SNS_ROLE: props.snsRole.roleArn,
-                  LAMBDA_POST_PROCESS: props.processTextractOp.functionName
+                  LAMBDA_POST_PROCESS: props.processTextractOp.functionName,
+                  ...textractSubmitterEnv
               },
             },
           },
@@ -5,24 +5,189 @@ This module provides a helper class for interacting with Amazon S3.
 It simplifies common S3 operations used throughout the Lambda functions
 in the PII redaction pipeline, such as:
 
-- Listing objects and prefixes
-- Getting object content
-- Copying and moving objects
-- Deleting objects
+- Listing objects and prefixes (lazily, one page at a time)
+- Getting object content (in memory, streamed, in chunks or by byte range)
+- Copying and moving objects (concurrently in bulk)
+- Deleting objects (in batches of up to 1000 keys)
 - Uploading and downloading files
 
 The class provides a consistent interface for S3 operations and handles
-error logging and exception propagation.
+error logging and exception propagation. It sits on a storage backend (see StorageBackends),
+Amazon S3 by default, or a local directory or process memory for offline runs of the pipeline.
+
+The module level S3 client and resource are built from a transfer profile set from
+environment variables, and are shared with the Lambda functions using S3 directly:
+
+- S3_MAX_POOL_CONNECTIONS: HTTP connections kept per client (default 50)
+- S3_MAX_ATTEMPTS: Attempts per request, standard retry mode (default 5). It is the only retry layer of
+  failed requests, the bulk helpers only retry the keys a DeleteObjects response reports as failed
+- S3_MULTIPART_THRESHOLD_MB: Size from which transfers are multipart (default 16)
+- S3_MULTIPART_CHUNKSIZE_MB: Size of the parts of multipart transfers (default 16)
+- S3_MAX_CONCURRENCY: Threads transferring the parts of one file (default 20)
+- S3_ENDPOINT_URL: Optional endpoint of an S3 compatible stand-in, e.g. for benchmarks
+
+S3 helper objects created with cache=True keep object bodies in an in-process LRU cache shared
+by every helper of the Lambda container, so it survives across warm invocations. Cached bodies
+are revalidated with a conditional GET (If-None-Match), an unchanged object costs a 304 response
+instead of a full read. The cache is bounded by S3_CACHE_MAX_MB (default 64).
 """
 import boto3
 import logging
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from typing import Callable, Iterator, NamedTuple
+from StorageBackends import StorageBackend, get_storage_backend
+
+MB = 1024 * 1024
+
+# Transfer profile, see the module docstring
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', '50'))
+S3_MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', '5'))
+S3_MULTIPART_THRESHOLD_MB = int(os.environ.get('S3_MULTIPART_THRESHOLD_MB', '16'))
+S3_MULTIPART_CHUNKSIZE_MB = int(os.environ.get('S3_MULTIPART_CHUNKSIZE_MB', '16'))
+S3_MAX_CONCURRENCY = int(os.environ.get('S3_MAX_CONCURRENCY', '20'))
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+
+def get_client_config(max_pool_connections: int = S3_MAX_POOL_CONNECTIONS, max_attempts: int = S3_MAX_ATTEMPTS) -> Config:
+    """Builds the botocore client configuration of the transfer profile
+    """
+    return Config(max_pool_connections=max_pool_connections, retries={'max_attempts': max_attempts, 'mode': 'standard'})
+
+def get_transfer_config(multipart_threshold_mb: int = S3_MULTIPART_THRESHOLD_MB, multipart_chunksize_mb: int = S3_MULTIPART_CHUNKSIZE_MB,
+                        max_concurrency: int = S3_MAX_CONCURRENCY) -> TransferConfig:
+    """Builds the managed transfer configuration (upload_file, download_file, copy) of the transfer profile
+    """
+    return TransferConfig(multipart_threshold=multipart_threshold_mb * MB, multipart_chunksize=multipart_chunksize_mb * MB,
+                          max_concurrency=max_concurrency, use_threads=True)
 
-# Initialize AWS S3 clients
-s3 = boto3.client('s3')
-s3_resource = boto3.resource('s3')
+# Initialize AWS S3 clients, shared by every S3 helper object and the Lambda functions importing them
+client_config = get_client_config()
+transfer_config = get_transfer_config()
+s3 = boto3.client('s3', config=client_config, endpoint_url=S3_ENDPOINT_URL)
+s3_resource = boto3.resource('s3', config=client_config, endpoint_url=S3_ENDPOINT_URL)
+# Storage backend of the S3 helper objects, selected with STORAGE_BACKEND
+storage_backend = get_storage_backend(client=s3, transfer_config=transfer_config)
 logger = logging.getLogger(__name__)
 
+# Number of threads copying objects concurrently in bulk operations, at most the client connection pool size
+BULK_WORKERS = int(os.environ.get('S3_BULK_WORKERS', str(min(20, S3_MAX_POOL_CONNECTIONS))))
+# Number of DeleteObjects attempts of a key reported in the Errors of a response, failed requests are
+# retried by the client (S3_MAX_ATTEMPTS)
+BULK_ATTEMPTS = int(os.environ.get('S3_BULK_ATTEMPTS', '3'))
+# Maximum number of keys of a DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+# Number of bytes of an object body logged at DEBUG level, bodies are never logged in full
+LOG_PREVIEW_BYTES = int(os.environ.get('S3_LOG_PREVIEW_BYTES', '256'))
+# Size of the chunks yielded by iter_object_chunks
+READ_CHUNK_SIZE = 1024 * 1024
+# Maximum size of the bodies kept by the object cache
+S3_CACHE_MAX_MB = int(os.environ.get('S3_CACHE_MAX_MB', '64'))
+# DeleteObjects error codes of a key worth retrying
+RETRYABLE_ERRORS = {'SlowDown', 'InternalError', 'ServiceUnavailable', 'RequestTimeout', 'RequestTimeTooSkewed', 'OperationAborted'}
+
+def backoff(attempt: int, base: float = 0.1, cap: float = 5.0):
+    """Sleeps with exponential backoff and full jitter before the next attempt
+    """
+    time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
+def log_content(key: str, content: bytes):
+    """Logs the size and a capped preview of an object body, only when DEBUG logging is enabled
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        preview = content[:LOG_PREVIEW_BYTES]
+        logger.debug(f"Content from object {key}: {len(content)} bytes, first {len(preview)} bytes: {preview!r}")
+
+
+def is_not_modified(error: Exception) -> bool:
+    """Returns True for the 304 Not Modified response of a conditional GET
+    """
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in ('304', 'NotModified')
+
+class CacheEntry(NamedTuple):
+    """Cached object body with the ETag it was read with
+    """
+    etag: str
+    content: object
+    size: int
+
+class ObjectCache:
+    """
+    Thread safe LRU cache of S3 object bodies, bounded by the total size of the bodies.
+
+    The cache only stores and evicts entries, validating them against S3 is up to the S3 helper.
+    """
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: Maximum total size of the cached bodies, larger bodies are never cached
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> CacheEntry:
+        """Returns the entry of a key and marks it as most recently used, None when it is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, etag: str, content, size: int):
+        """Stores the body of a key, evicting the least recently used entries beyond max_bytes
+        """
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = CacheEntry(etag=etag, content=content, size=size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key: tuple):
+        """Removes the entry of a key
+        """
+        with self._lock:
+            self._discard(key)
+
+    def record(self, hit: bool):
+        """Counts a cache hit or miss
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        """Returns the hit/miss counters and the current size of the cache
+        """
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self._entries),
+                        size_bytes=self.size, max_bytes=self.max_bytes)
+
+    def _discard(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.size -= entry.size
+
+# Object cache shared by the S3 helper objects created with cache=True, lives as long as the Lambda container
+object_cache = ObjectCache(max_bytes=S3_CACHE_MAX_MB * MB)
+
 class S3:
     """
     Helper class for S3 operations.
@@ -30,18 +195,60 @@ class S3:
     This class provides methods for common S3 operations used in the PII redaction pipeline.
     It simplifies the interaction with S3 and provides consistent error handling.
     """
-    def __init__(self, bucket: str, log_level: str ='INFO'):
+    def __init__(self, bucket: str, log_level: str ='INFO', cache: bool = False, backend: StorageBackend = None):
         """
         Initialize the S3 helper with a bucket name and log level.
         
         Args:
             bucket: Name of the S3 bucket to operate on
             log_level: Logging level (default: INFO)
+            cache: Serve get_object_content and list_objects_cached from the shared object cache (default: False)
+            backend: Storage backend (default: the backend selected by STORAGE_BACKEND)
         """
         self.bucket=bucket
+        self.backend = backend or storage_backend
+        self.cache = object_cache if cache else None
         logger.setLevel(log_level)
     
-    def list_objects(self, prefix: str, filters: list = None, search: list = None) -> list:
+    def iter_objects(self, prefix: str, filters: list = None, search: list = None, suffixes: list = None, start_after: str = None, page_size: int = 1000) -> Iterator[str]:
+        """
+        Lazily list objects in the S3 bucket with the given prefix.
+        
+        Pages are requested from S3 as the generator is consumed, so callers that stop early
+        never list the rest of the prefix.
+        
+        Args:
+            prefix: S3 prefix to list objects from
+            filters: List of patterns to exclude from results
+            search: List of patterns to include in results
+            suffixes: List of key endings to include in results
+            start_after: Only list keys after this key
+            page_size: Number of keys requested per page (max 1000)
+            
+        Yields:
+            str: Object keys matching the criteria, in key order
+        """
+        try:
+            logger.info(f"Attempting lazy file listing for bucket: {self.bucket}, prefix: {prefix}, filters: {filters}, searches: {search}, suffixes: {suffixes}, start after: {start_after}")
+            suffixes = tuple(suffixes) if suffixes else None
+            
+            for page in self.backend.list_pages(bucket=self.bucket, prefix=prefix, start_after=start_after, page_size=page_size):
+                logger.debug(f"Listed {len(page)} objects under prefix: {prefix}")
+                for key in page:
+                    if key.endswith("/"):
+                        continue
+                    if search and not any(x in key for x in search):
+                        continue
+                    if suffixes and not key.endswith(suffixes):
+                        continue
+                    if filters and any(x in key for x in filters):
+                        continue
+                    yield key
+        except Exception as e:
+            logger.error(e)
+            raise e
+    
+    def list_objects(self, prefix: str, filters: list = None, search: list = None, suffixes: list = None, start_after: str = None) -> list:
         """
         List objects in the S3 bucket with the given prefix.
         
@@ -51,29 +258,33 @@ class S3:
             prefix: S3 prefix to list objects from
             filters: List of patterns to exclude from results
             search: List of patterns to include in results
+            suffixes: List of key endings to include in results
+            start_after: Only list keys after this key
             
         Returns:
             list: List of object keys matching the criteria
         """
-        try:
-            logger.info(f"Attempting file listing for bucket: {self.bucket}, prefix: {prefix}, filters: {filters}, searches: {search}")
-            obj_bucket = s3_resource.Bucket(self.bucket)
-            logger.debug(obj_bucket)
-            
-            processed_files = None
-            
-            if filters and not search:
-                processed_files = [obj.key for obj in obj_bucket.objects.filter(Prefix=prefix) if not obj.key.endswith("/") and not any(x in obj.key for x in filters)]
-            elif search and not filters:
-                processed_files = [obj.key for obj in obj_bucket.objects.filter(Prefix=prefix) if not obj.key.endswith("/") and any(x in obj.key for x in search)]
-            elif search and filters:
-                processed_files = [obj.key for obj in obj_bucket.objects.filter(Prefix=prefix) if not obj.key.endswith("/") and any(x in obj.key for x in search)]
-                processed_files = [key for key in processed_files if not any(x in key for x in filters)]
-            else:
-                processed_files = [obj.key for obj in obj_bucket.objects.filter(Prefix=prefix) if not obj.key.endswith("/")]
-            logger.debug(processed_files)
+        processed_files = list(self.iter_objects(prefix=prefix, filters=filters, search=search, suffixes=suffixes, start_after=start_after))
+        logger.debug(processed_files)
+        return processed_files
+    
+    def iter_prefixes(self, prefix: str, start_after: str = None) -> Iterator[str]:
+        """
+        Lazily list directory-like prefixes in the S3 bucket with the given prefix, across all pages
+        of CommonPrefixes.
+        
+        Args:
+            prefix: S3 prefix to list directories from
+            start_after: Only list prefixes after this key
             
-            return processed_files
+        Yields:
+            str: Directory prefixes, in key order
+        """
+        try:
+            logger.info(f"Attempting lazy prefix listing for bucket: {self.bucket}, prefix: {prefix}, start after: {start_after}")
+            for common_prefix in self.backend.list_common_prefixes(bucket=self.bucket, prefix=prefix.rstrip("/")+"/", start_after=start_after):
+                if common_prefix.endswith("/"):
+                    yield common_prefix
         except Exception as e:
             logger.error(e)
             raise e
@@ -88,40 +299,179 @@ class S3:
         Returns:
             list: List of directory prefixes
         """
+        processed_files = list(self.iter_prefixes(prefix=prefix))
+        logger.debug(processed_files)
+        return processed_files
+            
+    def get_object_content(self, key: str, byte_range: tuple = None) -> bytes:
+        """
+        Get the content of an S3 object as bytes.
+        
+        Args:
+            key: S3 object key
+            byte_range: Optional inclusive (first byte, last byte) range to read, last byte None reads to the end
+            
+        Returns:
+            bytes: Content of the S3 object
+        """
         try:
-            logger.info(f"Attempting prefix listing for bucket: {self.bucket}, prefix: {prefix}")
-            obj_bucket = s3.list_objects_v2(Bucket=self.bucket, Delimiter="/", Prefix=prefix.rstrip("/")+"/")
-            prefixes = obj_bucket['CommonPrefixes']
-            processed_files = [obj['Prefix'] for obj in prefixes if obj['Prefix'].endswith("/")]
-            logger.debug(processed_files)
+            logger.info(f"Attempting file reading object: {key} in bucket: {self.bucket}, range: {byte_range}")
+            
+            if self.cache and not byte_range:
+                content, _ = self._get_cached_content(key=key)
+            else:
+                content = self.get_object_stream(key=key, byte_range=byte_range).read()
+            log_content(key=key, content=content)
             
-            return processed_files
+            return content
         except Exception as e:
             logger.error(e)
             raise e
+
+    def _get_cached_content(self, key: str) -> tuple:
+        """
+        Get the content and ETag of an S3 object from the object cache, revalidating the cached body
+        with a conditional GET. Objects not cached yet or changed since are read in full and cached.
+        """
+        cache_key = (self.bucket, key)
+        entry = self.cache.get(cache_key)
+        try:
+            stored = self.backend.get_object(bucket=self.bucket, key=key, if_none_match=entry.etag if entry else None)
+        except ClientError as e:
+            if entry and is_not_modified(e):
+                logger.debug(f"Object {key} not modified since cached, ETag: {entry.etag}")
+                self.cache.record(hit=True)
+                return entry.content, entry.etag
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                self.cache.invalidate(cache_key)
+            raise e
+        
+        content = stored.body.read()
+        self.cache.record(hit=False)
+        self.cache.put(cache_key, etag=stored.etag, content=content, size=len(content))
+        return content, stored.etag
+
+    def get_object_content_and_etag(self, key: str) -> tuple:
+        """
+        Get the content of an S3 object as bytes together with its ETag.
+        
+        Args:
+            key: S3 object key
             
-    def get_object_content(self, key: str) -> bytes:
+        Returns:
+            tuple: Content of the S3 object and its ETag
         """
-        Get the content of an S3 object as bytes.
+        try:
+            logger.info(f"Attempting file reading object: {key} with ETag in bucket: {self.bucket}")
+            if self.cache:
+                return self._get_cached_content(key=key)
+            stored = self.backend.get_object(bucket=self.bucket, key=key)
+            return stored.body.read(), stored.etag
+        except Exception as e:
+            logger.error(e)
+            raise e
+
+    def list_objects_cached(self, prefix: str, validator_etag: str, filters: list = None, search: list = None, suffixes: list = None) -> list:
+        """
+        List objects in the S3 bucket with the given prefix, from the object cache while a validator
+        ETag is unchanged.
+        
+        S3 listings carry no ETag, so a cached listing is only valid as long as the objects under the
+        prefix only change together with the object the validator ETag belongs to, e.g. the outputs
+        of a processed workflow and its Manifest. Without the cache the prefix is listed every time.
+        
+        Args:
+            prefix: S3 prefix to list objects from
+            validator_etag: Current ETag of the object validating the listing, see get_object_content_and_etag
+            filters: List of patterns to exclude from results
+            search: List of patterns to include in results
+            suffixes: List of key endings to include in results
+            
+        Returns:
+            list: List of object keys matching the criteria
+        """
+        if not self.cache:
+            return self.list_objects(prefix=prefix, filters=filters, search=search, suffixes=suffixes)
+        try:
+            cache_key = ('list', self.bucket, prefix, tuple(filters or ()), tuple(search or ()), tuple(suffixes or ()))
+            entry = self.cache.get(cache_key)
+            if entry and entry.etag == validator_etag:
+                logger.debug(f"Listing of {prefix} served from cache, validator ETag: {validator_etag}")
+                self.cache.record(hit=True)
+                return list(entry.content)
+            
+            keys = self.list_objects(prefix=prefix, filters=filters, search=search, suffixes=suffixes)
+            self.cache.record(hit=False)
+            self.cache.put(cache_key, etag=validator_etag, content=tuple(keys), size=sum(len(key) for key in keys))
+            return keys
+        except Exception as e:
+            logger.error(e)
+            raise e
+
+    def cache_stats(self) -> dict:
+        """
+        Get the hit/miss counters of the object cache, shared by every caching helper of the container.
+        
+        Returns:
+            dict: hits, misses, evictions, entries, size_bytes and max_bytes, empty when the helper does not cache
+        """
+        return self.cache.stats() if self.cache else {}
+
+    def get_object_stream(self, key: str, byte_range: tuple = None):
+        """
+        Get the content of an S3 object as a stream, without reading it into memory.
         
         Args:
             key: S3 object key
+            byte_range: Optional inclusive (first byte, last byte) range to read, last byte None reads to the end
             
         Returns:
-            bytes: Content of the S3 object
+            Binary file-like object with the content of the S3 object, supports read(n)
         """
         try:
-            logger.info(f"Attempting file reading object: {key} in bucket: {self.bucket}")
+            logger.info(f"Attempting file streaming object: {key} in bucket: {self.bucket}, range: {byte_range}")
+            
+            stored = self.backend.get_object(bucket=self.bucket, key=key, byte_range=byte_range)
+            logger.debug(f"Streaming {stored.size} bytes from object {key}, ETag: {stored.etag}")
             
-            s3_response = s3.get_object(Bucket=self.bucket, Key=key)
-            logger.debug(s3_response)
+            return stored.body
+        except Exception as e:
+            logger.error(e)
+            raise e
+
+    def iter_object_chunks(self, key: str, chunk_size: int = READ_CHUNK_SIZE, byte_range: tuple = None) -> Iterator[bytes]:
+        """
+        Read the content of an S3 object in chunks.
+        
+        Args:
+            key: S3 object key
+            chunk_size: Maximum number of bytes per chunk
+            byte_range: Optional inclusive (first byte, last byte) range to read, last byte None reads to the end
             
-            content_stream = s3_response['Body']
-            content = content_stream.read()
-            logger.debug(f"Content from object {key}")
-            logger.debug(content)
+        Yields:
+            bytes: Consecutive chunks of the content
+        """
+        stream = self.get_object_stream(key=key, byte_range=byte_range)
+        try:
+            yield from iter(lambda: stream.read(chunk_size), b"")
+        finally:
+            stream.close()
+
+    def download_fileobj(self, source_object: str, fileobj) -> bool:
+        """
+        Download an S3 object into a writable binary file object, using concurrent ranged GETs for large objects.
+        
+        Args:
+            source_object: S3 object key
+            fileobj: Writable binary file-like object, e.g. an open file or io.BytesIO
             
-            return content
+        Returns:
+            bool: True if the download was successful
+        """
+        try:
+            logger.info(f"Attempting to download object {source_object} from bucket: {self.bucket} to file object")
+            self.backend.download_fileobj(bucket=self.bucket, key=source_object, fileobj=fileobj)
+            return True
         except Exception as e:
             logger.error(e)
             raise e
@@ -139,15 +489,117 @@ class S3:
         """
         try:
             logger.info(f"Attempting copy {source_object} to {destination_object} within bucket: {self.bucket}")
-            copy_source = {'Bucket': self.bucket, 'Key': source_object }
-            
-            response = s3_resource.Object(self.bucket, destination_object).copy(copy_source)
-            logger.debug(response)
+            self.backend.copy_object(bucket=self.bucket, source_key=source_object, destination_key=destination_object, managed=True)
             return True
         except Exception as e:
             logger.error(e)
             raise e
             
+    def copy_objects_bulk(self, pairs: list, workers: int = BULK_WORKERS) -> dict:
+        """
+        Copy many objects within the S3 bucket concurrently.
+        
+        Objects are copied with a single CopyObject request each (objects up to 5 GB) on a bounded
+        thread pool, throttling and transient errors are retried by the client (S3_MAX_ATTEMPTS).
+        
+        Args:
+            pairs: List of (source object key, destination object key) tuples
+            workers: Maximum number of concurrent copies
+            
+        Returns:
+            dict: Result of every source key, {'status': 'copied'} or {'status': 'failed', 'error': message}
+        """
+        logger.info(f"Attempting bulk copy of {len(pairs)} objects within bucket: {self.bucket} with {workers} workers")
+        
+        def copy(pair: tuple) -> dict:
+            source_object, destination_object = pair
+            try:
+                self.backend.copy_object(bucket=self.bucket, source_key=source_object, destination_key=destination_object)
+                return dict(status='copied')
+            except Exception as e:
+                logger.error(f"Unable to copy {source_object} to {destination_object}: {e}")
+                return dict(status='failed', error=str(e))
+        
+        if not pairs:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pairs)))) as pool:
+            results = list(pool.map(copy, pairs))
+        report = {source_object: result for (source_object, _), result in zip(pairs, results)}
+        logger.debug(report)
+        return report
+    
+    def move_objects_bulk(self, pairs: list, workers: int = BULK_WORKERS) -> dict:
+        """
+        Move many objects within the S3 bucket concurrently, copying them in bulk and then deleting
+        the sources that were copied in batches.
+        
+        Args:
+            pairs: List of (source object key, destination object key) tuples
+            workers: Maximum number of concurrent copies
+            
+        Returns:
+            dict: Result of every source key, {'status': 'moved'} or {'status': 'failed', 'error': message}
+        """
+        report = self.copy_objects_bulk(pairs=pairs, workers=workers)
+        copied = [key for key, result in report.items() if result['status'] == 'copied']
+        for key, result in self.delete_objects_bulk(keys=copied, workers=workers).items():
+            report[key] = dict(status='moved') if result['status'] == 'deleted' else result
+        return report
+    
+    def delete_objects_bulk(self, keys: list, workers: int = BULK_WORKERS) -> dict:
+        """
+        Delete many objects from the S3 bucket in DeleteObjects batches of up to 1000 keys.
+        
+        Batches are sent concurrently. A failed request was already retried by the client (S3_MAX_ATTEMPTS)
+        and fails its keys, keys reported in the Errors of a batch with a throttling or transient error
+        code are retried with backoff, up to BULK_ATTEMPTS times.
+        
+        Args:
+            keys: List of S3 object keys to delete
+            workers: Maximum number of concurrent DeleteObjects requests
+            
+        Returns:
+            dict: Result of every key, {'status': 'deleted'} or {'status': 'failed', 'error': message}
+        """
+        logger.info(f"Attempting bulk delete of {len(keys)} objects from bucket: {self.bucket}")
+        
+        def delete_batch(batch: list) -> dict:
+            report = {}
+            pending = batch
+            for attempt in range(BULK_ATTEMPTS):
+                last_attempt = attempt == BULK_ATTEMPTS - 1
+                try:
+                    batch_errors = self.backend.delete_objects(bucket=self.bucket, keys=pending)
+                except Exception as e:
+                    report.update({key: dict(status='failed', error=str(e)) for key in pending})
+                    return report
+                # Only the keys that could not be deleted are reported
+                errors = {error['Key']: error for error in batch_errors}
+                report.update({key: dict(status='deleted') for key in pending if key not in errors})
+                pending = []
+                for key, error in errors.items():
+                    if error.get('Code') in RETRYABLE_ERRORS and not last_attempt:
+                        pending.append(key)
+                    else:
+                        report[key] = dict(status='failed', error=f"{error.get('Code')}: {error.get('Message')}")
+                if not pending:
+                    break
+                logger.warning(f"Retrying delete of {len(pending)} objects")
+                backoff(attempt)
+            return report
+        
+        keys = list(dict.fromkeys(keys))
+        batches = [keys[idx:idx + DELETE_BATCH_SIZE] for idx in range(0, len(keys), DELETE_BATCH_SIZE)]
+        report = {}
+        if batches:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as pool:
+                for batch_report in pool.map(delete_batch, batches):
+                    report.update(batch_report)
+        failed = [key for key, result in report.items() if result['status'] == 'failed']
+        if failed:
+            logger.error(f"Unable to delete {len(failed)} objects: {failed}")
+        return report
+    
     def copy_objects(self, source_prefix: str, destination_prefix: str, filters: list = None, search: list = None) -> bool:
         """
         Copy multiple objects with the same prefix to a new location.
@@ -165,10 +617,11 @@ class S3:
             logger.info(f"Attempting copy objects from {source_prefix} to {destination_prefix} within bucket: {self.bucket} and filter: {filters}")            
             source_objects = self.list_objects(prefix=source_prefix, filters=filters, search=search)
             logger.debug(source_objects)
-            for source_object in source_objects:                
-                file_name = os.path.basename(source_object)
-                destination_object = f"{destination_prefix.rstrip('/')}/{file_name}"                
-                self.copy_object(source_object=source_object, destination_object=destination_object)
+            pairs = [(source_object, f"{destination_prefix.rstrip('/')}/{os.path.basename(source_object)}") for source_object in source_objects]
+            report = self.copy_objects_bulk(pairs=pairs)
+            failed = [key for key, result in report.items() if result['status'] == 'failed']
+            if failed:
+                raise Exception(f"Unable to copy {len(failed)} objects: {failed}")
             return True
         except Exception as e:
             logger.error(e)
@@ -189,7 +642,7 @@ class S3:
             logger.info(f"Attempting move object {source_object} to {destination_object} within bucket: {self.bucket}")
             if self.copy_object(source_object=source_object, destination_object=destination_object):
                 logger.info(f"Attempting move delete source object {source_object} in bucket: {self.bucket}")
-                response = s3.delete_object(Bucket=self.bucket,Key=source_object)
+                response = self.backend.delete_object(bucket=self.bucket, key=source_object)
                 
                 logger.debug(response)
                 return response
@@ -214,11 +667,11 @@ class S3:
             logger.info(f"Attempting move objects from {source_prefix} to {destination_prefix} within bucket: {self.bucket} and filter: {filters}")            
             source_objects = self.list_objects(prefix=source_prefix, filters=filters, search=search)
             logger.debug(source_objects)
-            for source_object in source_objects:                
-                file_name = os.path.basename(source_object)
-                destination_object = f"{destination_prefix.rstrip('/')}/{file_name}"                
-                self.move_object(source_object=source_object, destination_object=destination_object)
-                
+            pairs = [(source_object, f"{destination_prefix.rstrip('/')}/{os.path.basename(source_object)}") for source_object in source_objects]
+            report = self.move_objects_bulk(pairs=pairs)
+            failed = [key for key, result in report.items() if result['status'] == 'failed']
+            if failed:
+                raise Exception(f"Unable to move {len(failed)} objects: {failed}")
             return True
         except Exception as e:
             logger.error(e)
@@ -226,23 +679,19 @@ class S3:
     
     def delete_objects(self, objects: list) -> dict:
         """
-        Delete multiple objects from the S3 bucket.
+        Delete multiple objects from the S3 bucket, in batches of up to 1000 keys.
         
         Args:
             objects: List of S3 object keys to delete
             
         Returns:
-            dict: Response from the delete operation
+            dict: Deleted keys and Errors, in the shape of a DeleteObjects response
         """
         try:
             logger.info(f"Attempting to delete {len(objects)} objects from bucket: {self.bucket}")
-            delete_us = dict(Objects=[])
-            
-            for item in objects:
-                delete_us['Objects'].append(dict(Key=item))
-            
-            logger.debug(delete_us)
-            response = s3.delete_objects(Bucket=self.bucket, Delete=delete_us)
+            report = self.delete_objects_bulk(keys=objects)
+            response = dict(Deleted=[dict(Key=key) for key, result in report.items() if result['status'] == 'deleted'],
+                            Errors=[dict(Key=key, Message=result['error']) for key, result in report.items() if result['status'] == 'failed'])
             logger.debug(response)
             
             return response
@@ -264,17 +713,7 @@ class S3:
         try:
             # Get all objects with the given prefix
             objects = self.list_objects(prefix=prefix, filters=filters)
-            logger.info(f"Attempting to delete {len(objects)} objects from bucket: {self.bucket}")
-            
-            delete_us = dict(Objects=[])
-            for item in objects:
-                delete_us['Objects'].append(dict(Key=item))
-            
-            logger.debug(delete_us)
-            response = s3.delete_objects(Bucket=self.bucket, Delete=delete_us)
-            logger.debug(response)
-            
-            return response
+            return self.delete_objects(objects=objects)
         except Exception as e:
             logger.error(e)
             raise e
@@ -293,15 +732,33 @@ class S3:
         """
         try:
             logger.info(f"Attempting to upload file {source_file} to bucket: {self.bucket}, destination: {destination_object}")
-            if ExtraArgs:
-                s3_resource.Bucket(self.bucket).upload_file(source_file, destination_object, ExtraArgs=ExtraArgs)
-            else:    
-                s3_resource.Bucket(self.bucket).upload_file(source_file, destination_object)
+            self.backend.upload_file(source_file=source_file, bucket=self.bucket, key=destination_object, extra_args=ExtraArgs)
             return True
         except Exception as e:
             logger.error(e)
             raise e
     
+    def put_object(self, key: str, body, content_type: str = None) -> str:
+        """
+        Write bytes or text to an object of the S3 bucket.
+        
+        Args:
+            key: S3 object key
+            body: Content of the object, bytes or str (UTF-8 encoded)
+            content_type: Optional Content-Type of the object
+            
+        Returns:
+            str: ETag of the written object
+        """
+        try:
+            logger.info(f"Attempting to write object {key} to bucket: {self.bucket}")
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            return self.backend.put_object(bucket=self.bucket, key=key, body=body, content_type=content_type)
+        except Exception as e:
+            logger.error(e)
+            raise e
+    
     def download_file(self, source_object: str, destination_file: str) -> bool:
         """
         Download a file from the S3 bucket.
@@ -315,7 +772,7 @@ class S3:
         """
         try:
             logger.info(f"Attempting to download file {source_object} from bucket: {self.bucket}, to : {destination_file}")
-            s3_resource.Bucket(self.bucket).download_file(source_object, destination_file)
+            self.backend.download_file(bucket=self.bucket, key=source_object, destination_file=destination_file)
             return True
         except Exception as e:
             logger.error(e)
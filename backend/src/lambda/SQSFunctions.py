@@ -0,0 +1,146 @@
+"""
+SQS Helper Functions
+
+This module provides batched Amazon SQS operations for the Lambda functions of the pipeline:
+
+- Sending messages (SendMessageBatch)
+- Deleting messages (DeleteMessageBatch)
+- Changing the visibility timeout of messages (ChangeMessageVisibilityBatch)
+
+Entries are sent in batches of 10, the SQS maximum, with the batches fanned out over a small
+thread pool. Entries reported in the Failed list of a batch response are retried with backoff
+on their own, the entries of the batch that succeeded are never sent again. Entries failing
+with a sender fault (e.g. an invalid receipt handle) are not retried.
+
+Messages can be sent with a message group ID, on a standard queue SQS then balances the delivery
+of the messages across groups (SQS fair queues), so a group with a large backlog does not hold back
+the messages of the other groups.
+"""
+import boto3
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from typing import Callable
+
+# Maximum number of entries of an SQS batch request
+SQS_BATCH_SIZE = 10
+# Number of batch requests sent concurrently
+SQS_WORKERS = int(os.environ.get('SQS_WORKERS', '4'))
+# Number of attempts of a batch entry before it is reported as failed
+SQS_BATCH_ATTEMPTS = int(os.environ.get('SQS_BATCH_ATTEMPTS', '3'))
+
+sqs = boto3.client('sqs', config=Config(max_pool_connections=max(10, SQS_WORKERS)))
+logger = logging.getLogger(__name__)
+
+def backoff(attempt: int, base: float = 0.1, cap: float = 2.0):
+    """Sleeps with exponential backoff and full jitter before the next attempt
+    """
+    time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
+def run_batch(operation: Callable, queue_url: str, entries: list, attempts: int = SQS_BATCH_ATTEMPTS) -> list:
+    """
+    Sends one batch request of up to 10 entries, retrying the failed entries only.
+
+    Args:
+        operation: SQS client batch method, e.g. sqs.send_message_batch
+        queue_url: URL of the queue
+        entries: Batch entries with unique Id values
+        attempts: Number of attempts per entry
+
+    Returns:
+        list: Entries that failed on every attempt, with the Code and Message of their last failure
+    """
+    pending = entries
+    failed = []
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        try:
+            response = operation(QueueUrl=queue_url, Entries=pending)
+        except Exception as e:
+            if last_attempt:
+                return failed + [dict(entry, Code=type(e).__name__, Message=str(e)) for entry in pending]
+            logger.warning(f"Retrying SQS batch of {len(pending)} entries after error: {e}")
+            backoff(attempt)
+            continue
+        by_id = {entry['Id']: entry for entry in pending}
+        pending = []
+        for failure in response.get('Failed', []):
+            entry = by_id[failure['Id']]
+            if failure.get('SenderFault') or last_attempt:
+                failed.append(dict(entry, Code=failure.get('Code'), Message=failure.get('Message')))
+            else:
+                pending.append(entry)
+        if not pending:
+            break
+        logger.warning(f"Retrying {len(pending)} failed SQS batch entries")
+        backoff(attempt)
+    return failed
+
+def run_batches(operation: Callable, queue_url: str, entries: list, workers: int = SQS_WORKERS) -> list:
+    """
+    Splits entries in batches of 10 and sends them over a thread pool.
+
+    Returns:
+        list: Entries that could not be processed
+    """
+    batches = [entries[idx:idx + SQS_BATCH_SIZE] for idx in range(0, len(entries), SQS_BATCH_SIZE)]
+    if not batches:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as pool:
+        failed = [entry for batch_failed in pool.map(lambda batch: run_batch(operation, queue_url, batch), batches) for entry in batch_failed]
+    if failed:
+        logger.error(f"{len(failed)} of {len(entries)} SQS batch entries failed: {failed}")
+    return failed
+
+def send_messages(queue_url: str, bodies: list, workers: int = SQS_WORKERS, group_ids: list = None) -> list:
+    """
+    Sends messages to a queue in batches of 10.
+
+    Args:
+        queue_url: URL of the queue
+        bodies: Message bodies
+        workers: Number of batch requests sent concurrently
+        group_ids: Optional message group ID of every message
+
+    Returns:
+        list: Bodies of the messages that could not be sent
+    """
+    entries = [dict(Id=str(idx), MessageBody=body) for idx, body in enumerate(bodies)]
+    if group_ids:
+        for entry, group_id in zip(entries, group_ids):
+            entry['MessageGroupId'] = group_id
+    return [entry['MessageBody'] for entry in run_batches(sqs.send_message_batch, queue_url, entries, workers)]
+
+def delete_messages(queue_url: str, receipt_handles: list, workers: int = SQS_WORKERS) -> list:
+    """
+    Deletes received messages from a queue in batches of 10.
+
+    Args:
+        queue_url: URL of the queue
+        receipt_handles: Receipt handles of the messages
+        workers: Number of batch requests sent concurrently
+
+    Returns:
+        list: Receipt handles of the messages that could not be deleted
+    """
+    entries = [dict(Id=str(idx), ReceiptHandle=handle) for idx, handle in enumerate(receipt_handles)]
+    return [entry['ReceiptHandle'] for entry in run_batches(sqs.delete_message_batch, queue_url, entries, workers)]
+
+def change_message_visibility(queue_url: str, receipt_handles: list, timeouts: list, workers: int = SQS_WORKERS) -> list:
+    """
+    Changes the visibility timeout of received messages in batches of 10.
+
+    Args:
+        queue_url: URL of the queue
+        receipt_handles: Receipt handles of the messages
+        timeouts: Visibility timeout in seconds of every message
+        workers: Number of batch requests sent concurrently
+
+    Returns:
+        list: Receipt handles of the messages whose visibility could not be changed
+    """
+    entries = [dict(Id=str(idx), ReceiptHandle=handle, VisibilityTimeout=timeout) for idx, (handle, timeout) in enumerate(zip(receipt_handles, timeouts))]
+    return [entry['ReceiptHandle'] for entry in run_batches(sqs.change_message_visibility_batch, queue_url, entries, workers)]
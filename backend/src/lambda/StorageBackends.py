@@ -0,0 +1,425 @@
+"""
+Storage Backends
+
+This module provides the storage backends the S3 helper class (S3Functions.S3) sits on:
+
+- S3Backend: Amazon S3 through a boto3 client, used by the deployed Lambda functions
+- LocalBackend: A local directory, every bucket is a sub directory and every key a file
+- MemoryBackend: Objects kept in process memory
+
+The local and in-memory backends make it possible to run the Lambda functions of the pipeline
+offline on a single box, e.g. for repeatable throughput benchmarks without network noise. They
+raise the same botocore ClientError codes as S3 (NoSuchKey, 304 for conditional GETs), so the
+error handling of the Lambda functions is the same for every backend.
+
+The backend is selected with environment variables:
+
+- STORAGE_BACKEND: s3 (default), local or memory
+- STORAGE_ROOT: Directory of the local backend (default /tmp/storage)
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from botocore.exceptions import ClientError
+from typing import Iterator, NamedTuple
+
+# Backend selection, see the module docstring
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 's3').lower()
+STORAGE_ROOT = os.environ.get('STORAGE_ROOT', '/tmp/storage')
+# Size of the pieces read when hashing and copying files
+COPY_CHUNK_SIZE = 1024 * 1024
+
+class StoredObject(NamedTuple):
+    """Content of a stored object as a binary file-like object, with its ETag and size
+    """
+    body: object
+    etag: str
+    size: int
+
+def client_error(code: str, message: str, operation: str) -> ClientError:
+    """Builds the botocore ClientError S3 raises for an error code
+    """
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+def get_etag(content: bytes) -> str:
+    """Quoted MD5 hex digest of a body, the ETag S3 gives single part uploads
+    """
+    return f'"{hashlib.md5(content).hexdigest()}"'
+
+def slice_range(size: int, byte_range: tuple) -> tuple:
+    """Converts an inclusive (first byte, last byte) range, last byte None reads to the end, to a start and stop offset
+    """
+    if not byte_range:
+        return 0, size
+    first_byte, last_byte = byte_range
+    return first_byte, size if last_byte is None else min(last_byte + 1, size)
+
+def page_keys(keys: Iterator[str], page_size: int) -> Iterator[list]:
+    """Groups keys in pages of up to page_size keys
+    """
+    page = []
+    for key in keys:
+        page.append(key)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+def common_prefixes(keys: Iterator[str], prefix: str, start_after: str = None) -> Iterator[str]:
+    """Directory-like prefixes ending with '/' directly under a prefix, like a listing with Delimiter='/'
+    """
+    seen = None
+    for key in keys:
+        rest = key[len(prefix):]
+        if "/" not in rest:
+            continue
+        common_prefix = prefix + rest[:rest.index("/") + 1]
+        if common_prefix != seen and (not start_after or common_prefix > start_after):
+            seen = common_prefix
+            yield common_prefix
+
+class StorageBackend(ABC):
+    """
+    Interface of the storage backends.
+
+    Keys are S3 style object keys, listings are in key order. Missing objects raise a ClientError
+    with the NoSuchKey code. A backend implements every abstract method, an incomplete backend
+    cannot be instantiated.
+    """
+    @abstractmethod
+    def list_pages(self, bucket: str, prefix: str, start_after: str = None, page_size: int = 1000) -> Iterator[list]:
+        """
+        Lists the keys under a prefix, one page at a time.
+
+        Args:
+            bucket: Bucket name
+            prefix: Key prefix
+            start_after: Only list keys after this key
+            page_size: Maximum number of keys per page
+
+        Yields:
+            list: Keys of a page, in key order
+        """
+
+    @abstractmethod
+    def list_common_prefixes(self, bucket: str, prefix: str, start_after: str = None) -> Iterator[str]:
+        """
+        Lists the directory-like prefixes directly under a prefix ending with '/'.
+
+        Yields:
+            str: Prefixes ending with '/', in key order
+        """
+
+    @abstractmethod
+    def get_object(self, bucket: str, key: str, byte_range: tuple = None, if_none_match: str = None) -> StoredObject:
+        """
+        Reads an object.
+
+        Args:
+            bucket: Bucket name
+            key: Object key
+            byte_range: Optional inclusive (first byte, last byte) range, last byte None reads to the end
+            if_none_match: Optional ETag, a ClientError with the 304 code is raised when the object still has it
+
+        Returns:
+            StoredObject: Body stream, ETag and size of the content read
+        """
+
+    @abstractmethod
+    def put_object(self, bucket: str, key: str, body: bytes, content_type: str = None) -> str:
+        """Writes an object and returns its ETag
+        """
+
+    @abstractmethod
+    def copy_object(self, bucket: str, source_key: str, destination_key: str, managed: bool = False):
+        """Copies an object within a bucket, managed copies split large S3 objects in parts
+        """
+
+    @abstractmethod
+    def delete_object(self, bucket: str, key: str):
+        """Deletes an object, missing objects are ignored
+        """
+
+    def delete_objects(self, bucket: str, keys: list) -> list:
+        """
+        Deletes a batch of up to 1000 objects.
+
+        Returns:
+            list: Errors of the keys that could not be deleted, dicts with Key, Code and Message
+        """
+        errors = []
+        for key in keys:
+            try:
+                self.delete_object(bucket=bucket, key=key)
+            except ClientError as e:
+                errors.append(dict(Key=key, Code=e.response['Error']['Code'], Message=e.response['Error']['Message']))
+        return errors
+
+    def upload_file(self, source_file: str, bucket: str, key: str, extra_args: dict = None):
+        """Writes a local file to an object
+        """
+        with open(source_file, 'rb') as f:
+            self.put_object(bucket=bucket, key=key, body=f.read(), content_type=(extra_args or {}).get('ContentType'))
+
+    def download_fileobj(self, bucket: str, key: str, fileobj):
+        """Writes an object to a writable binary file object
+        """
+        with self.get_object(bucket=bucket, key=key).body as body:
+            shutil.copyfileobj(body, fileobj, COPY_CHUNK_SIZE)
+
+    def download_file(self, bucket: str, key: str, destination_file: str):
+        """Writes an object to a local file
+        """
+        with open(destination_file, 'wb') as f:
+            self.download_fileobj(bucket=bucket, key=key, fileobj=f)
+
+class S3Backend(StorageBackend):
+    """
+    Amazon S3 backend on a boto3 client, large transfers use the managed transfer configuration.
+    """
+    def __init__(self, client, transfer_config=None):
+        """
+        Args:
+            client: boto3 S3 client
+            transfer_config: boto3 TransferConfig of managed uploads, downloads and copies
+        """
+        self.client = client
+        self.transfer_config = transfer_config
+
+    def list_pages(self, bucket: str, prefix: str, start_after: str = None, page_size: int = 1000) -> Iterator[list]:
+        params = dict(Bucket=bucket, Prefix=prefix, PaginationConfig={'PageSize': page_size})
+        if start_after:
+            params['StartAfter'] = start_after
+        for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+            yield [obj['Key'] for obj in page.get('Contents', [])]
+
+    def list_common_prefixes(self, bucket: str, prefix: str, start_after: str = None) -> Iterator[str]:
+        params = dict(Bucket=bucket, Delimiter="/", Prefix=prefix)
+        if start_after:
+            params['StartAfter'] = start_after
+        for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+            for obj in page.get('CommonPrefixes', []):
+                yield obj['Prefix']
+
+    def get_object(self, bucket: str, key: str, byte_range: tuple = None, if_none_match: str = None) -> StoredObject:
+        params = dict(Bucket=bucket, Key=key)
+        if byte_range:
+            first_byte, last_byte = byte_range
+            params['Range'] = f"bytes={first_byte}-{'' if last_byte is None else last_byte}"
+        if if_none_match:
+            params['IfNoneMatch'] = if_none_match
+        response = self.client.get_object(**params)
+        return StoredObject(body=response['Body'], etag=response.get('ETag'), size=response['ContentLength'])
+
+    def put_object(self, bucket: str, key: str, body: bytes, content_type: str = None) -> str:
+        params = dict(Bucket=bucket, Key=key, Body=body)
+        if content_type:
+            params['ContentType'] = content_type
+        return self.client.put_object(**params).get('ETag')
+
+    def copy_object(self, bucket: str, source_key: str, destination_key: str, managed: bool = False):
+        copy_source = {'Bucket': bucket, 'Key': source_key}
+        if managed:
+            self.client.copy(copy_source, bucket, destination_key, Config=self.transfer_config)
+        else:
+            self.client.copy_object(Bucket=bucket, Key=destination_key, CopySource=copy_source)
+
+    def delete_object(self, bucket: str, key: str):
+        return self.client.delete_object(Bucket=bucket, Key=key)
+
+    def delete_objects(self, bucket: str, keys: list) -> list:
+        response = self.client.delete_objects(Bucket=bucket, Delete=dict(Objects=[dict(Key=key) for key in keys], Quiet=True))
+        return response.get('Errors', [])
+
+    def upload_file(self, source_file: str, bucket: str, key: str, extra_args: dict = None):
+        self.client.upload_file(source_file, bucket, key, ExtraArgs=extra_args, Config=self.transfer_config)
+
+    def download_fileobj(self, bucket: str, key: str, fileobj):
+        self.client.download_fileobj(bucket, key, fileobj, Config=self.transfer_config)
+
+    def download_file(self, bucket: str, key: str, destination_file: str):
+        self.client.download_file(bucket, key, destination_file, Config=self.transfer_config)
+
+class LocalBackend(StorageBackend):
+    """
+    Local directory backend: bucket names are sub directories of the root directory and keys are
+    file paths below them. Writes go to a temporary file renamed into place, so concurrent readers
+    never see partial objects.
+    """
+    def __init__(self, root: str = STORAGE_ROOT):
+        """
+        Args:
+            root: Root directory of the buckets, created when missing
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def _iter_keys(self, bucket: str, prefix: str) -> Iterator[str]:
+        """Keys of the files under a prefix in key order, only walking the directory the prefix is in
+        """
+        bucket_dir = os.path.join(self.root, bucket)
+        directory = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        start = os.path.join(bucket_dir, *directory.split("/")) if directory else bucket_dir
+        if not os.path.isdir(start):
+            return iter(())
+        keys = []
+        for dirpath, _, filenames in os.walk(start):
+            relative = os.path.relpath(dirpath, bucket_dir).replace(os.sep, "/")
+            for filename in filenames:
+                if filename.startswith(".tmp-"):
+                    continue
+                key = filename if relative == "." else f"{relative}/{filename}"
+                if key.startswith(prefix):
+                    keys.append(key)
+        return iter(sorted(keys))
+
+    def list_pages(self, bucket: str, prefix: str, start_after: str = None, page_size: int = 1000) -> Iterator[list]:
+        keys = (key for key in self._iter_keys(bucket, prefix) if not start_after or key > start_after)
+        yield from page_keys(keys, page_size)
+
+    def list_common_prefixes(self, bucket: str, prefix: str, start_after: str = None) -> Iterator[str]:
+        yield from common_prefixes(self._iter_keys(bucket, prefix), prefix, start_after)
+
+    def _etag(self, path: str) -> str:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b""):
+                md5.update(chunk)
+        return f'"{md5.hexdigest()}"'
+
+    def get_object(self, bucket: str, key: str, byte_range: tuple = None, if_none_match: str = None) -> StoredObject:
+        path = self._path(bucket, key)
+        if not os.path.isfile(path):
+            raise client_error('NoSuchKey', f"The specified key does not exist: {key}", 'GetObject')
+        etag = self._etag(path)
+        if if_none_match and if_none_match == etag:
+            raise client_error('304', 'Not Modified', 'GetObject')
+        if not byte_range:
+            return StoredObject(body=open(path, 'rb'), etag=etag, size=os.path.getsize(path))
+        start, stop = slice_range(os.path.getsize(path), byte_range)
+        with open(path, 'rb') as f:
+            f.seek(start)
+            content = f.read(max(0, stop - start))
+        return StoredObject(body=io.BytesIO(content), etag=etag, size=len(content))
+
+    def _write(self, path: str, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def put_object(self, bucket: str, key: str, body: bytes, content_type: str = None) -> str:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self._write(self._path(bucket, key), lambda f: f.write(body))
+        return get_etag(body)
+
+    def copy_object(self, bucket: str, source_key: str, destination_key: str, managed: bool = False):
+        source = self._path(bucket, source_key)
+        if not os.path.isfile(source):
+            raise client_error('NoSuchKey', f"The specified key does not exist: {source_key}", 'CopyObject')
+        def write(f):
+            with open(source, 'rb') as src:
+                shutil.copyfileobj(src, f, COPY_CHUNK_SIZE)
+        self._write(self._path(bucket, destination_key), write)
+
+    def delete_object(self, bucket: str, key: str):
+        path = self._path(bucket, key)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def upload_file(self, source_file: str, bucket: str, key: str, extra_args: dict = None):
+        def write(f):
+            with open(source_file, 'rb') as src:
+                shutil.copyfileobj(src, f, COPY_CHUNK_SIZE)
+        self._write(self._path(bucket, key), write)
+
+class MemoryBackend(StorageBackend):
+    """
+    In-memory backend, objects live as long as the process. Thread safe, object bodies are
+    immutable bytes shared with the readers.
+    """
+    def __init__(self):
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def _objects(self, bucket: str) -> dict:
+        return self.buckets.setdefault(bucket, {})
+
+    def _sorted_keys(self, bucket: str, prefix: str) -> list:
+        with self._lock:
+            return sorted(key for key in self._objects(bucket) if key.startswith(prefix))
+
+    def list_pages(self, bucket: str, prefix: str, start_after: str = None, page_size: int = 1000) -> Iterator[list]:
+        keys = (key for key in self._sorted_keys(bucket, prefix) if not start_after or key > start_after)
+        yield from page_keys(keys, page_size)
+
+    def list_common_prefixes(self, bucket: str, prefix: str, start_after: str = None) -> Iterator[str]:
+        yield from common_prefixes(self._sorted_keys(bucket, prefix), prefix, start_after)
+
+    def _get(self, bucket: str, key: str, operation: str) -> tuple:
+        with self._lock:
+            stored = self._objects(bucket).get(key)
+        if stored is None:
+            raise client_error('NoSuchKey', f"The specified key does not exist: {key}", operation)
+        return stored
+
+    def get_object(self, bucket: str, key: str, byte_range: tuple = None, if_none_match: str = None) -> StoredObject:
+        content, etag = self._get(bucket, key, 'GetObject')
+        if if_none_match and if_none_match == etag:
+            raise client_error('304', 'Not Modified', 'GetObject')
+        start, stop = slice_range(len(content), byte_range)
+        content = content[start:stop] if byte_range else content
+        return StoredObject(body=io.BytesIO(content), etag=etag, size=len(content))
+
+    def put_object(self, bucket: str, key: str, body: bytes, content_type: str = None) -> str:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        content = bytes(body)
+        etag = get_etag(content)
+        with self._lock:
+            self._objects(bucket)[key] = (content, etag)
+        return etag
+
+    def copy_object(self, bucket: str, source_key: str, destination_key: str, managed: bool = False):
+        stored = self._get(bucket, source_key, 'CopyObject')
+        with self._lock:
+            self._objects(bucket)[destination_key] = stored
+
+    def delete_object(self, bucket: str, key: str):
+        with self._lock:
+            self._objects(bucket).pop(key, None)
+
+def get_storage_backend(name: str = STORAGE_BACKEND, client=None, transfer_config=None) -> StorageBackend:
+    """
+    Builds the storage backend selected by name.
+
+    Args:
+        name: s3, local or memory
+        client: boto3 S3 client of the s3 backend
+        transfer_config: boto3 TransferConfig of the s3 backend
+
+    Returns:
+        StorageBackend: Backend instance
+    """
+    if name == 's3':
+        return S3Backend(client=client, transfer_config=transfer_config)
+    if name == 'local':
+        return LocalBackend(root=STORAGE_ROOT)
+    if name == 'memory':
+        return MemoryBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
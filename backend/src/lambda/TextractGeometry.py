@@ -0,0 +1,316 @@
+"""
+Textract Geometry Helpers
+
+This module handles the text geometry the redaction needs from Amazon Textract output:
+
+- Streaming the Blocks array of a Textract JSON one block at a time
+- Keeping only the LINE/WORD text, page number and BoundingBox of each block
+- Writing and reading the compact binary geometry sidecar (<document_name>.geometry)
+
+Textract output JSON files carry every KEY_VALUE_SET, TABLE and CELL block with their
+relationships and polygons, the reader only materializes compact TextBlock records.
+
+The geometry sidecar is written by the textract-output Lambda. It holds fixed-width LINE and
+WORD records sorted by page with a page index, so the records of a page range are a contiguous
+byte range of the file:
+
+    header          GEOMETRY_HEADER (magic, version, page count, line count, word count, text size)
+    line index      page count + 1 uint32, first LINE record of every page
+    word index      page count + 1 uint32, first WORD record of every page
+    line records    GEOMETRY_RECORD per LINE
+    word records    GEOMETRY_RECORD per WORD
+    text            UTF-8 text of the records, in record order
+"""
+import codecs
+import json
+import logging
+import struct
+import numpy as np
+from typing import Iterator, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Size of the pieces read from the Textract JSON stream
+READ_CHUNK_SIZE = 1024 * 1024
+
+GEOMETRY_MAGIC = b"TXTGEOM\x00"
+GEOMETRY_VERSION = 1
+# magic, version, page count, line count, word count, text size
+GEOMETRY_HEADER = struct.Struct("<8sIIIII")
+# page, left, top, width, height, begin, end, text offset, text length
+GEOMETRY_RECORD = struct.Struct("<IffffiiII")
+# NumPy view of the GEOMETRY_RECORD records of a sidecar
+RECORD_DTYPE = np.dtype([('page', '<u4'), ('left', '<f4'), ('top', '<f4'), ('width', '<f4'), ('height', '<f4'),
+                         ('begin', '<i4'), ('end', '<i4'), ('text_offset', '<u4'), ('text_length', '<u4')])
+# Records built from Textract JSON blocks, keeping the double precision of the JSON coordinates
+BLOCK_DTYPE = np.dtype([('page', '<u4'), ('left', '<f8'), ('top', '<f8'), ('width', '<f8'), ('height', '<f8'),
+                        ('begin', '<i4'), ('end', '<i4')])
+
+class TextBlock(NamedTuple):
+    """Text and normalized BoundingBox of a Textract LINE or WORD block
+    """
+    block_type: str
+    page_number: int
+    text: str
+    left: float
+    top: float
+    width: float
+    height: float
+    begin: int = -1     # character range of the block in the plain text sent to Comprehend Medical,
+    end: int = -1       # -1 when unknown
+
+class TextRecords(NamedTuple):
+    """Array backed LINE or WORD records: a structured array with page, left, top, width, height,
+    begin and end fields plus the text of every record (None when the text was not decoded)
+    """
+    records: np.ndarray
+    texts: list = None
+
+class JsonStreamReader:
+    """
+    Incremental reader of a JSON document from a binary stream.
+
+    Values are decoded with the C accelerated json decoder one at a time while the stream is
+    read in chunks, so memory holds the current chunk and the value being decoded.
+    """
+    def __init__(self, stream, chunk_size: int = READ_CHUNK_SIZE):
+        """
+        Args:
+            stream: Binary file-like object, e.g. a file or the Body of an S3 get_object response
+            chunk_size: Number of bytes read from the stream at a time
+        """
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def _fill(self):
+        """Reads the next chunk of the stream into the buffer, dropping the consumed part
+        """
+        data = self.stream.read(self.chunk_size)
+        self.eof = not data
+        self.buffer = self.buffer[self.pos:] + self._text_decoder.decode(data or b"", final=self.eof)
+        self.pos = 0
+
+    def peek(self) -> str:
+        """Returns the next non whitespace character without consuming it
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError("Unexpected end of JSON stream")
+            self._fill()
+
+    def expect(self, char: str):
+        """Consumes the next non whitespace character, which must be char
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' in JSON stream, found '{found}'")
+        self.pos += 1
+
+    def decode_value(self):
+        """Decodes the next JSON value, reading more of the stream until the value is complete
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def iter_array(self, key: str) -> Iterator:
+        """
+        Generator over the items of the array stored under a key of the top level JSON object.
+        Reading stops at the end of that array.
+
+        Args:
+            key: Key of the array in the top level object
+
+        Yields:
+            Decoded items of the array
+        """
+        self.expect("{")
+        while True:
+            char = self.peek()
+            if char == "}":
+                return
+            if char == ",":
+                self.pos += 1
+                continue
+            name = self.decode_value()
+            self.expect(":")
+            if name != key:
+                self.decode_value()
+                continue
+            self.expect("[")
+            while True:
+                char = self.peek()
+                if char == "]":
+                    self.pos += 1
+                    return
+                if char == ",":
+                    self.pos += 1
+                    continue
+                yield self.decode_value()
+
+def to_text_block(block: dict) -> TextBlock:
+    """Builds the compact TextBlock of a Textract LINE or WORD block
+    """
+    bounding_box = block['Geometry']['BoundingBox']
+    return TextBlock(block_type=block['BlockType'],
+                     page_number=block.get('Page', 1),
+                     text=block.get('Text', ''),
+                     left=bounding_box['Left'],
+                     top=bounding_box['Top'],
+                     width=bounding_box['Width'],
+                     height=bounding_box['Height'])
+
+def read_text_blocks(stream, block_types: tuple = ("LINE", "WORD"), chunk_size: int = READ_CHUNK_SIZE) -> list[TextBlock]:
+    """
+    Streams the Blocks of a Textract output JSON and keeps the text geometry of the requested block types.
+
+    Args:
+        stream: Binary file-like object with the Textract JSON
+        block_types: Textract BlockType values to keep (default: LINE and WORD)
+        chunk_size: Number of bytes read from the stream at a time
+
+    Returns:
+        list: TextBlock of every kept block, in Textract order
+    """
+    reader = JsonStreamReader(stream=stream, chunk_size=chunk_size)
+    text_blocks = [to_text_block(block) for block in reader.iter_array("Blocks") if block.get('BlockType') in block_types]
+    logger.debug(f"Read {len(text_blocks)} {'/'.join(block_types)} blocks from Textract JSON")
+    return text_blocks
+
+def get_text_blocks(textract_json: dict, block_types: tuple = ("LINE", "WORD")) -> list[TextBlock]:
+    """Keeps the text geometry of the requested block types of an already parsed Textract JSON
+    """
+    return [to_text_block(block) for block in textract_json.get('Blocks', []) if block.get('BlockType') in block_types]
+
+def to_text_records(text_blocks: list[TextBlock]) -> TextRecords:
+    """Converts TextBlock records, e.g. read from a Textract JSON, to array backed records
+    """
+    records = np.array([(block.page_number, block.left, block.top, block.width, block.height, block.begin, block.end) for block in text_blocks],
+                       dtype=BLOCK_DTYPE)
+    return TextRecords(records=records, texts=[block.text for block in text_blocks])
+
+def pack_geometry(lines: list[TextBlock], words: list[TextBlock], page_count: int) -> bytes:
+    """
+    Packs LINE and WORD records into the binary geometry sidecar format.
+
+    Args:
+        lines: LINE TextBlock records sorted by page number
+        words: WORD TextBlock records sorted by page number
+        page_count: Number of pages of the document
+
+    Returns:
+        bytes: Content of the geometry sidecar
+    """
+    text_parts = []
+    text_size = 0
+    sections = []
+    for blocks in (lines, words):
+        index = [0] * (page_count + 1)
+        records = bytearray()
+        for block in blocks:
+            text = block.text.encode("utf-8")
+            records += GEOMETRY_RECORD.pack(block.page_number, block.left, block.top, block.width, block.height,
+                                            block.begin, block.end, text_size, len(text))
+            text_parts.append(text)
+            text_size += len(text)
+            index[block.page_number] += 1
+        # running count of the records before every page
+        for page in range(1, page_count + 1):
+            index[page] += index[page - 1]
+        sections.append((index, records))
+
+    header = GEOMETRY_HEADER.pack(GEOMETRY_MAGIC, GEOMETRY_VERSION, page_count, len(lines), len(words), text_size)
+    index_format = f"<{page_count + 1}I"
+    return b"".join([header,
+                     struct.pack(index_format, *sections[0][0]),
+                     struct.pack(index_format, *sections[1][0]),
+                     bytes(sections[0][1]),
+                     bytes(sections[1][1])] + text_parts)
+
+class TextGeometry:
+    """
+    Reader of the binary geometry sidecar written by pack_geometry.
+
+    Only the header and page indexes are decoded up front, records are unpacked on request for
+    the pages asked for.
+    """
+    def __init__(self, data: bytes):
+        """
+        Args:
+            data: Content of the geometry sidecar
+        """
+        magic, version, self.page_count, self.line_count, self.word_count, self.text_size = GEOMETRY_HEADER.unpack_from(data)
+        if magic != GEOMETRY_MAGIC or version != GEOMETRY_VERSION:
+            raise ValueError(f"Unsupported geometry sidecar, magic: {magic}, version: {version}")
+        self.data = memoryview(data)
+        index_format = struct.Struct(f"<{self.page_count + 1}I")
+        offset = GEOMETRY_HEADER.size
+        self.line_index = index_format.unpack_from(data, offset)
+        self.word_index = index_format.unpack_from(data, offset + index_format.size)
+        self.line_offset = offset + 2 * index_format.size
+        self.word_offset = self.line_offset + self.line_count * GEOMETRY_RECORD.size
+        self.text_offset = self.word_offset + self.word_count * GEOMETRY_RECORD.size
+
+    def blocks(self, block_type: str, first_page: int = 1, last_page: int = None) -> list[TextBlock]:
+        """
+        Unpacks the LINE or WORD records of a page range.
+
+        Args:
+            block_type: "LINE" or "WORD"
+            first_page: First 1-based page number (default: 1)
+            last_page: Last 1-based page number, inclusive (default: last page)
+
+        Returns:
+            list: TextBlock records of the page range in document order
+        """
+        records = self._record_bytes(block_type=block_type, first_page=first_page, last_page=last_page)
+        text = self.data[self.text_offset:]
+        return [TextBlock(block_type, page, str(text[text_start:text_start + text_length], "utf-8"), left, top, width, height, begin, end)
+                for page, left, top, width, height, begin, end, text_start, text_length in GEOMETRY_RECORD.iter_unpack(records)]
+
+    def records(self, block_type: str, first_page: int = 1, last_page: int = None, with_text: bool = True) -> TextRecords:
+        """
+        Maps the LINE or WORD records of a page range to a NumPy structured array without copying them.
+
+        Args:
+            block_type: "LINE" or "WORD"
+            first_page: First 1-based page number (default: 1)
+            last_page: Last 1-based page number, inclusive (default: last page)
+            with_text: Decode the text of the records (default: True)
+
+        Returns:
+            TextRecords: Records of the page range in document order
+        """
+        records = np.frombuffer(self._record_bytes(block_type=block_type, first_page=first_page, last_page=last_page), dtype=RECORD_DTYPE)
+        texts = None
+        if with_text:
+            text = self.data[self.text_offset:]
+            texts = [str(text[text_start:text_start + text_length], "utf-8")
+                     for text_start, text_length in zip(records['text_offset'].tolist(), records['text_length'].tolist())]
+        return TextRecords(records=records, texts=texts)
+
+    def _record_bytes(self, block_type: str, first_page: int, last_page: int) -> memoryview:
+        """Returns the bytes of the LINE or WORD records of a page range
+        """
+        index, offset = (self.line_index, self.line_offset) if block_type == "LINE" else (self.word_index, self.word_offset)
+        last_page = min(last_page or self.page_count, self.page_count)
+        first, last = index[first_page - 1], index[last_page]
+        return self.data[offset + first * GEOMETRY_RECORD.size:offset + last * GEOMETRY_RECORD.size]
@@ -0,0 +1,477 @@
+"""
+Textract Submitter
+
+This module submits the documents queued on the PII SQS queue to Amazon Textract. It is shared
+by the extract (state machine) and textract-bulk (SNS notification) Lambda functions:
+
+- StartDocumentAnalysis calls are issued concurrently, under a token bucket rate limit that
+  halves its rate on throttling errors and recovers on successful calls. The token bucket only
+  covers the threads of one Lambda container, the account-wide TEXTRACT_TPS is enforced across
+  containers by a per-second call counter on the PII table
+- An optional concurrent-job budget is kept as a counter on the PII table, a slot is taken
+  before a job is started and given back when its completion notification is counted. The ledger
+  item of the document records that its claim holds a slot, a claim taken over from a stale
+  consumer inherits the slot instead of taking a second one for the same job
+- Throttled calls are retried with exponential backoff and full jitter, messages still throttled
+  or over the job budget go back to the queue with an extended visibility timeout
+- Queue messages are deleted or returned in batches once the whole batch was submitted
+- The messages of all workflows share the queue. The init Lambda queues them with the workflow as
+  message group, so SQS delivers backlogged workflows fairly, and a received batch is submitted in
+  round-robin order across its workflows
+- Every document is submitted at most once: a ledger item per document on the PII table is
+  claimed with a conditional write before the job is started and records its job ID, so
+  redelivered or concurrently received messages of a submitted document are skipped. The job is
+  also started with a ClientRequestToken derived from the document, so Textract returns the same
+  job when a stale claim is taken over after the job was started
+- Documents failing with other errors stay on the queue and are retried, until they were received
+  TEXTRACT_SUBMIT_MAX_RECEIVES times and are recorded as failed on the ledger
+
+The limits are set from environment variables:
+
+- TEXTRACT_TPS: StartDocumentAnalysis calls per second across the account (default 5)
+- TEXTRACT_SHARED_RATE_LIMIT: Enforces TEXTRACT_TPS across Lambda containers on the PII table (default true)
+- TEXTRACT_MAX_CONCURRENT_JOBS: Textract jobs in progress across the account, 0 disables the budget (default 0)
+- TEXTRACT_SUBMIT_WORKERS: Concurrent StartDocumentAnalysis calls (default 4)
+- TEXTRACT_SUBMIT_ATTEMPTS: Attempts per document before it goes back to the queue (default 3)
+- THROTTLED_VISIBILITY_TIMEOUT: Seconds before a throttled message is received again (default 60)
+- TEXTRACT_RECEIVE_VISIBILITY_TIMEOUT: Seconds received messages stay hidden while they are submitted (default 120)
+- TEXTRACT_SUBMIT_MAX_RECEIVES: Receives of a failing document before it is given up (default 5)
+- SUBMISSION_LEASE_SECONDS: Age after which the ledger claim of a crashed consumer can be taken over (default 900)
+"""
+import boto3
+import botocore.exceptions
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from SQSFunctions import sqs, change_message_visibility, delete_messages
+
+# Submission limits, see the module docstring
+TEXTRACT_TPS = float(os.environ.get('TEXTRACT_TPS', '5'))
+TEXTRACT_SHARED_RATE_LIMIT = os.environ.get('TEXTRACT_SHARED_RATE_LIMIT', 'true').lower() == 'true'
+TEXTRACT_MAX_CONCURRENT_JOBS = int(os.environ.get('TEXTRACT_MAX_CONCURRENT_JOBS', '0'))
+TEXTRACT_SUBMIT_WORKERS = int(os.environ.get('TEXTRACT_SUBMIT_WORKERS', '4'))
+TEXTRACT_SUBMIT_ATTEMPTS = int(os.environ.get('TEXTRACT_SUBMIT_ATTEMPTS', '3'))
+THROTTLED_VISIBILITY_TIMEOUT = int(os.environ.get('THROTTLED_VISIBILITY_TIMEOUT', '60'))
+TEXTRACT_RECEIVE_VISIBILITY_TIMEOUT = int(os.environ.get('TEXTRACT_RECEIVE_VISIBILITY_TIMEOUT', '120'))
+TEXTRACT_SUBMIT_MAX_RECEIVES = int(os.environ.get('TEXTRACT_SUBMIT_MAX_RECEIVES', '5'))
+SUBMISSION_LEASE_SECONDS = int(os.environ.get('SUBMISSION_LEASE_SECONDS', '900'))
+# Lowest rate the token bucket slows down to after throttling errors
+MIN_TPS = 0.2
+# Textract error codes of exceeded rate or job quotas
+THROTTLING_ERRORS = {'LimitExceededException', 'ThrottlingException', 'ProvisionedThroughputExceededException'}
+# Item of the PII table counting the Textract jobs in progress
+JOB_BUDGET_KEY = {'part_key': {'S': 'textract-quota'}, 'sort_key': {'S': 'jobs-in-progress'}}
+# Item of the PII table counting the StartDocumentAnalysis calls of the current second
+RATE_WINDOW_KEY = {'part_key': {'S': 'textract-quota'}, 'sort_key': {'S': 'start-rate'}}
+
+# Disable Boto3 retries, throttling is retried by the submitter with its own backoff
+retry_config = Config(
+   retries = {
+      'max_attempts': 0,
+      'mode': 'standard'
+   }
+)
+
+textract = boto3.client('textract', config=retry_config)
+ddb = boto3.client('dynamodb')
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter with an adaptive rate: throttling halves the rate, every
+    successful call adds back a tenth of the configured rate.
+    """
+    def __init__(self, rate: float, min_rate: float = MIN_TPS):
+        """
+        Args:
+            rate: Maximum number of calls per second, also the burst size
+            min_rate: Lowest rate after throttling
+        """
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a call is allowed
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        """Halves the rate after a throttling error
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            logger.warning(f"Textract throttled, submission rate lowered to {self.rate:.2f} TPS")
+
+    def succeeded(self):
+        """Recovers the rate after a successful call
+        """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+# Rate limiter shared by the submissions of the Lambda container, the adapted rate carries over warm invocations
+rate_limiter = TokenBucket(rate=TEXTRACT_TPS)
+
+def is_throttled(error: Exception) -> bool:
+    return isinstance(error, botocore.exceptions.ClientError) and error.response['Error']['Code'] in THROTTLING_ERRORS
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 8.0):
+    """Sleeps with exponential backoff and full jitter before the next attempt
+    """
+    time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
+def is_condition_failed(error: Exception) -> bool:
+    return isinstance(error, botocore.exceptions.ClientError) and error.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+def acquire_account_rate(table: str, tps: float = TEXTRACT_TPS, enabled: bool = TEXTRACT_SHARED_RATE_LIMIT):
+    """
+    Blocks until a StartDocumentAnalysis call fits in the account-wide rate, shared by every Lambda
+    container through a fixed one-second window counted on the PII table.
+
+    Args:
+        table: PII table name
+        tps: Calls per second across the account
+        enabled: Whether the shared rate limit is enforced
+    """
+    if not enabled:
+        return
+    limit = max(1, int(tps))
+    while True:
+        second = int(time.time())
+        values = {':one': {'N': '1'}, ':second': {'N': str(second)}}
+        try:
+            # Count the call in the current window
+            ddb.update_item(TableName=table,
+                            Key=RATE_WINDOW_KEY,
+                            UpdateExpression="ADD calls :one",
+                            ConditionExpression="window_start = :second AND calls < :limit",
+                            ExpressionAttributeValues=dict(values, **{':limit': {'N': str(limit)}}))
+            return
+        except Exception as e:
+            if not is_condition_failed(e):
+                raise e
+        try:
+            # Start a new window with this call
+            ddb.update_item(TableName=table,
+                            Key=RATE_WINDOW_KEY,
+                            UpdateExpression="SET window_start = :second, calls = :one",
+                            ConditionExpression="attribute_not_exists(window_start) OR window_start < :second",
+                            ExpressionAttributeValues=values)
+            return
+        except Exception as e:
+            if not is_condition_failed(e):
+                raise e
+        # The calls of this second are used up
+        time.sleep(max(0.0, second + 1 - time.time()) + random.uniform(0, 0.05))
+
+def acquire_job_slot(table: str, budget: int = TEXTRACT_MAX_CONCURRENT_JOBS) -> bool:
+    """
+    Takes a slot of the concurrent-job budget, counted on the PII table.
+
+    Returns:
+        bool: True when a slot was taken or the budget is disabled, False when the budget is used up
+    """
+    if budget <= 0:
+        return True
+    try:
+        ddb.update_item(TableName=table,
+                        Key=JOB_BUDGET_KEY,
+                        UpdateExpression="ADD jobs_in_progress :one",
+                        ConditionExpression="attribute_not_exists(jobs_in_progress) OR jobs_in_progress < :budget",
+                        ExpressionAttributeValues={':one': {'N': '1'}, ':budget': {'N': str(budget)}})
+        return True
+    except Exception as e:
+        if is_condition_failed(e):
+            return False
+        raise e
+
+def release_job_slot(table: str, budget: int = TEXTRACT_MAX_CONCURRENT_JOBS):
+    """Gives back a slot of the concurrent-job budget, once the job finished or could not be started
+    """
+    if budget <= 0:
+        return
+    try:
+        ddb.update_item(TableName=table,
+                        Key=JOB_BUDGET_KEY,
+                        UpdateExpression="ADD jobs_in_progress :minus_one",
+                        ConditionExpression="jobs_in_progress > :zero",
+                        ExpressionAttributeValues={':minus_one': {'N': '-1'}, ':zero': {'N': '0'}})
+    except Exception as e:
+        if not is_condition_failed(e):
+            raise e
+
+def get_submission_key(doc: dict) -> dict:
+    """Key of the submission ledger item of a document in the PII table
+    """
+    return {'part_key': {'S': doc['workflow_id']}, 'sort_key': {'S': f"submission/{doc['document_name']}"}}
+
+def get_client_request_token(doc: dict) -> str:
+    """Textract idempotency token of a document, the same token always returns the same job
+    """
+    return hashlib.sha256(f"{doc['workflow_id']}/{doc['document_name']}".encode('utf-8')).hexdigest()
+
+def claim_submission(table: str, doc: dict, claim_id: str) -> dict:
+    """
+    Claims the submission of a document on its ledger item. The claim succeeds when the document
+    was never submitted, its last attempt was released, or the claim of another consumer is older
+    than the lease. A claim taken over from another consumer also takes over its job slot.
+
+    Returns:
+        dict: status claimed with slot_held when the job slot of the previous claim was taken over,
+              duplicate with the job_id of the submitted document, in_progress when another consumer
+              is submitting it, or failed when it was given up
+    """
+    now = int(time.time())
+    try:
+        response = ddb.update_item(TableName=table,
+                                   Key=get_submission_key(doc),
+                                   UpdateExpression="SET submission_status = :submitting, claim_id = :claim_id, claimed_at = :now",
+                                   ConditionExpression="attribute_not_exists(submission_status) OR submission_status = :released OR (submission_status = :submitting AND claimed_at < :stale)",
+                                   ExpressionAttributeValues={':submitting': {'S': 'submitting'},
+                                                              ':released': {'S': 'released'},
+                                                              ':claim_id': {'S': claim_id},
+                                                              ':now': {'N': str(now)},
+                                                              ':stale': {'N': str(now - SUBMISSION_LEASE_SECONDS)}},
+                                   ReturnValues='ALL_OLD')
+        previous = response.get('Attributes', {})
+        slot_held = previous.get('submission_status', {}).get('S') == 'submitting' and previous.get('slot_held', {}).get('BOOL', False)
+        if slot_held:
+            logger.warning(f"Took over the stale submission of {doc['document_name']} of workflow {doc['workflow_id']} with its job slot")
+        return dict(status='claimed', slot_held=slot_held)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise e
+    entry = ddb.get_item(TableName=table, Key=get_submission_key(doc), ConsistentRead=True).get('Item', {})
+    status = entry.get('submission_status', {}).get('S')
+    if status == 'submitted':
+        logger.info(f"Document {doc['document_name']} of workflow {doc['workflow_id']} already submitted as job {entry['job_id']['S']}")
+        return dict(status='duplicate', job_id=entry['job_id']['S'])
+    if status == 'failed':
+        return dict(status='failed', error='Submission given up')
+    return dict(status='in_progress')
+
+def hold_job_slot(table: str, doc: dict, claim_id: str) -> bool:
+    """
+    Records on the ledger item that the claim holds a job slot, before its job is started.
+
+    Returns:
+        bool: False when the claim was taken over meanwhile, the caller gives its slot back
+    """
+    try:
+        ddb.update_item(TableName=table,
+                        Key=get_submission_key(doc),
+                        UpdateExpression="SET slot_held = :true",
+                        ConditionExpression="claim_id = :claim_id",
+                        ExpressionAttributeValues={':true': {'BOOL': True}, ':claim_id': {'S': claim_id}})
+        return True
+    except Exception as e:
+        if is_condition_failed(e):
+            return False
+        raise e
+
+def record_submission(table: str, doc: dict, job_id: str):
+    """Records the Textract job of a claimed document on its ledger item
+    """
+    ddb.update_item(TableName=table,
+                    Key=get_submission_key(doc),
+                    UpdateExpression="SET submission_status = :submitted, job_id = :job_id, submitted_at = :now",
+                    ExpressionAttributeValues={':submitted': {'S': 'submitted'},
+                                               ':job_id': {'S': job_id},
+                                               ':now': {'N': str(int(time.time()))}})
+
+def release_submission(table: str, doc: dict, claim_id: str, error: str = None, final: bool = False):
+    """
+    Releases the claim of a document that was not submitted, so a later delivery can claim it again.
+    A final release records the document as failed and its later deliveries are skipped.
+
+    Returns:
+        bool: False when the claim was taken over by another consumer, together with its job slot
+    """
+    values = {':status': {'S': 'failed' if final else 'released'}, ':claim_id': {'S': claim_id}, ':error': {'S': error or ''}, ':false': {'BOOL': False}}
+    try:
+        ddb.update_item(TableName=table,
+                        Key=get_submission_key(doc),
+                        UpdateExpression="SET submission_status = :status, last_error = :error, slot_held = :false",
+                        ConditionExpression="claim_id = :claim_id",
+                        ExpressionAttributeValues=values)
+        return True
+    except Exception as e:
+        if is_condition_failed(e):
+            return False
+        raise e
+
+def give_up_claim(table: str, doc: dict, claim_id: str, error: str, final: bool = False):
+    """Releases the claim of a document and its job slot, unless another consumer took both over
+    """
+    if release_submission(table=table, doc=doc, claim_id=claim_id, error=error, final=final):
+        release_job_slot(table=table)
+
+def start_document_analysis(doc: dict, env_vars: dict) -> str:
+    """
+    Starts the asynchronous Textract analysis of a queued document.
+
+    Args:
+        doc: Queue message with workflow_id, input_path and document_name
+        env_vars: Environment variables
+
+    Returns:
+        str: Textract job ID
+    """
+    # Start asynchronous Textract document analysis job
+    # - Extract text, forms, and tables from the document
+    # - Configure SNS notification for job completion
+    # - Store results in S3
+    txrct_response = textract.start_document_analysis(
+                            DocumentLocation={
+                                'S3Object': {
+                                    'Bucket': env_vars['INPUT_BKT'],
+                                    'Name': f"public/{doc['input_path']}{doc['document_name']}",
+                                }
+                            },
+                            FeatureTypes=['TABLES','FORMS'],
+                            ClientRequestToken=get_client_request_token(doc),
+                            JobTag=doc['workflow_id'],
+                            NotificationChannel={
+                                'SNSTopicArn': env_vars['SNS_TOPIC'],
+                                'RoleArn': env_vars['SNS_ROLE']
+                            },
+                            OutputConfig={
+                                'S3Bucket': env_vars['INPUT_BKT'],
+                                'S3Prefix': f"public/output/{doc['workflow_id']}"
+                            }
+                        )
+    logger.debug(json.dumps(txrct_response))
+    return txrct_response['JobId']
+
+def submit_document(doc: dict, env_vars: dict, attempts: int = TEXTRACT_SUBMIT_ATTEMPTS, final: bool = False) -> dict:
+    """
+    Starts the Textract job of a document within the rate limit and job budget, retrying throttling
+    errors with backoff. The document is claimed on the submission ledger first, so a document
+    already submitted or being submitted by another consumer is skipped.
+
+    Args:
+        doc: Queue message with workflow_id, input_path and document_name
+        env_vars: Environment variables
+        attempts: Number of attempts on throttling errors
+        final: Whether a failure gives the document up instead of retrying it with a later delivery
+
+    Returns:
+        dict: status submitted with the job_id, duplicate with the job_id of an earlier submission,
+              throttled or in_progress when the document should be received again later, or failed with the error
+    """
+    table = env_vars['PII_TABLE']
+    claim_id = str(uuid.uuid4())
+    claim = claim_submission(table=table, doc=doc, claim_id=claim_id)
+    if claim['status'] != 'claimed':
+        return claim
+    logger.debug(f"Starting Async Textract job for workflow: {doc['workflow_id']}, document: {doc['document_name']}")
+    if not claim['slot_held'] and TEXTRACT_MAX_CONCURRENT_JOBS > 0:
+        if not acquire_job_slot(table=table):
+            logger.info(f"Textract job budget of {TEXTRACT_MAX_CONCURRENT_JOBS} in use, deferring {doc['document_name']}")
+            release_submission(table=table, doc=doc, claim_id=claim_id, error='Job budget in use')
+            return dict(status='throttled')
+        if not hold_job_slot(table=table, doc=doc, claim_id=claim_id):
+            release_job_slot(table=table)
+            return dict(status='in_progress')
+    for attempt in range(attempts):
+        rate_limiter.acquire()
+        acquire_account_rate(table=table)
+        try:
+            job_id = start_document_analysis(doc=doc, env_vars=env_vars)
+            rate_limiter.succeeded()
+            record_submission(table=table, doc=doc, job_id=job_id)
+            return dict(status='submitted', job_id=job_id)
+        except Exception as error:
+            if not is_throttled(error):
+                logger.error(f"Unable to start Textract job for {doc['document_name']}: {error}")
+                give_up_claim(table=table, doc=doc, claim_id=claim_id, error=str(error), final=final)
+                return dict(status='failed', error=str(error))
+            rate_limiter.throttled()
+            if attempt < attempts - 1:
+                backoff(attempt)
+    give_up_claim(table=table, doc=doc, claim_id=claim_id, error='Throttled')
+    return dict(status='throttled')
+
+def defer_messages(queue_url: str, receipt_handles: list, timeout: int = THROTTLED_VISIBILITY_TIMEOUT):
+    """Returns messages to the queue, they are received again after the timeout plus up to 50% jitter
+    """
+    timeouts = [min(43200, int(timeout * random.uniform(1.0, 1.5))) for _ in receipt_handles]
+    change_message_visibility(queue_url=queue_url, receipt_handles=receipt_handles, timeouts=timeouts)
+
+def interleave_workflows(messages: list) -> list:
+    """Orders received messages round-robin across their workflows, keeping the order within a workflow
+    """
+    by_workflow = {}
+    for message in messages:
+        by_workflow.setdefault(message['doc']['workflow_id'], []).append(message)
+    queues = list(by_workflow.values())
+    return [queue[idx] for idx in range(max(map(len, queues), default=0)) for queue in queues if idx < len(queue)]
+
+def get_msg_submit(event, env_vars, num_msgs):
+    """
+    Retrieves messages from SQS and submits Textract jobs for their documents concurrently.
+
+    Args:
+        event: Invocation event
+        env_vars: Environment variables
+        num_msgs: Maximum number of messages to retrieve from SQS
+
+    Returns:
+        list: List of Textract job IDs
+    """
+    try:
+        logger.debug("Getting messages from SQS Queue")
+        # The visibility timeout covers the submission of the whole batch, including throttling backoff
+        sqsresponse = sqs.receive_message(QueueUrl=env_vars['PII_QUEUE'],
+                                          MaxNumberOfMessages=num_msgs,
+                                          VisibilityTimeout=TEXTRACT_RECEIVE_VISIBILITY_TIMEOUT,
+                                          AttributeNames=['ApproximateReceiveCount'],
+                                          WaitTimeSeconds=5)   # Long poll to get as many messages as possible (max 10)
+        logger.debug(json.dumps(sqsresponse))
+
+        messages = [{"doc": json.loads(msg['Body']),
+                     "ReceiptHandle": msg['ReceiptHandle'],
+                     "final": int(msg.get('Attributes', {}).get('ApproximateReceiveCount', '1')) >= TEXTRACT_SUBMIT_MAX_RECEIVES} for msg in sqsresponse.get('Messages', [])]
+        logger.debug(json.dumps(messages))
+        if not messages:
+            return []
+        messages = interleave_workflows(messages)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(TEXTRACT_SUBMIT_WORKERS, len(messages)))) as pool:
+            results = list(pool.map(lambda message: submit_document(doc=message['doc'], env_vars=env_vars, final=message['final']), messages))
+
+        jobs = [result['job_id'] for result in results if result['status'] == 'submitted']
+        # Submitted, duplicate and given up documents are deleted, the others go back to the queue to be retried
+        retry = [result['status'] in ('throttled', 'in_progress') or (result['status'] == 'failed' and not message['final'])
+                 for message, result in zip(messages, results)]
+        deferred = [message['ReceiptHandle'] for message, later in zip(messages, retry) if later]
+        done = [message['ReceiptHandle'] for message, later in zip(messages, retry) if not later]
+        if deferred:
+            defer_messages(queue_url=env_vars['PII_QUEUE'], receipt_handles=deferred)
+        delete_messages(queue_url=env_vars['PII_QUEUE'], receipt_handles=done)
+        logger.debug(f"Textract Analyze document jobs submitted with job ids : {jobs}, and {len(done)} SQS Messages deleted.")
+
+        logger.info(f"Submitted {len(jobs)} of {len(messages)} documents to Textract at {rate_limiter.rate:.2f} TPS")
+        return jobs
+    except Exception as error:
+        raise error
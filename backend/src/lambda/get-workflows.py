@@ -3,6 +3,7 @@ import os
 import json
 import logging
 import decimal
+import itertools
 from S3Functions import S3
 from boto3.dynamodb.types import TypeDeserializer
 
@@ -14,6 +15,8 @@ class DecimalEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, decimal.Decimal):
             return str(o)
+        if isinstance(o, set):
+            return sorted(o)
         return super(DecimalEncoder, self).default(o)
 
 def lambda_handler(event, context):
@@ -36,6 +39,8 @@ def lambda_handler(event, context):
             all_docs = []
             for doc in ddbresponse['Items']:
                 deserialized_document = {k: deserializer.deserialize(v) for k, v in doc.items()}
+                # Job ID set of workflows counted before the completion items, not returned to the UI
+                deserialized_document.pop('completed_jobs', None)
                 all_docs.append(deserialized_document)
 
             payload = {
@@ -55,7 +60,8 @@ def lambda_handler(event, context):
             logger.error(e)
             return event
     else:
-        s3 = S3(bucket=bucket, log_level=log_level)        
+        # The UI polls workflows, the object cache keeps the Manifest and redacted listing across warm invocations
+        s3 = S3(bucket=bucket, log_level=log_level, cache=True)
         stmt = f"SELECT * FROM \"{piiTable}\" WHERE part_key=? AND sort_key=?"
         workflow_id = param['fetch']
         part_key = f"input/{param['fetch']}/"
@@ -69,6 +75,7 @@ def lambda_handler(event, context):
         des_doc['workflow_id'] = des_doc.pop('part_key')
         des_doc.pop('sort_key')
         des_doc.pop('workflow_token')     
+        des_doc.pop('completed_jobs', None)
 
         # if des_doc["retain_orig_docs"]:
         #     documents   = [{"document": k, "doc_path": f"output/{workflow_id}/{v.split(':')[1]}/orig-doc/{k}", "status": v.split(':')[0], "jobid": v.split(':')[1]} for k,v in des_doc['docs'].items()]           
@@ -80,13 +87,28 @@ def lambda_handler(event, context):
         des_doc.pop('docs')   
 
         if des_doc["redaction_status"] == "processed":
-            redacted_docs = s3.list_objects(prefix=f"public/output/{workflow_id}/", search=["/redacted-doc/"])
-            manifest_content = s3.get_object_content(key=f"public/output/{workflow_id}/Manifest")            
+            # Optional paging of the redacted documents: limit caps the number of documents returned and
+            # start_after continues after the redacted_next key of the previous response
+            limit = int(param.get('limit', 0)) or None
+            start_after = param.get('start_after')
+            # The redacted documents of a processed workflow only change when it is processed again, which
+            # rewrites the Manifest, so the Manifest ETag validates the cached listing
+            manifest_content, manifest_etag = s3.get_object_content_and_etag(key=f"public/output/{workflow_id}/Manifest")
+            manifest = json.loads(manifest_content)
+            if limit or start_after:
+                # A page is listed lazily from start_after and the listing stops once the page is full
+                redacted_keys = s3.iter_objects(prefix=f"public/output/{workflow_id}/", search=["/redacted-doc/"], start_after=start_after)
+            else:
+                redacted_keys = s3.list_objects_cached(prefix=f"public/output/{workflow_id}/", validator_etag=manifest_etag, search=["/redacted-doc/"])
+            redacted_docs = list(itertools.islice(redacted_keys, limit))
+            if limit and len(redacted_docs) == limit:
+                des_doc["redacted_next"] = redacted_docs[-1]
+            logger.debug(f"Object cache: {s3.cache_stats()}")
 
             if redacted_docs and len(redacted_docs) >0:   
                 des_doc["redacted_documents"] = [ {"document": os.path.basename(k),"doc_path":k.replace("public/",""), "phi_json": f"{os.path.dirname(k).replace('/redacted-doc','').replace('public/','')}/{os.path.splitext(os.path.basename(k))[0]}.comp-med"} for k in redacted_docs]
-            if manifest_content:
-                des_doc["phi_manifest"] = json.loads(manifest_content)
+            if manifest:
+                des_doc["phi_manifest"] = manifest
 
         logger.debug(json.dumps(des_doc, cls=DecimalEncoder))
 
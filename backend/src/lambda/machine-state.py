@@ -8,24 +8,114 @@ It serves as the entry point for the PII redaction workflow by:
 3. Sending messages to SQS for each document to be processed
 4. Starting the Step Functions state machine to orchestrate the workflow
 
+Documents are queued in chunks, and the number of queued documents is checkpointed on the workflow
+item (enqueue_cursor) after every chunk. When the invocation gets close to its timeout it invokes
+itself to continue from the checkpoint, and a retried invocation resumes from it too. The state
+machine is only started once every document is queued.
+
+All workflows share the SQS queue, the messages of a workflow are sent with the workflow as message
+group so SQS delivers the documents of the workflows fairly, and a large workflow does not hold
+back the small ones queued after it. The optional 11th element of the configuration is the priority
+class of the workflow, a class with a weight of n spreads its messages over n groups and gets n
+times the share of a normal workflow.
+
 The workflow configuration file should be a JSON file with information about the documents
 to be processed and redaction settings.
 """
 import json
 import urllib.parse
 import boto3
+import botocore.exceptions
 import json
 import logging
 import os
+from S3Functions import S3
+from SQSFunctions import send_messages
 
 # Initialize AWS service clients
-s3 = boto3.client('s3')
 ddb = boto3.client('dynamodb')
-sqs = boto3.client('sqs')
 sfn = boto3.client('stepfunctions')
+lambda_client = boto3.client('lambda')
 
 logger = logging.getLogger(__name__)
 
+# Number of documents queued between two checkpoints of the enqueue cursor
+FANOUT_CHUNK_SIZE = int(os.environ.get('FANOUT_CHUNK_SIZE', '1000'))
+# Remaining invocation time below which the fan-out continues in a new invocation
+FANOUT_TIME_MARGIN_MS = int(os.environ.get('FANOUT_TIME_MARGIN_MS', '15000'))
+# Share of the queue deliveries of each workflow priority class, relative to normal
+PRIORITY_WEIGHTS = json.loads(os.environ.get('PRIORITY_WEIGHTS', '{"normal": 1, "high": 4}'))
+DEFAULT_PRIORITY = 'normal'
+
+def get_message_groups(workflow_id: str, priority: str, start: int, count: int) -> list:
+    """
+    Message group IDs of queued documents, the documents of a workflow with a weight of n are
+    spread over n groups.
+
+    Args:
+        workflow_id: Workflow ID
+        priority: Priority class of the workflow
+        start: Index of the first document
+        count: Number of documents
+
+    Returns:
+        list: Message group ID of every document
+    """
+    weight = max(1, int(PRIORITY_WEIGHTS.get(priority, 1)))
+    if weight == 1:
+        return [workflow_id] * count
+    return [f"{workflow_id}-{idx % weight}" for idx in range(start, start + count)]
+
+def register_workflow(table: str, params: list) -> int:
+    """
+    Stores the workflow item with an enqueue cursor of 0. When the item already exists, this
+    invocation resumes the fan-out of the workflow and the stored cursor is returned.
+
+    Args:
+        table: PII table name
+        params: Workflow configuration parameters
+
+    Returns:
+        int: Number of documents of the workflow already queued
+    """
+    stmt = f"INSERT INTO \"{table}\" VALUE {{'part_key' : ?, 'sort_key' : ?, 'status': ?, 'docs': ?, 'submit_ts': ?, 'total_files': ?, 'redact': ?, 'retain_orig_docs': ?, 'redaction_status': ?, 'redact_options': ?, 'priority': ?, 'enqueue_cursor': 0}}"
+    logger.debug(stmt)
+    try:
+        ddresponse = ddb.execute_statement(Statement=stmt, Parameters=params)
+        logger.debug(json.dumps(ddresponse))
+        return 0
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'DuplicateItemException':
+            raise e
+    select = f"SELECT enqueue_cursor FROM \"{table}\" WHERE part_key=? AND sort_key=?"
+    # A strongly consistent read, a stale cursor would queue a checkpointed chunk again
+    item = ddb.execute_statement(Statement=select, Parameters=params[:2], ConsistentRead=True)['Items'][0]
+    # Workflows registered before the enqueue cursor was introduced were queued in full
+    cursor = int(item['enqueue_cursor']['N']) if 'enqueue_cursor' in item else len(params[3]['M'])
+    logger.info(f"Resuming fan-out of workflow {params[0]['S']} after {cursor} queued documents")
+    return cursor
+
+def advance_cursor(table: str, params: list, cursor: int, new_cursor: int) -> bool:
+    """
+    Checkpoints the enqueue cursor of the workflow, if no other invocation moved it meanwhile.
+
+    Returns:
+        bool: False when another invocation of the same workflow already moved the cursor
+    """
+    stmt = f"UPDATE \"{table}\" SET enqueue_cursor=? WHERE part_key=? AND sort_key=? AND enqueue_cursor=?"
+    try:
+        ddb.execute_statement(Statement=stmt, Parameters=[{'N': str(new_cursor)}, params[0], params[1], {'N': str(cursor)}])
+        return True
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise e
+
+def continue_fanout(event, context):
+    """Invokes this function asynchronously with the same event, to continue the fan-out from the checkpoint
+    """
+    lambda_client.invoke(FunctionName=context.invoked_function_arn, InvocationType='Event', Payload=json.dumps(event))
+
 def lambda_handler(event, context):
     """
     Lambda handler function triggered by S3 event when a workflow file is uploaded.
@@ -51,41 +141,55 @@ def lambda_handler(event, context):
     key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
     # root_prefix = event['Records'][0]['s3']['object']['key'].split("/")[0]
     try:
-        response = s3.get_object(Bucket=bucket, Key=key)        
-        content = response['Body']
-        jsonObject = json.loads(content.read())
+        s3 = S3(bucket=bucket, log_level=log_level)
+        jsonObject = json.loads(s3.get_object_content(key=key))
         logger.debug(json.dumps(jsonObject))
 
-        # Store workflow metadata in DynamoDB for tracking
-        stmt = f"INSERT INTO \"{piiTable}\" VALUE {{'part_key' : ?, 'sort_key' : ?, 'status': ?, 'docs': ?, 'submit_ts': ?, 'total_files': ?, 'redact': ?, 'retain_orig_docs': ?, 'redaction_status': ?}}"
-        logger.debug(stmt)
-        ddresponse = ddb.execute_statement(Statement=stmt, Parameters=jsonObject);
-        logger.debug(json.dumps(ddresponse))
+        # Optional 10th element: redaction render resolution and output encoding of the workflow
+        if len(jsonObject) < 10:
+            jsonObject.append({'M': {}})
+        # Optional 11th element: priority class of the workflow on the shared SQS queue
+        if len(jsonObject) < 11:
+            jsonObject.append({'S': DEFAULT_PRIORITY})
+
+        # Store workflow metadata in DynamoDB for tracking, or resume the fan-out of a stored workflow
+        cursor = register_workflow(table=piiTable, params=jsonObject)
 
         # Extract workflow information from the JSON object
         workflow_id=jsonObject[0]['S']  # Unique identifier for this workflow
         input_path=jsonObject[1]['S']   # Path to input documents
         docs=jsonObject[3]['M']         # Dictionary of documents to process
+        priority=jsonObject[10]['S']    # Priority class of the workflow
 
-        # Send a message to SQS for each document to be processed
+        # Send a message to SQS for each document to be processed, in batches of 10
         # These messages will be picked up by the Textract processing Lambda
         logger.debug("Sending messages to SQS")
-        for doc in docs.keys():
-            msg = dict(workflow_id= workflow_id, input_path= input_path, document_name= doc)
-            logger.debug(json.dumps(msg))
-            sqsresponse = sqs.send_message(QueueUrl=sqsUrl, MessageBody=json.dumps(msg))            
-            logger.debug(sqsresponse)
-
-            # Commented out code for creating temporary processing files
-            # logger.debug(f"Creating temp processing file {root_prefix}/temp/{workflow_id}/{doc}.json")
-            # obj = {doc: {"S": "ready"}}
-            # s3.put_object(Body=json.dumps(obj),Bucket=bucket,Key=f'{root_prefix}/temp/{workflow_id}/{doc}.json')
+        documents = list(docs.keys())
+        while cursor < len(documents):
+            if context and context.get_remaining_time_in_millis() < FANOUT_TIME_MARGIN_MS:
+                logger.info(f"Queued {cursor} of {len(documents)} documents, continuing in a new invocation")
+                continue_fanout(event, context)
+                return dict(Success=True, Queued=cursor)
+
+            chunk = documents[cursor:cursor + FANOUT_CHUNK_SIZE]
+            messages = [json.dumps(dict(workflow_id= workflow_id, input_path= input_path, document_name= doc)) for doc in chunk]
+            groups = get_message_groups(workflow_id=workflow_id, priority=priority, start=cursor, count=len(chunk))
+            failed = send_messages(queue_url=sqsUrl, bodies=messages, group_ids=groups)
+            if failed:
+                raise Exception(f"Unable to queue {len(failed)} of {len(messages)} documents: {failed}")
+            # A chunk is queued again if the invocation fails before its checkpoint
+            if not advance_cursor(table=piiTable, params=jsonObject, cursor=cursor, new_cursor=cursor + len(chunk)):
+                logger.info(f"Fan-out of workflow {workflow_id} continued by another invocation")
+                return dict(Success=True, Queued=cursor)
+            cursor += len(chunk)
+            logger.debug(f"Queued {cursor} of {len(documents)} documents")
             
         # Prepare payload for Step Functions state machine
         sfnPayload = dict(workflow_id=workflow_id, bucket=bucket)
         
         # Start Step Functions state machine to orchestrate the workflow
         # This will coordinate the document processing, PII detection, and redaction
+        # The execution name is the workflow, starting it again with the same input returns the same execution
         logger.debug("Starting Step function state machine")
         logger.debug(sfnPayload)
         sfnResponse = sfn.start_execution(
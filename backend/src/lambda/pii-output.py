@@ -2,6 +2,7 @@ import os
 import json
 import boto3
 import logging
+from decimal import Decimal
 from S3Functions import S3
 from boto3.dynamodb.types import TypeDeserializer
 
@@ -72,6 +73,7 @@ def lambda_handler(event, context):
 
         logger.info("Copying PHI entity outputs and original documents to workflow output prefix")
         file_list = s3.list_objects(prefix=phi_output_dir, filters=["ComprehendMedicalS3WriteTestFile", "Manifest"])        
+        moves = []
         for file in file_list:
             fragments = file.split('/')[-2:]
             phi_output = os.path.basename(file).split('.')[0]+".comp-med"
@@ -84,16 +86,22 @@ def lambda_handler(event, context):
             document_name = os.path.basename(file).replace('.txt.out','')
             workflow_output = f"public/output/{workflow_id}/{fragments[0]}"  
             # Move the PHI Output file       
-            s3.move_object(source_object=file, destination_object=f"{workflow_output}/{phi_output}")
+            moves.append((file, f"{workflow_output}/{phi_output}"))
             #Move the original document
-            s3.move_object(source_object=f"public/input/{workflow_id}/{document_name}", destination_object=f"{workflow_output}/orig-doc/{document_name}")
+            moves.append((f"public/input/{workflow_id}/{document_name}", f"{workflow_output}/orig-doc/{document_name}"))
+
+        # Move all the files concurrently
+        report = s3.move_objects_bulk(pairs=moves)
+        failed = {key: result['error'] for key, result in report.items() if result['status'] == 'failed'}
+        if failed:
+            raise Exception(f"Unable to move {len(failed)} of {len(moves)} files: {failed}")
 
         logger.info("Copying PHI entity Manifest file to target workflow prefix")
-        manifest_file = s3.list_objects(prefix=phi_output_dir, filters=["/failed/","/success/"], search=["Manifest"])[0]
+        manifest_file = next(s3.iter_objects(prefix=phi_output_dir, filters=["/failed/","/success/"], search=["Manifest"]))
         s3.move_object(source_object=manifest_file, destination_object=f"public/output/{workflow_id}/Manifest")
                 
-        logger.debug(f"Getting retain_orig_docs status from database")
-        stmt = f"SELECT \"retain_orig_docs\" FROM \"{env_vars['PII_TABLE']}\" WHERE part_key=? AND sort_key=?"
+        logger.debug(f"Getting retain_orig_docs status and redact_options from database")
+        stmt = f"SELECT \"retain_orig_docs\", \"redact_options\" FROM \"{env_vars['PII_TABLE']}\" WHERE part_key=? AND sort_key=?"
         logger.debug(stmt)
         ddb_response = ddb.execute_statement(Statement=stmt, Parameters=[
                                                             {'S': workflow_id},
@@ -104,11 +112,14 @@ def lambda_handler(event, context):
         logger.debug(deserialized_document)
         retain_docs = deserialized_document['retain_orig_docs']
         logger.debug(retain_docs)
+        # DynamoDB numbers deserialize to Decimal which is not JSON serializable in the Lambda output
+        redact_options = {k: int(v) if isinstance(v, Decimal) else v for k, v in deserialized_document.get('redact_options', {}).items()}
+        logger.debug(redact_options)
                 
         map_list = gen_list_for_map(documents=documents)
         logger.debug(map_list)
         if map_list:
-            return dict(workflow_id=workflow_id, input_prefix= f"input/{workflow_id}/",bucket=bucket, retain_docs=retain_docs, doc_list=map_list)
+            return dict(workflow_id=workflow_id, input_prefix= f"input/{workflow_id}/",bucket=bucket, retain_docs=retain_docs, redact_options=redact_options, doc_list=map_list)
         else:
             update_error_state(env_vars=env_vars,event=event)
             return dict(error="Error occured while copying PHI output file. map_list is None")
@@ -6,10 +6,28 @@ from S3Functions import S3
 
 logger = logging.getLogger(__name__)
 
-def get_key(pattern: str, files: list) -> str:
+# Suffixes of the redaction inputs stored next to the orig-doc/ prefix of a document
+INPUT_SUFFIXES = [".comp-med", ".json", ".geometry"]
+
+def get_key(pattern: str, files: list, required: bool = True) -> str:
     val = [x for x in files if pattern in x]
+    if not val and not required:
+        return None
     return val[0]
 
+def list_redaction_inputs(s3: S3, prefix: str) -> list:
+    """
+    Lists the redaction inputs of a document: the original document, the Comprehend Medical output,
+    the geometry sidecar and the Textract JSON. Listing stops as soon as the original document, the
+    Comprehend Medical output and the geometry sidecar are found.
+    """
+    files = []
+    for key in s3.iter_objects(prefix=prefix, search=INPUT_SUFFIXES + ["/orig-doc/"]):
+        files.append(key)
+        if all(get_key(pattern=pattern, files=files, required=False) for pattern in ['/orig-doc/', '.comp-med', '.geometry']):
+            break
+    return files
+
 def lambda_handler(event, context):
     log_level = os.environ.get('LOG_LEVEL', 'INFO')    
     logger.setLevel(log_level)
@@ -25,12 +43,20 @@ def lambda_handler(event, context):
     for prefix in doc_prefixes:
         try:
             # Get the Comprehend Medical output and Textract JSON output path
-            files = s3.list_objects(prefix=prefix, search=[".comp-med", ".json", "/orig-doc/"]) 
-            process_dict = dict(comp_med=get_key(pattern='.comp-med',files=files), txtract=get_key(pattern='.json',files=files), doc=get_key(pattern='/orig-doc/',files=files))            
+            files = list_redaction_inputs(s3=s3, prefix=prefix)
+            process_dict = dict(comp_med=get_key(pattern='.comp-med',files=files), doc=get_key(pattern='/orig-doc/',files=files))            
+
+            # Geometry sidecar with the LINE/WORD boxes and text offsets, the redaction reads it instead of the
+            # Textract JSON. Workflows processed before it was introduced only have the Textract JSON
+            geometry = get_key(pattern='.geometry', files=files, required=False)
+            if geometry:
+                process_dict['geometry'] = geometry
+            else:
+                process_dict['txtract'] = get_key(pattern='.json', files=files)
 
             redact_data.append(process_dict)
         except Exception as e:
             logger.error("Error occured...")
             logger.error(e)
 
-    return dict(workflow_id=workflow_id, bucket=bucket, retain_docs=retain_docs, redact_data=redact_data)
+    return dict(workflow_id=workflow_id, bucket=bucket, retain_docs=retain_docs, redact_options=event.get("redact_options", {}), redact_data=redact_data)
@@ -6,24 +6,34 @@ using the results from Amazon Comprehend Medical and Amazon Textract. The functi
 
 1. Loads Textract JSON (document layout) and Comprehend Medical JSON (PHI entities)
 2. Downloads the original document from S3
-3. Converts the document to images (for PDF, JPEG, PNG, or TIFF files)
-4. Identifies text bounding boxes that contain PHI entities
-5. Draws black rectangles over those bounding boxes to redact the PHI
-6. Saves the redacted document and uploads it to S3
+3. Identifies text bounding boxes that contain PHI entities
+4. Renders the document one page at a time (for PDF, JPEG, PNG, or TIFF files)
+5. Draws black rectangles over the bounding boxes of each page to redact the PHI
+6. Streams each redacted page into the output file and uploads it to S3
 7. Optionally deletes the original document based on configuration
 
 This is the final step in the PII redaction workflow that produces the redacted documents.
 """
+import io
+import math
 import os
 import json
 import fitz  # PyMuPDF
 import logging
+import multiprocessing
+import tempfile
+import shutil
+import time
 import filetype
+import numpy as np
 import string
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, NamedTuple
 from S3Functions import S3
-from PIL import Image , ImageDraw, ImageSequence
-from textractoverlayer.t_overlay import DocumentDimensions, get_bounding_boxes
-from textractcaller.t_call import Textract_Types
+from PIL import Image , ImageDraw, ImageSequence, TiffImagePlugin
+from textractoverlayer.t_overlay import DocumentDimensions
+from TextractGeometry import TextGeometry, TextRecords, read_text_blocks, to_text_records
 
 logger = logging.getLogger(__name__)
 
@@ -50,166 +60,859 @@ def redacted_file_name(file_path: str) -> str:
     logger.debug(f"Local path for redacted file: {local_redacted_path}")
     return local_redacted_path
 
+# Matrix factors: 1.0 = 72 DPI, 2.0 = 144 DPI, etc.
+# ~150 DPI - matches the original pdfplumber resolution
+PDF_DPI_FACTOR = 2.1
+
+# PDF redaction mode. "raster" renders every page to an image and rebuilds the PDF from the
+# redacted bitmaps. "vector" removes the PHI text with PyMuPDF redaction annotations so pages
+# stay vector/text, pages without a text layer (scanned pages) still fall back to "raster".
+PDF_REDACTION_MODE = os.environ.get('PDF_REDACTION_MODE', 'raster')
+
+# Number of worker processes redacting the documents of one invocation. "1" redacts the documents
+# sequentially, "auto" uses one worker per available vCPU.
+REDACT_WORKERS = os.environ.get('REDACT_WORKERS', '1')
+
+# Number of documents downloaded ahead of, or uploaded behind, the document being redacted, in the
+# background. At most REDACT_PREFETCH + 1 documents are in flight, "0" downloads, redacts and uploads
+# one document at a time.
+REDACT_PREFETCH = int(os.environ.get('REDACT_PREFETCH', '1'))
+
+# Number of worker processes rendering the pages of a PDF in raster mode, "auto" uses one worker per
+# available vCPU. The workers are capped so the rendered pages in flight fit in REDACT_MEMORY_MB.
+RENDER_WORKERS = os.environ.get('RENDER_WORKERS', '1')
+
+# Start method of the render worker processes. Pages are rendered while the download and upload threads
+# of redact_documents run, a child forked from this process could inherit a lock (logging, boto3, urllib3)
+# held by one of them. The workers are forked from the single threaded forkserver process instead.
+RENDER_START_METHOD = 'forkserver'
+
+# Memory budget (MB) for the pixels of rendered pages in flight, in the Lambda process and the render workers.
+# Before rendering, the number of render workers and then the render resolution are lowered until the
+# estimate fits. Defaults to half the Lambda memory.
+REDACT_MEMORY_MB = int(os.environ.get('REDACT_MEMORY_MB', int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '2048')) // 2))
+
+# Lowest zoom factor the render resolution is lowered to when fitting the memory budget (72 DPI)
+MIN_DPI_FACTOR = 1.0
+
+class RedactionOptions(NamedTuple):
+    """
+    Rendering and output encoding options of a workflow, set with the optional redact_options
+    map of the workflow configuration.
+    """
+    dpi: int = None                 # PDF render resolution, default PDF_DPI_FACTOR (~150 DPI)
+    pdf_image_format: str = 'jpeg'  # encoding of rasterized PDF pages, 'jpeg' or 'png'
+    jpeg_quality: int = 75          # JPEG quality of rasterized PDF pages and JPEG files
+    tiff_compression: str = None    # Pillow TIFF compression such as 'group4', 'tiff_lzw' or 'tiff_adobe_deflate'
+
+    @classmethod
+    def from_dict(cls, options: dict) -> "RedactionOptions":
+        """Builds the options from the workflow redact_options, unknown keys are ignored
+        """
+        options = {k: v for k, v in (options or {}).items() if k in cls._fields and v is not None}
+        for key in ('dpi', 'jpeg_quality'):
+            if key in options:
+                options[key] = int(options[key])
+        return cls(**options)
+
+    @property
+    def dpi_factor(self) -> float:
+        return self.dpi / 72 if self.dpi else PDF_DPI_FACTOR
+
 def get_pil_img(file_path: str) -> tuple[str, list[Image.Image]]:
+    """Function gets a list of Pillow images from PDF/PNG/JPG/TIFF files.
+
+    Every page is kept in memory, use iter_pil_img to render one page at a time.
+    """
     try:
         file_mime = detect_file_type(file_path)
-        images = []
-        if file_mime == "application/pdf":
-            # gets an array of Pillow images from PDF file using PyMuPDF (much faster than pdfplumber)
-            logger.debug("Converting PDF file to Pillow Images using PyMuPDF")
-            pdf_document = None
-            try:
-                pdf_document = fitz.open(file_path)
-                logger.info(f"PDF opened successfully. Pages: {len(pdf_document)}")
-                
-                for page_num in range(len(pdf_document)):
-                    logger.debug(f"Processing PDF page {page_num+1}/{len(pdf_document)}")
-                    page = pdf_document[page_num]
-                    
-                    # Increase resolution to 150 DPI for better text detection
-                    # Matrix factors: 1.0 = 72 DPI, 2.0 = 144 DPI, etc.
-                    dpi_factor = 2.1  # ~150 DPI - matches the original pdfplumber resolution
-                    
-                    try:
-                        # Add alpha=False to ensure RGB output without alpha channel
-                        pix = page.get_pixmap(matrix=fitz.Matrix(dpi_factor, dpi_factor), alpha=False)
-                        # Convert pixmap to PIL Image
-                        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                        images.append(img)
-                        # Free up memory immediately
-                        pix = None
-                    except Exception as page_error:
-                        logger.error(f"Error processing page {page_num+1}: {page_error}")
-                        # Continue with next page instead of failing the whole document
-                        continue
-            except Exception as pdf_error:
-                logger.error(f"Error opening PDF document: {pdf_error}")
-                raise pdf_error
-            finally:
-                # Make sure we always close the PDF document to free resources
-                if pdf_document:
-                    pdf_document.close()
-                    logger.debug("PDF document closed")
-        elif file_mime in ['image/jpeg', 'image/png', 'image/tiff']:
-            logger.debug(f"Converting {file_mime} Image file to Pillow Images")
-            im = Image.open(file_path)
-            images = [img for img in ImageSequence.Iterator(im)]
-        
+        # iter_pil_img yields a new image for every page, no further copy needed
+        images = [img for _, img in iter_pil_img(file_path=file_path, file_mime=file_mime)]
         logger.debug(f"File type: {file_mime}, Total Pages: {len(images)}")
-        
-        try:
-            # Log memory usage to monitor resource consumption
-            import psutil
-            process = psutil.Process(os.getpid())
-            logger.info(f"Memory usage after image conversion: {process.memory_info().rss / 1024 / 1024:.2f} MB")
-        except ImportError:
-            pass
-            
+        log_memory_usage("after image conversion")
         return file_mime, images
     except Exception as e:
         logger.error("Failed to convert file to Pillow images")
         logger.error(e)
         raise e
 
-def redact_doc(temp_file: str, textract_json: dict, comprehend_json: dict) -> str:
+def render_pdf_page(page: fitz.Page, dpi_factor: float = PDF_DPI_FACTOR) -> Image.Image:
+    """Renders a single PyMuPDF page into a RGB Pillow image at the given zoom factor
+    """
+    # Add alpha=False to ensure RGB output without alpha channel
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi_factor, dpi_factor), alpha=False)
+    # Convert pixmap to PIL Image
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    # Free up memory immediately
+    pix = None
+    return img
+
+def render_worker(file_path: str, page_numbers: list[int], dpi_factor: float, conn):
+    """
+    Entry point of a page rendering worker process. Opens its own PyMuPDF document, renders its
+    pages in order and sends each of them to the parent process through a pipe. Sending blocks
+    until the parent reads the page, so a worker never renders more than one page ahead. A page
+    that fails to render is sent as its error and the worker stops.
+    """
+    try:
+        with fitz.open(file_path) as pdf_document:
+            matrix = fitz.Matrix(dpi_factor, dpi_factor)
+            for page_num in page_numbers:
+                try:
+                    pix = pdf_document[page_num - 1].get_pixmap(matrix=matrix, alpha=False)
+                except Exception as page_error:
+                    # logged by the parent process
+                    conn.send((page_num, None, str(page_error)))
+                    return
+                conn.send((page_num, pix.width, pix.height))
+                conn.send_bytes(pix.samples)
+                pix = None
+    finally:
+        conn.close()
+
+def iter_pdf_pages_parallel(file_path: str, page_numbers: list[int], workers: int, dpi_factor: float = PDF_DPI_FACTOR) -> Iterator[tuple[int, Image.Image]]:
+    """
+    Generator that renders PDF pages across worker processes and yields them in page order.
+
+    Pages are dealt to the workers round robin so every worker renders while the caller consumes
+    pages in order. Like the process pool of the redaction Lambda, workers are multiprocessing.Process
+    instances with a Pipe each since Lambda has no /dev/shm. They are started with RENDER_START_METHOD,
+    never forked from the threads of the Lambda process.
+
+    Args:
+        file_path: Path to the PDF file
+        page_numbers: 1-based page numbers to render, in order
+        workers: Number of worker processes
+        dpi_factor: Zoom factor of the rendered pages, 1.0 = 72 DPI
+
+    Yields:
+        tuple: 1-based page number and the Pillow image of that page
+
+    Raises:
+        Exception: When a page fails to render, a page is never skipped
+    """
+    context = multiprocessing.get_context(RENDER_START_METHOD)
+    if RENDER_START_METHOD == 'forkserver':
+        # the forkserver imports this module once, the workers forked from it start without importing anything
+        context.set_forkserver_preload([__name__])
+    pool = []
+    try:
+        for idx in range(workers):
+            recv_conn, send_conn = context.Pipe(duplex=False)
+            process = context.Process(target=render_worker, args=(file_path, page_numbers[idx::workers], dpi_factor, send_conn), daemon=True)
+            process.start()
+            send_conn.close()
+            pool.append((process, recv_conn))
+
+        for idx, page_num in enumerate(page_numbers):
+            process, recv_conn = pool[idx % workers]
+            try:
+                _, width, height = recv_conn.recv()
+                if width is None:
+                    # Fail the document, a missing page must never be replaced by the unredacted original
+                    logger.error(f"Error rendering page {page_num}: {height}")
+                    raise Exception(f"Unable to render page {page_num}: {height}")
+                img = Image.frombytes("RGB", [width, height], recv_conn.recv_bytes())
+            except EOFError:
+                raise Exception(f"Render worker exited with code {process.exitcode} before page {page_num}")
+            yield page_num, img
+    finally:
+        for process, recv_conn in pool:
+            recv_conn.close()
+            # the caller may stop consuming pages early
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+def fit_render_settings(document_dimensions: list[DocumentDimensions], dpi_factor: float, workers: str = RENDER_WORKERS, memory_mb: int = REDACT_MEMORY_MB) -> tuple[float, int]:
+    """
+    Resolves the render resolution and the number of page rendering workers of a PDF from a single
+    memory budget for the pixels of the rendered pages in flight.
+
+    The Lambda process holds up to two pages (the rendered page and its encoded copy) and every render
+    worker two more (the one it renders and the one waiting in the pipe). Render workers are dropped
+    first, then the resolution is lowered, not below MIN_DPI_FACTOR.
+
+    Args:
+        document_dimensions: DocumentDimensions of each page at dpi_factor
+        dpi_factor: Requested zoom factor of the rendered pages
+        workers: Requested number of render workers, "auto" uses every available vCPU
+        memory_mb: Memory budget for rendered pages in flight
+
+    Returns:
+        tuple: Zoom factor and number of render workers to use, 1 renders in the Lambda process
+    """
+    workers = get_worker_count(workers=str(workers), num_docs=len(document_dimensions))
+    budget = memory_mb * 1024 * 1024
+    page_bytes = max(dim.doc_width * dim.doc_height * 3 for dim in document_dimensions)
+
+    def estimate(count: int) -> int:
+        return page_bytes * (2 + 2 * count if count > 1 else 2)
+
+    while workers > 1 and estimate(workers) > budget:
+        workers -= 1
+    if estimate(workers) > budget:
+        # pixel memory scales with the square of the zoom factor
+        fitted_factor = max(MIN_DPI_FACTOR, dpi_factor * math.sqrt(budget / estimate(workers)))
+        logger.warning(f"Rendered pages need ~{estimate(workers) // (1024 * 1024)} MB, over the {memory_mb} MB budget. Lowering zoom factor from {dpi_factor:.2f} to {fitted_factor:.2f}")
+        dpi_factor = fitted_factor
+    return dpi_factor, workers
+
+def iter_pil_img(file_path: str, file_mime: str, workers: int = 1, dpi_factor: float = PDF_DPI_FACTOR) -> Iterator[tuple[int, Image.Image]]:
+    """
+    Generator that renders a PDF/PNG/JPG/TIFF file one page at a time.
+
+    Only the page currently yielded is held in memory, the caller is expected to
+    encode it and drop its reference before asking for the next page.
+
+    Args:
+        file_path: Path to the document file
+        file_mime: MIME type of the document file
+        workers: Number of processes rendering PDF pages in parallel (default: 1)
+        dpi_factor: Zoom factor of the rendered PDF pages, 1.0 = 72 DPI (default: PDF_DPI_FACTOR)
+
+    Yields:
+        tuple: 1-based page number and the Pillow image of that page
+    """
+    if file_mime == "application/pdf" and workers > 1:
+        with fitz.open(file_path) as pdf_document:
+            page_count = len(pdf_document)
+        logger.info(f"Rendering PDF with {workers} worker processes. Pages: {page_count}")
+        yield from iter_pdf_pages_parallel(file_path=file_path, page_numbers=list(range(1, page_count + 1)), workers=workers, dpi_factor=dpi_factor)
+    elif file_mime == "application/pdf":
+        # renders Pillow images from PDF file using PyMuPDF (much faster than pdfplumber)
+        logger.debug("Converting PDF file to Pillow Images using PyMuPDF")
+        try:
+            pdf_document = fitz.open(file_path)
+        except Exception as pdf_error:
+            logger.error(f"Error opening PDF document: {pdf_error}")
+            raise pdf_error
+        try:
+            logger.info(f"PDF opened successfully. Pages: {len(pdf_document)}")
+
+            for page_num in range(len(pdf_document)):
+                logger.debug(f"Processing PDF page {page_num+1}/{len(pdf_document)}")
+                try:
+                    img = render_pdf_page(page=pdf_document[page_num], dpi_factor=dpi_factor)
+                except Exception as page_error:
+                    logger.error(f"Error rendering page {page_num+1}: {page_error}")
+                    # Fail the document instead of leaving the page out of the redacted file
+                    raise page_error
+                yield page_num + 1, img
+        finally:
+            # Make sure we always close the PDF document to free resources
+            pdf_document.close()
+            logger.debug("PDF document closed")
+    elif file_mime in ['image/jpeg', 'image/png', 'image/tiff']:
+        logger.debug(f"Converting {file_mime} Image file to Pillow Images")
+        with Image.open(file_path) as im:
+            for idx, frame in enumerate(ImageSequence.Iterator(im)):
+                # copy the frame, the iterator re-uses the same image object for every frame
+                yield idx + 1, frame.copy()
+
+def get_page_dimensions(file_path: str, file_mime: str, dpi_factor: float = PDF_DPI_FACTOR) -> list[DocumentDimensions]:
+    """
+    Gets the pixel dimensions of every page without rendering any of them.
+
+    For PDF files the size is computed from the page rectangle and the zoom factor, which
+    is exactly the size of the pixmap rendered by iter_pil_img. For image files only the
+    frame headers are read.
+
+    Args:
+        file_path: Path to the document file
+        file_mime: MIME type of the document file
+        dpi_factor: Zoom factor of the rendered PDF pages, 1.0 = 72 DPI (default: PDF_DPI_FACTOR)
+
+    Returns:
+        list: DocumentDimensions for each page
+    """
+    dimensions = []
+    if file_mime == "application/pdf":
+        matrix = fitz.Matrix(dpi_factor, dpi_factor)
+        with fitz.open(file_path) as pdf_document:
+            for page in pdf_document:
+                irect = (page.rect * matrix).irect
+                dimensions.append(DocumentDimensions(doc_width=irect.width, doc_height=irect.height))
+    elif file_mime in ['image/jpeg', 'image/png', 'image/tiff']:
+        with Image.open(file_path) as im:
+            for frame in ImageSequence.Iterator(im):
+                dimensions.append(DocumentDimensions(doc_width=frame.size[0], doc_height=frame.size[1]))
+    return dimensions
+
+def log_memory_usage(stage: str):
+    """Logs the resident memory of the Lambda process to monitor resource consumption
+    """
+    try:
+        import psutil
+        process = psutil.Process(os.getpid())
+        logger.info(f"Memory usage {stage}: {process.memory_info().rss / 1024 / 1024:.2f} MB")
+    except ImportError:
+        pass
+
+class RedactedDocumentWriter:
+    """
+    Writes redacted pages to the output file one page at a time.
+
+    PDF pages are JPEG (or PNG) encoded and appended to a PyMuPDF document, so only the compressed
+    page streams are kept until the file is saved. TIFF frames are saved one at a time into the
+    output file through Pillow's AppendingTiffWriter. JPEG and PNG files are single page and saved as is.
+    """
+    def __init__(self, local_path: str, file_mime: str, dpi_factor: float = PDF_DPI_FACTOR, options: "RedactionOptions" = None):
+        """
+        Args:
+            local_path: Path of the redacted output file
+            file_mime: MIME type of the original document
+            dpi_factor: Zoom factor the PDF pages were rendered with, 1.0 = 72 DPI
+            options: Output encoding options
+        """
+        self.local_path = local_path
+        self.file_mime = file_mime
+        self.dpi_factor = dpi_factor
+        self.options = options or RedactionOptions()
+        self.page_count = 0
+        self._pdf = None
+        self._tiff = None
+        self._tiff_fp = None
+        self._thresholded = False
+
+    def __enter__(self):
+        if self.file_mime == "application/pdf":
+            self._pdf = fitz.open()
+        elif self.file_mime == "image/tiff":
+            self._tiff_fp = open(self.local_path, "w+b")
+            self._tiff = TiffImagePlugin.AppendingTiffWriter(self._tiff_fp)
+            self._tiff.__enter__()
+        return self
+
+    def add_page(self, img: Image.Image):
+        """Encodes a redacted page into the output file
+        """
+        if self._pdf is not None:
+            buffer = io.BytesIO()
+            if self.options.pdf_image_format == 'png':
+                img.save(buffer, format="PNG", optimize=True)
+            else:
+                img.convert("RGB").save(buffer, format="JPEG", quality=self.options.jpeg_quality)
+            # keep the physical page size of the original document
+            width, height = img.size[0] / self.dpi_factor, img.size[1] / self.dpi_factor
+            page = self._pdf.new_page(width=width, height=height)
+            page.insert_image(page.rect, stream=buffer.getvalue())
+        elif self._tiff is not None:
+            compression = self.options.tiff_compression
+            if compression in ('group3', 'group4') and img.mode != "1":
+                # CCITT compression only applies to bilevel images, grayscale and color pages are thresholded
+                if not self._thresholded:
+                    logger.warning(f"Thresholding {img.mode} pages of {self.local_path} to bilevel for {compression} compression")
+                    self._thresholded = True
+                img = img.convert("1")
+            # save_all would keep every appended page in memory, frames are appended one at a time instead
+            img.save(self._tiff, format="TIFF", **(dict(compression=compression) if compression else {}))
+            self._tiff.newFrame()
+        elif self.page_count == 0:
+            if self.file_mime == "image/jpeg":
+                img.save(self.local_path, quality=self.options.jpeg_quality)
+            else:
+                img.save(self.local_path)
+        else:
+            raise Exception(f'Unable to write more than one page for {self.file_mime} file {self.local_path}')
+        self.page_count += 1
+
+    def add_pdf_page(self, pdf_document: fitz.Document, page_number: int):
+        """Copies a page from a PyMuPDF document into the output PDF without rendering it
+
+        Args:
+            pdf_document: Source PyMuPDF document
+            page_number: 1-based page number in the source document
+        """
+        self.add_pdf_pages(pdf_document=pdf_document, from_page=page_number, to_page=page_number)
+
+    def add_pdf_pages(self, pdf_document: fitz.Document, from_page: int, to_page: int):
+        """Copies a range of pages from a PyMuPDF document into the output PDF without rendering them
+
+        Args:
+            pdf_document: Source PyMuPDF document
+            from_page: First 1-based page number of the range
+            to_page: Last 1-based page number of the range, inclusive
+        """
+        if self._pdf is None:
+            raise Exception(f'Unable to copy PDF pages into {self.file_mime} file {self.local_path}')
+        self._pdf.insert_pdf(pdf_document, from_page=from_page - 1, to_page=to_page - 1)
+        self.page_count += to_page - from_page + 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._pdf is not None:
+            if exc_type is None:
+                # garbage=4 also merges the duplicate objects (fonts, images) of the copied pages
+                self._pdf.save(self.local_path, garbage=4, deflate=True)
+            self._pdf.close()
+        elif self._tiff is not None:
+            self._tiff.__exit__(exc_type, exc_value, traceback)
+            self._tiff_fp.close()
+        return False
+
+class RedactionBox(NamedTuple):
+    """Pixel bounding box of a Textract WORD to redact, same attributes as the textractoverlayer BoundingBox
+    """
+    page_number: int
+    xmin: int
+    ymin: int
+    xmax: int
+    ymax: int
+    text: str
+
+def merge_boxes(boxes: list) -> list[RedactionBox]:
+    """
+    Merges the overlapping and adjacent redaction boxes of a page that sit on the same line.
+
+    Boxes are clustered into lines when they overlap vertically by at least half of the smaller box
+    height, then boxes of a line touching or overlapping horizontally are replaced by their union.
+
+    Args:
+        boxes: Bounding boxes of a single page
+
+    Returns:
+        list: Merged boxes
+    """
+    lines = []
+    active = []
+    for box in sorted(boxes, key=lambda b: (b.ymin, b.xmin)):
+        # boxes come in ymin order, lines ending above this box can't take any more boxes
+        active = [line for line in active if line[0].ymax >= box.ymin]
+        for line in active:
+            anchor = line[0]
+            overlap = min(anchor.ymax, box.ymax) - max(anchor.ymin, box.ymin)
+            if overlap * 2 >= min(anchor.ymax - anchor.ymin, box.ymax - box.ymin):
+                line.append(box)
+                break
+        else:
+            lines.append([box])
+            active.append(lines[-1])
+
+    merged = []
+    for line in lines:
+        current = None
+        for box in sorted(line, key=lambda b: b.xmin):
+            if current is not None and box.xmin <= current.xmax + 1:
+                current = RedactionBox(page_number=current.page_number,
+                                       xmin=current.xmin,
+                                       ymin=min(current.ymin, box.ymin),
+                                       xmax=max(current.xmax, box.xmax),
+                                       ymax=max(current.ymax, box.ymax),
+                                       text=f"{current.text} {box.text}")
+            else:
+                if current is not None:
+                    merged.append(current)
+                current = RedactionBox(page_number=box.page_number, xmin=box.xmin, ymin=box.ymin, xmax=box.xmax, ymax=box.ymax, text=box.text)
+        merged.append(current)
+    return merged
+
+def group_redactions_by_page(redactions: list) -> dict[int, list[RedactionBox]]:
+    """Buckets the redaction boxes by 1-based page number once and merges the boxes of every page
+    """
+    page_redactions = defaultdict(list)
+    for box in redactions:
+        page_redactions[box.page_number].append(box)
+    return {page_num: merge_boxes(boxes) for page_num, boxes in page_redactions.items()}
+
+def draw_redactions(img: Image.Image, boxes: list) -> Image.Image:
+    """
+    Fills the bounding boxes of a rendered page with black.
+
+    Args:
+        img: Rendered page
+        boxes: Merged bounding boxes of the page
+
+    Returns:
+        Image: Redacted page
+    """
+    if boxes:
+        draw = ImageDraw.Draw(img)
+        for box in boxes:
+            draw.rectangle(xy=[box.xmin, box.ymin, box.xmax, box.ymax], fill="Black")
+    return img
+
+def has_text_layer(page: fitz.Page) -> bool:
+    """Returns True if the PDF page has extractable text, False for scanned (image only) pages
+    """
+    return bool(page.get_text("text").strip())
+
+def redact_pdf_page_vector(page: fitz.Page, boxes: list, dpi_factor: float = PDF_DPI_FACTOR):
+    """
+    Redacts a PDF page in place using PyMuPDF redaction annotations.
+
+    The bounding boxes are in pixels of the page rendered at dpi_factor, they are mapped back
+    to PDF points and de-rotated before adding the annotations. Applying the annotations removes
+    the text under the boxes and blanks the pixels of any image underneath.
+
+    Args:
+        page: PyMuPDF page to redact
+        boxes: Bounding boxes of the page to redact
+        dpi_factor: Zoom factor the bounding boxes were computed with
+    """
+    for box in boxes:
+        rect = fitz.Rect(box.xmin, box.ymin, box.xmax, box.ymax) / dpi_factor
+        page.add_redact_annot(rect * page.derotation_matrix, fill=(0, 0, 0))
+    page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_PIXELS)
+
+def redact_pdf(file_path: str, page_redactions: dict, writer: RedactedDocumentWriter, dpi_factor: float = PDF_DPI_FACTOR):
+    """
+    Redacts a PDF file in vector mode.
+
+    Pages with a text layer are redacted with PyMuPDF redaction annotations and copied into the
+    output as vector/text pages, no rendering needed. Scanned pages are rendered and redacted as
+    images like in raster mode. Pages without redactions are copied as is.
+
+    Args:
+        file_path: Path to the PDF file
+        page_redactions: Bounding boxes to redact grouped by 1-based page number
+        writer: Writer of the redacted output file
+        dpi_factor: Zoom factor of the bounding boxes and of the rendered scanned pages
+    """
+    with fitz.open(file_path) as pdf_document:
+        logger.info(f"Redacting PDF in vector mode. Pages: {len(pdf_document)}")
+        for page in pdf_document:
+            page_num = page.number + 1
+            boxes = page_redactions.get(page_num, [])
+            if not boxes:
+                logger.debug(f"PDF page {page_num}/{len(pdf_document)} has no redactions, copying it as is")
+                writer.add_pdf_page(pdf_document=pdf_document, page_number=page_num)
+            elif has_text_layer(page):
+                logger.debug(f"Vector redaction of PDF page {page_num}/{len(pdf_document)}")
+                redact_pdf_page_vector(page=page, boxes=boxes, dpi_factor=dpi_factor)
+                writer.add_pdf_page(pdf_document=pdf_document, page_number=page_num)
+            else:
+                logger.debug(f"PDF page {page_num}/{len(pdf_document)} has no text layer, falling back to raster redaction")
+                img = render_pdf_page(page=page, dpi_factor=dpi_factor)
+                img = draw_redactions(img=img, boxes=boxes)
+                writer.add_page(img)
+                del img
+
+def redact_pdf_raster(file_path: str, page_redactions: dict, writer: RedactedDocumentWriter, workers: int = 1, dpi_factor: float = PDF_DPI_FACTOR):
+    """
+    Redacts a PDF file in raster mode, rendering only the pages that have redactions.
+
+    Pages with redactions are rendered, redacted and encoded as images. The runs of pages without
+    redactions in between are copied into the output as is with a single insert_pdf per run. A page
+    with redactions is never copied: the document fails when one of them is not rendered.
+
+    Args:
+        file_path: Path to the PDF file
+        page_redactions: Bounding boxes to redact grouped by 1-based page number
+        writer: Writer of the redacted output file
+        workers: Number of processes rendering the pages with redactions
+        dpi_factor: Zoom factor of the bounding boxes and of the rendered pages
+    """
+    with fitz.open(file_path) as pdf_document:
+        page_count = len(pdf_document)
+        hit_pages = sorted(page_num for page_num, boxes in page_redactions.items() if boxes and 1 <= page_num <= page_count)
+        logger.info(f"Redacting PDF in raster mode. Pages: {page_count}, pages with redactions: {len(hit_pages)}")
+
+        workers = min(workers, len(hit_pages))
+        if workers > 1:
+            rendered = iter_pdf_pages_parallel(file_path=file_path, page_numbers=hit_pages, workers=workers, dpi_factor=dpi_factor)
+        else:
+            rendered = ((page_num, render_pdf_page(page=pdf_document[page_num - 1], dpi_factor=dpi_factor)) for page_num in hit_pages)
+
+        next_page = 1
+        for idx, (page_num, img) in enumerate(rendered):
+            if page_num != hit_pages[idx]:
+                raise Exception(f"Rendered page {page_num} out of order, expected page {hit_pages[idx]}")
+            if page_num > next_page:
+                writer.add_pdf_pages(pdf_document=pdf_document, from_page=next_page, to_page=page_num - 1)
+            img = draw_redactions(img=img, boxes=page_redactions[page_num])
+            writer.add_page(img)
+            # Free the page before the next one is rendered
+            del img
+            next_page = page_num + 1
+        if hit_pages and next_page <= hit_pages[-1]:
+            raise Exception(f"Unable to render PDF pages with redactions after page {next_page - 1}")
+        if next_page <= page_count:
+            writer.add_pdf_pages(pdf_document=pdf_document, from_page=next_page, to_page=page_count)
+
+class EntityMatcher:
+    """
+    Matches Textract line text against PHI entities in time linear to the line length.
+
+    A line matches when it is equal to an entity, contains an entity ("John" in "John Smith")
+    or is contained in an entity ("John" in "John Smith MD"). The matcher is built once per
+    document:
+
+    - an Aho-Corasick automaton over the lowercased entities finds any entity inside a line
+      in a single pass over the line text
+    - the lowercased entities joined by a NUL separator act as a reverse index, so a line
+      inside an entity is a single substring search
+
+    Results are memoized per distinct line text since headers and footers repeat on every page.
+    """
+    SEPARATOR = "\x00"
+
+    def __init__(self, entities: list[str]):
+        """
+        Args:
+            entities: PHI entity texts from Comprehend Medical
+        """
+        self._patterns = {entity.lower() for entity in entities}
+        # An empty entity is contained in every line
+        self._match_all = "" in self._patterns
+        self._entity_index = self.SEPARATOR.join(self._patterns)
+        self._cache = {}
+
+        # Aho-Corasick trie, state 0 is the root
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [False]
+        for pattern in self._patterns:
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(False)
+                    self._goto[state][ch] = nxt
+                state = nxt
+            self._out[state] = True
+
+        # Failure links in breadth first order
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] or self._out[self._fail[nxt]]
+
+    def _contains_entity(self, text: str) -> bool:
+        """Returns True if any entity occurs in the lowercased text
+        """
+        if self._match_all:
+            return True
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                return True
+        return False
+
+    def _inside_entity(self, text: str) -> bool:
+        """Returns True if the lowercased text occurs in any entity
+        """
+        if not self._patterns:
+            return False
+        if self.SEPARATOR in text:
+            return any(text in pattern for pattern in self._patterns)
+        return text in self._entity_index
+
+    def matches(self, text: str) -> bool:
+        """
+        Checks if a line of text has to be redacted.
+
+        Args:
+            text: Textract line text
+
+        Returns:
+            bool: True if the line is equal to, contains or is contained in a PHI entity
+        """
+        match = self._cache.get(text)
+        if match is None:
+            text_lower = text.lower()
+            match = self._contains_entity(text_lower) or self._inside_entity(text_lower)
+            self._cache[text] = match
+        return match
+
+def scale_boxes(records: np.ndarray, document_dimensions: list[DocumentDimensions]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Scales normalized Textract boxes to the pixel size of their page in one shot, rounding like the
+    textractoverlayer BoundingBox.
+
+    Args:
+        records: Structured array with page, left, top, width and height fields (see TextractGeometry.TextRecords)
+        document_dimensions: DocumentDimensions for each page
+
+    Returns:
+        tuple: (n, 4) int array of xmin, ymin, xmax, ymax and the mask of the records on a known page
+    """
+    page_sizes = np.array([(dim.doc_width, dim.doc_height) for dim in document_dimensions], dtype=np.float64).reshape(-1, 2)
+    pages = records['page'].astype(np.intp)
+    valid = (pages >= 1) & (pages <= len(page_sizes))
+    sizes = page_sizes[np.where(valid, pages - 1, 0)] if len(page_sizes) else np.zeros((len(records), 2))
+    widths, heights = sizes[:, 0], sizes[:, 1]
+    # np.rint rounds half to even like round()
+    xmin = np.rint(records['left'].astype(np.float64) * widths)
+    ymin = np.rint(records['top'].astype(np.float64) * heights)
+    xmax = np.rint(xmin + records['width'].astype(np.float64) * widths)
+    ymax = np.rint(ymin + records['height'].astype(np.float64) * heights)
+    return np.stack([xmin, ymin, xmax, ymax], axis=1).astype(np.int64), valid
+
+def to_redaction_boxes(records: np.ndarray, texts: list[str], document_dimensions: list[DocumentDimensions]) -> list[RedactionBox]:
+    """Scales the records to redact and builds their RedactionBox, records on unknown pages are dropped
+    """
+    boxes, valid = scale_boxes(records=records, document_dimensions=document_dimensions)
+    return [RedactionBox(page_number, xmin, ymin, xmax, ymax, text)
+            for page_number, (xmin, ymin, xmax, ymax), text, keep in zip(records['page'].tolist(), boxes.tolist(), texts, valid.tolist()) if keep]
+
+def get_redactions(lines: TextRecords, comprehend_json: dict, document_dimensions: list[DocumentDimensions]) -> list[RedactionBox]:
+    """
+    Identifies which Textract LINEs contain PHI entities and returns their pixel boxes.
+
+    Args:
+        lines: LINE records with their text
+        comprehend_json: JSON output from Comprehend Medical containing PHI entities
+        document_dimensions: DocumentDimensions for each page
+
+    Returns:
+        list: Bounding boxes to redact
+    """
+    # Extract PHI entities from Comprehend Medical JSON
+    entities = [entity['Text'] for entity in comprehend_json['Entities']]
+
+    logger.debug("PHI Entities found...")
+    logger.debug(entities)
+
+    # Identify which lines contain PHI entities, the matcher is built once per document
+    matcher = EntityMatcher(entities=entities)
+    hits = np.fromiter((matcher.matches(text) for text in lines.texts), dtype=bool, count=len(lines.texts))
+    redactions = to_redaction_boxes(records=lines.records[hits],
+                                    texts=[lines.texts[idx] for idx in np.flatnonzero(hits).tolist()],
+                                    document_dimensions=document_dimensions)
+
+    logger.debug(f"Found {len(redactions)} boxes to redact")
+    return redactions
+
+def get_offset_redactions(words: TextRecords, comprehend_json: dict, document_dimensions: list[DocumentDimensions]) -> tuple[list, list]:
+    """
+    Resolves PHI entities to Textract WORD boxes using the Comprehend Medical BeginOffset/EndOffset.
+
+    The geometry sidecar written by the textract-output Lambda holds the character range of every WORD in the
+    plain text sent to Comprehend Medical, in text order. The word range of every entity is found with two
+    binary searches over the word offsets, for all entities at once.
+
+    Args:
+        words: WORD records of the geometry sidecar (<document_name>.geometry), in text order
+        comprehend_json: JSON output from Comprehend Medical containing PHI entities
+        document_dimensions: DocumentDimensions for each page
+
+    Returns:
+        tuple: WORD boxes to redact and the entities that could not be resolved by offset
     """
-    Redacts PDF/PNG/JPG files using Amazon Comprehend PHI entities and Textract OCR JSON.
+    entities = comprehend_json['Entities']
+    with_offsets = [entity for entity in entities if entity.get('BeginOffset') is not None and entity.get('EndOffset') is not None]
+    unresolved = [entity for entity in entities if entity.get('BeginOffset') is None or entity.get('EndOffset') is None]
+    entity_begins = np.array([entity['BeginOffset'] for entity in with_offsets], dtype=np.int64)
+    entity_ends = np.array([entity['EndOffset'] for entity in with_offsets], dtype=np.int64)
+
+    # first word ending after the entity begins, first word beginning at or after the entity end
+    first = np.searchsorted(words.records['end'], entity_begins, side='right')
+    last = np.searchsorted(words.records['begin'], entity_ends, side='left')
+    counts = np.maximum(last - first, 0)
+    unresolved += [entity for entity, count in zip(with_offsets, counts.tolist()) if count == 0]
+
+    # word indexes of every entity, a word shared by several entities is redacted once with the first entity
+    entity_idx = np.repeat(np.arange(len(with_offsets)), counts)
+    word_idx = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    word_idx, unique_idx = np.unique(word_idx, return_index=True)
+    entity_idx = entity_idx[unique_idx]
+
+    redactions = to_redaction_boxes(records=words.records[word_idx],
+                                    texts=[with_offsets[idx]['Text'] for idx in entity_idx.tolist()],
+                                    document_dimensions=document_dimensions)
+
+    logger.debug(f"Found {len(redactions)} word boxes to redact, {len(unresolved)} entities not resolved by offset")
+    return redactions, unresolved
+
+def redact_doc(temp_file: str, lines: TextRecords, comprehend_json: dict, pdf_mode: str = PDF_REDACTION_MODE, words: TextRecords = None, options: dict = None) -> str:
+    """
+    Redacts PDF/PNG/JPG/TIFF files using Amazon Comprehend PHI entities and Textract OCR JSON.
     
     This function:
-    1. Converts the document to Pillow images
-    2. Gets document dimensions for each page
-    3. Gets bounding boxes for text from Textract JSON
-    4. Identifies which bounding boxes contain PHI entities
-    5. Draws black rectangles over those bounding boxes
-    6. Saves the redacted document
+    1. Gets document dimensions for each page without rendering the pages
+    2. Resolves PHI entities to WORD boxes using the text offsets of the geometry sidecar (when available)
+    3. Gets LINE bounding boxes from the Textract geometry and identifies which contain the remaining PHI entities
+    4. Renders one page at a time as a Pillow image
+    5. Draws black rectangles over the bounding boxes of that page
+    6. Encodes the page into the redacted document and frees it before rendering the next page
+
+    Only PDF pages with redactions are rendered, the other pages are copied into the redacted PDF as is.
+    Peak memory is a single rendered page regardless of the number of pages. In "vector" PDF mode
+    pages with a text layer are redacted with PyMuPDF redaction annotations instead of rendering.
+    The PDF render resolution is lowered when the rendered pages would not fit in REDACT_MEMORY_MB.
     
     Args:
         temp_file: Path to the document file
-        textract_json: JSON output from Textract containing document layout
+        lines: LINE records with their text, from the geometry sidecar or the Textract JSON
         comprehend_json: JSON output from Comprehend Medical containing PHI entities
+        pdf_mode: PDF redaction mode, "raster" or "vector" (default: PDF_REDACTION_MODE)
+        words: WORD records of the geometry sidecar with their text offsets, enables word level redaction
+        options: Workflow redact_options with the render resolution and output encoding, see RedactionOptions
         
     Returns:
         tuple: File MIME type and path to the redacted file
     """
     try:        
-        file_mime, images = get_pil_img(file_path=temp_file)
+        file_mime = detect_file_type(temp_file)
         logger.debug(f"Getting local redacted file name from path {temp_file}")
         local_path = redacted_file_name(file_path=temp_file)
 
-        if len(images) == 0:
-            raise Exception(f'Unable to redact. No images returned from file, images : {len(images)}')        
+        redact_options = RedactionOptions.from_dict(options)
+        dpi_factor = redact_options.dpi_factor
 
         # Get document dimensions for each page
         logger.debug("Getting document dimensions")
-        document_dimension = [DocumentDimensions(doc_width=img_sample.size[0], doc_height=img_sample.size[1]) for img_sample in images]
-        
-        # Set up overlay for text lines
-        logger.debug("Setting overlay")
-        overlay=[Textract_Types.LINE]
-        
-        # Get bounding boxes for text from Textract JSON
-        logger.debug("Getting bounding boxes")
-        bounding_box_list = get_bounding_boxes(textract_json=textract_json, document_dimensions=document_dimension, overlay_features=overlay)
-        
-        # Extract PHI entities from Comprehend Medical JSON
-        entities = []
-        entity_lookup = {}  # Optimization: Create lookup dictionary for faster matching
-        
-        for entity in comprehend_json['Entities']:
-            entity_text = entity['Text']
-            entities.append(entity_text)
-            # Add lowercase entity to lookup dictionary
-            entity_lookup[entity_text.lower()] = True
-        
-        logger.debug("PHI Entities found...")    
-        logger.debug(entities)
+        document_dimension = get_page_dimensions(file_path=temp_file, file_mime=file_mime, dpi_factor=dpi_factor)
 
-        # Identify which bounding boxes contain PHI entities - Comprehensive matching
-        redactions = []
-        processed_boxes = set()  # Keep track of boxes we've already added
+        if len(document_dimension) == 0:
+            raise Exception(f'Unable to redact. No pages found in file, pages : {len(document_dimension)}')
+
+        render_workers = 1
+        if file_mime == "application/pdf":
+            # Fit the render resolution and workers to the memory budget before rendering anything
+            fitted_factor, render_workers = fit_render_settings(document_dimensions=document_dimension, dpi_factor=dpi_factor,
+                                                                workers=RENDER_WORKERS if pdf_mode != "vector" else 1)
+            if fitted_factor != dpi_factor:
+                dpi_factor = fitted_factor
+                document_dimension = get_page_dimensions(file_path=temp_file, file_mime=file_mime, dpi_factor=dpi_factor)
         
-        # Combined approach that handles all matching cases:
-        # 1. Exact matches: entity == bbox text
-        # 2. Entity contained in bbox: "John" in "John Smith"
-        # 3. Bbox text contained in entity: "John" in "John Smith MD"
-        for idx, bbox in enumerate(bounding_box_list):
-            if idx in processed_boxes:
-                continue
-                
-            bbox_text_lower = bbox.text.lower()
-            
-            # Case 1: Direct match using lookup dictionary
-            if bbox_text_lower in entity_lookup:
-                redactions.append(bbox)
-                processed_boxes.add(idx)
-                continue
-                
-            # Case 2 & 3: Check bidirectional containment
-            for entity in entities:
-                entity_lower = entity.lower()
-                if entity_lower in bbox_text_lower or bbox_text_lower in entity_lower:
-                    redactions.append(bbox)
-                    processed_boxes.add(idx)
-                    break
-                        
-        logger.debug(f"Found {len(redactions)} boxes to redact")
-
-        # Draw black rectangles over bounding boxes that contain PHI entities
-        for idx,img in enumerate(images):
-            draw = ImageDraw.Draw(img)
-            page_num = idx + 1
-            for box in redactions:
-                if box.page_number == page_num:                    
-                    draw.rectangle(xy=[box.xmin, box.ymin, box.xmax, box.ymax], fill="Black")
-
-        if len(images) == 1:
-            images[0].save(local_path)
-            logger.info(f"Redaction complete. Redacted file saved as {local_path}")
-            return file_mime, local_path
-        else:
-            images[0].save(local_path, save_all=True,append_images=images[1:])
-            logger.info(f"Redaction complete. Redacted file saved as {local_path}")
-            return file_mime, local_path
+        redactions = []
+        if words is not None:
+            # Resolve the entities to exact WORD boxes using the Comprehend Medical offsets
+            logger.debug("Getting word bounding boxes from text offsets")
+            redactions, unresolved = get_offset_redactions(words=words, comprehend_json=comprehend_json, document_dimensions=document_dimension)
+            comprehend_json = dict(comprehend_json, Entities=unresolved)
+
+        if comprehend_json['Entities']:
+            # Get bounding boxes of the text lines containing the remaining entities
+            logger.debug("Getting bounding boxes")
+            redactions += get_redactions(lines=lines, comprehend_json=comprehend_json, document_dimensions=document_dimension)
+
+        # Group the redactions by page so each rendered page only looks at its own boxes
+        page_redactions = group_redactions_by_page(redactions=redactions)
+
+        # Draw black rectangles over bounding boxes that contain PHI entities, one page at a time
+        with RedactedDocumentWriter(local_path=local_path, file_mime=file_mime, dpi_factor=dpi_factor, options=redact_options) as writer:
+            if file_mime == "application/pdf" and pdf_mode == "vector":
+                redact_pdf(file_path=temp_file, page_redactions=page_redactions, writer=writer, dpi_factor=dpi_factor)
+            elif file_mime == "application/pdf":
+                redact_pdf_raster(file_path=temp_file, page_redactions=page_redactions, writer=writer, workers=render_workers, dpi_factor=dpi_factor)
+            else:
+                for page_num, img in iter_pil_img(file_path=temp_file, file_mime=file_mime, workers=render_workers, dpi_factor=dpi_factor):
+                    img = draw_redactions(img=img, boxes=page_redactions.get(page_num, []))
+                    writer.add_page(img)
+                    # Free the page before the next one is rendered
+                    del img
+
+        if writer.page_count == 0:
+            raise Exception(f'Unable to redact. No images returned from file, images : {writer.page_count}')
+
+        log_memory_usage("after redaction")
+        logger.info(f"Redaction complete. Redacted file saved as {local_path}")
+        return file_mime, local_path
     except Exception as e:
         logger.error(e)
         raise e
@@ -244,6 +947,275 @@ def clean_up(local_paths: list[str], s3_keys: list[str], s3_retain_docs: bool, s
 
     return True
 
+def fetch_document(doc: dict, s3: S3) -> dict:
+    """
+    Downloads the inputs of a document concurrently: the geometry sidecar (or the Textract JSON for
+    workflows processed before the sidecar was introduced), the Comprehend Medical JSON and the original document.
+
+    The document is downloaded into its own temporary directory under /tmp so documents with the
+    same file name never collide, the directory is removed by store_document.
+
+    Args:
+        doc: Document to redact with the S3 keys of its Textract and Comprehend Medical outputs
+        s3: S3 helper object
+
+    Returns:
+        dict: Parsed inputs, local path of the document and time spent downloading
+    """
+    start = time.perf_counter()
+    work_dir = tempfile.mkdtemp(dir='/tmp')
+    temp_file = os.path.join(work_dir, os.path.basename(doc['doc']))
+    try:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            if doc.get('geometry'):
+                # Geometry sidecar with the LINE/WORD boxes and their text offsets
+                geometry_op = pool.submit(s3.get_object_content, key=doc['geometry'])
+            else:
+                # Textract response JSON containing document layout information, streamed so only the
+                # LINE text and geometry are kept in memory
+                textract_op = pool.submit(lambda: read_text_blocks(s3.get_object_stream(key=doc['txtract']), block_types=("LINE",)))
+            # Comprehend Medical PHI output JSON containing detected PHI entities, parsed from the stream
+            comp_med = pool.submit(lambda: json.load(s3.get_object_stream(key=doc['comp_med'])))
+            # Original document into the Lambda /tmp directory
+            logger.info(f"Downloading document to {work_dir}")
+            download = pool.submit(s3.download_file, source_object=doc['doc'], destination_file=temp_file)
+
+            inputs = dict(work_dir=work_dir, temp_file=temp_file)
+            if doc.get('geometry'):
+                geometry = TextGeometry(geometry_op.result())
+                inputs['lines'] = geometry.records("LINE")
+                inputs['words'] = geometry.records("WORD", with_text=False)
+                logger.info(f"Loaded {geometry.line_count} LINE and {geometry.word_count} WORD records from geometry sidecar")
+            else:
+                inputs['lines'] = to_text_records(textract_op.result())
+                inputs['words'] = None
+                logger.info(f"Loaded {len(inputs['lines'].texts)} LINE blocks from Textract JSON")
+            inputs['comprehend_json'] = comp_med.result()
+            logger.info(f"Loaded Comprehend Medical JSON with {len(inputs['comprehend_json']['Entities'])} entities")
+            download.result()
+        inputs['fetch_time'] = time.perf_counter() - start
+        return inputs
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise e
+
+def store_document(doc: dict, work_dir: str, file_mime: str, redacted_file: str, s3: S3, retain_docs: bool) -> tuple[str, float]:
+    """
+    Uploads the redacted document, optionally deletes the original document from S3 and removes
+    the temporary directory of the document.
+
+    Returns:
+        tuple: S3 key of the redacted document and time spent uploading and cleaning up
+    """
+    start = time.perf_counter()
+    try:
+        document = doc['doc']  # S3 key of the original document
+        filename = os.path.basename(document)
+
+        # Determine the S3 key for the redacted document
+        redacted_prefix = os.path.dirname(document).replace('/orig-doc','/redacted-doc')
+        s3_redacted_key = f"{redacted_prefix}/{filename}"
+
+        logger.debug(f"Redaction complete. Saving {redacted_file} to S3")
+        s3.upload_file(source_file=redacted_file, destination_object=s3_redacted_key, ExtraArgs={'ContentType': file_mime})
+
+        # Clean up temporary files and optionally delete original document
+        if clean_up(local_paths=[os.path.join(work_dir, filename), redacted_file], s3_keys=[document], s3_retain_docs=retain_docs, s3=s3):
+            logger.info("Cleanup complete...")
+        return s3_redacted_key, time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def redact_documents(docs: list, s3: S3, retain_docs: bool, prefetch: int = REDACT_PREFETCH, options: dict = None) -> list:
+    """
+    Redacts documents through an overlapped download / redact / upload pipeline.
+
+    While document N is being redacted, the inputs of the next documents are downloaded and the
+    previous redacted documents are uploaded in background threads. Downloads ahead and uploads behind
+    share `prefetch` slots, so at most `prefetch` + 1 documents have their inputs in memory or their
+    files in /tmp at any time. With `prefetch` 0 the documents are downloaded, redacted and uploaded
+    one at a time.
+
+    Args:
+        docs: Documents to redact
+        s3: S3 helper object
+        retain_docs: Whether to retain the original documents in S3
+        prefetch: Number of documents downloaded and uploaded alongside the redaction (0 disables overlapping)
+        options: Workflow redact_options, see RedactionOptions
+
+    Returns:
+        list: Redaction result of every document with its status, redacted S3 key or error and stage timings
+    """
+    results = []
+
+    def start_document(doc: dict) -> dict:
+        logger.debug(doc)
+        result = dict(doc=doc['doc'], status='failed', timings={})
+        results.append(result)
+        return result
+
+    def load_inputs(doc: dict, result: dict, fetch: Callable):
+        try:
+            inputs = fetch()
+            result['timings']['fetch'] = round(inputs['fetch_time'], 3)
+            return inputs
+        except Exception as e:
+            logger.error(f"Error occured in downloading {doc['doc']}")
+            logger.error(e)
+            result['error'] = str(e)
+            return None
+
+    def redact_inputs(doc: dict, result: dict, inputs: dict):
+        try:
+            # Redact the document
+            start = time.perf_counter()
+            logger.info(f"Redacting document in {inputs['work_dir']}")
+            redacted = redact_doc(temp_file=inputs['temp_file'], lines=inputs['lines'], comprehend_json=inputs['comprehend_json'], words=inputs['words'], options=options)
+            result['timings']['redact'] = round(time.perf_counter() - start, 3)
+            return redacted
+        except Exception as e:
+            logger.error(f"Error occured in redacting {doc['doc']}")
+            logger.error(e)
+            result['error'] = str(e)
+            shutil.rmtree(inputs['work_dir'], ignore_errors=True)
+            return None
+
+    def finish_upload(result: dict, store: Callable):
+        try:
+            redacted_key, upload_time = store()
+            result['timings']['upload'] = round(upload_time, 3)
+            result.update(status='redacted', redacted_doc=redacted_key)
+        except Exception as e:
+            logger.error(f"Error occured in uploading redacted {result['doc']}")
+            logger.error(e)
+            result['error'] = str(e)
+        logger.info(f"Redaction of {result['doc']} {result['status']}, timings: {result['timings']}")
+
+    if prefetch <= 0:
+        for doc in docs:
+            result = start_document(doc)
+            inputs = load_inputs(doc, result, lambda: fetch_document(doc=doc, s3=s3))
+            if inputs is None:
+                continue
+            redacted = redact_inputs(doc, result, inputs)
+            if redacted is None:
+                continue
+            file_mime, redacted_file = redacted
+            work_dir = inputs['work_dir']
+            # Release the parsed JSON before the next document is fetched
+            del inputs
+            finish_upload(result, lambda: store_document(doc=doc, work_dir=work_dir, file_mime=file_mime, redacted_file=redacted_file, s3=s3, retain_docs=retain_docs))
+        return results
+
+    fetches = deque()
+    uploads = deque()
+    docs_iter = iter(docs)
+
+    with ThreadPoolExecutor(max_workers=prefetch) as fetch_pool, ThreadPoolExecutor(max_workers=prefetch) as upload_pool:
+        def submit_fetches():
+            # Completed uploads give their slot back to the downloads ahead
+            while uploads and uploads[0][1].done():
+                result, upload = uploads.popleft()
+                finish_upload(result, upload.result)
+            while len(fetches) + len(uploads) < prefetch:
+                doc = next(docs_iter, None)
+                if doc is None:
+                    return
+                fetches.append((doc, fetch_pool.submit(fetch_document, doc=doc, s3=s3)))
+
+        submit_fetches()
+        while fetches or uploads:
+            if not fetches:
+                # Every slot is held by an upload
+                result, upload = uploads.popleft()
+                finish_upload(result, upload.result)
+                submit_fetches()
+                continue
+
+            doc, fetch = fetches.popleft()
+            result = start_document(doc)
+            inputs = load_inputs(doc, result, fetch.result)
+            # The slot of this document is taken by the next download once its inputs are loaded
+            submit_fetches()
+            if inputs is None:
+                continue
+            redacted = redact_inputs(doc, result, inputs)
+            if redacted is None:
+                continue
+            file_mime, redacted_file = redacted
+            work_dir = inputs['work_dir']
+            # Release the parsed JSON before the next document is redacted
+            del inputs
+
+            # Upload the redacted document to S3 in the background
+            uploads.append((result, upload_pool.submit(store_document, doc=doc, work_dir=work_dir, file_mime=file_mime, redacted_file=redacted_file, s3=s3, retain_docs=retain_docs)))
+
+    return results
+
+def redact_worker(docs: list, bucket: str, retain_docs: bool, log_level: str, options: dict, conn):
+    """
+    Entry point of a redaction worker process, redacts its share of the documents and sends
+    the results back to the parent process through a pipe.
+    """
+    logger.setLevel(log_level)
+    try:
+        s3 = S3(bucket=bucket, log_level=log_level)
+        conn.send(redact_documents(docs=docs, s3=s3, retain_docs=retain_docs, options=options))
+    except Exception as e:
+        logger.error(e)
+        conn.send([dict(doc=doc['doc'], status='failed', error=str(e)) for doc in docs])
+    finally:
+        conn.close()
+
+def redact_documents_parallel(docs: list, bucket: str, retain_docs: bool, log_level: str, workers: int, options: dict = None) -> list:
+    """
+    Redacts documents across a pool of worker processes, one document at a time per worker.
+
+    Lambda has no /dev/shm so multiprocessing.Pool and concurrent.futures.ProcessPoolExecutor are not
+    available, the pool is built from multiprocessing.Process and a Pipe per worker instead.
+
+    Args:
+        docs: Documents to redact
+        bucket: S3 bucket containing the documents
+        retain_docs: Whether to retain the original documents in S3
+        log_level: Logging level of the workers
+        workers: Number of worker processes
+        options: Workflow redact_options, see RedactionOptions
+
+    Returns:
+        list: Redaction result of every document
+    """
+    pool = []
+    for idx in range(workers):
+        chunk = docs[idx::workers]
+        recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=redact_worker, args=(chunk, bucket, retain_docs, log_level, options, send_conn))
+        process.start()
+        # close the parent copy so recv gets EOFError if the worker dies without sending
+        send_conn.close()
+        pool.append((chunk, process, recv_conn))
+
+    results = [None] * len(docs)
+    for idx, (chunk, process, recv_conn) in enumerate(pool):
+        try:
+            chunk_results = recv_conn.recv()
+        except EOFError:
+            # worker exited without results, e.g. killed for running out of memory
+            logger.error(f"Redaction worker exited with code {process.exitcode}")
+            chunk_results = [dict(doc=doc['doc'], status='failed', error=f"Worker exited with code {process.exitcode}") for doc in chunk]
+        finally:
+            recv_conn.close()
+            process.join()
+        # put the results back in the order of the documents
+        results[idx::workers] = chunk_results
+    return results
+
+def get_worker_count(workers: str, num_docs: int) -> int:
+    """Resolves the REDACT_WORKERS or RENDER_WORKERS setting to a number of worker processes, "auto" uses every available vCPU
+    """
+    count = (os.cpu_count() or 1) if workers == 'auto' else int(workers)
+    return max(1, min(count, num_docs))
+
 def lambda_handler(event, context):
     """
     Lambda handler function invoked by Step Functions state machine.
@@ -256,7 +1228,7 @@ def lambda_handler(event, context):
         context: Lambda context
         
     Returns:
-        dict: Status of the redaction process
+        dict: Status of the redaction process and the redaction result of every document
     """
     log_level = os.environ.get('LOG_LEVEL', 'INFO')    
     logger.setLevel(log_level)
@@ -280,56 +1252,22 @@ def lambda_handler(event, context):
     doc_prefixes = event["redact_data"]  # List of documents to redact with their Textract and Comprehend Medical outputs
     bucket = event["bucket"]  # S3 bucket containing the documents
     workflow_id = event["workflow_id"]  # Workflow ID
+    redact_options = event.get("redact_options")  # Optional render resolution and output encoding of the workflow
 
-    # Initialize S3 helper
-    s3 = S3(bucket=bucket, log_level=log_level)
-   
-    # Process each document in the list
-    for doc in doc_prefixes:
-        logger.debug(doc)
-        try:
-            # Read Textract response JSON containing document layout information
-            textract_op_content = s3.get_object_content(key=doc['txtract'])
-            textract_op = json.loads(textract_op_content)
-            logger.info("Loaded Textract JSON")
-            logger.debug(textract_op)
-            
-            # Read Comprehend Medical PHI output JSON containing detected PHI entities
-            comp_med_content = s3.get_object_content(key=doc['comp_med'])
-            comp_med = json.loads(comp_med_content)
-            logger.info("Loaded Comprehend Medical JSON")
-            logger.debug(comp_med)
-
-            # Get document information
-            document = doc['doc']  # S3 key of the original document
-            filename = os.path.basename(document)
-            temp_file = f'/tmp/{filename}'
-            
-            # Download the document to the Lambda /tmp directory
-            logger.info("Downloading document to /tmp/")
-            s3.download_file(source_object=document, destination_file=temp_file)
-        
-            # Redact the document
-            logger.info("Redacting document in /tmp/")
-            file_mime, redacted_file = redact_doc(temp_file=temp_file, textract_json=textract_op, comprehend_json=comp_med)
-
-            # Determine the S3 key for the redacted document
-            redacted_prefix = os.path.dirname(document).replace('/orig-doc','/redacted-doc')
-            s3_redacted_key = f"{redacted_prefix}/{filename}"
-
-            # Upload the redacted document to S3 and clean up temporary files
-            if redacted_file and os.path.exists(redacted_file):
-                logger.debug(f"Redaction complete. Saving {redacted_file} to S3")
-                s3.upload_file(source_file=redacted_file, destination_object=s3_redacted_key, ExtraArgs={'ContentType': file_mime})
-                
-                # Clean up temporary files and optionally delete original document
-                if clean_up(local_paths=[temp_file, redacted_file], s3_keys=[document], s3_retain_docs=retain_docs, s3=s3):
-                    logger.info("Cleanup complete...")
-            else:
-                logger.error(f"Redaction un-successful for file {document}. See logs for more details.")
-        except Exception as e:
-            logger.error(f"Error occured in redacting {doc['doc']}")
-            logger.error(e)
+    workers = get_worker_count(workers=REDACT_WORKERS, num_docs=len(doc_prefixes))
+    if workers > 1:
+        # Redact the documents across worker processes
+        logger.info(f"Redacting {len(doc_prefixes)} documents with {workers} worker processes")
+        results = redact_documents_parallel(docs=doc_prefixes, bucket=bucket, retain_docs=retain_docs, log_level=log_level, workers=workers, options=redact_options)
+    else:
+        # Initialize S3 helper. The inputs are read once and hold PHI, so they are not kept in the object cache
+        s3 = S3(bucket=bucket, log_level=log_level)
+       
+        # Process each document in the list
+        results = redact_documents(docs=doc_prefixes, s3=s3, retain_docs=retain_docs, options=redact_options)
+
+    failed = [result for result in results if result['status'] != 'redacted']
+    if failed:
+        logger.error(f"Redaction failed for {len(failed)} of {len(results)} documents")
 
-    return dict(status="done")
-  
\ No newline at end of file
+    return dict(status="done", documents=results)
@@ -0,0 +1,60 @@
+"""
+Shared fixtures of the Lambda function tests.
+
+The Lambda modules are imported from the parent directory the way the Lambda image loads them.
+AWS calls go to moto, the tests never reach AWS.
+"""
+import importlib.util
+import os
+import sys
+import threading
+
+import pytest
+# moto registers its request handler on the botocore clients created after this import, which
+# includes the module-level clients of the Lambda modules
+from moto import mock_aws
+
+LAMBDA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LAMBDA_DIR)
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+PII_TABLE = 'pii-table'
+
+def load_lambda(name: str):
+    """Imports a Lambda function module with a hyphenated file name, e.g. textract-bulk.py
+    """
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(LAMBDA_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def aws():
+    """Runs the test against moto"""
+    with mock_aws():
+        yield
+
+@pytest.fixture
+def pii_table(aws, monkeypatch):
+    """Creates the PII table with the key schema of the CDK stack"""
+    import boto3
+    import botocore.client
+    # moto evaluates condition expressions without locking, DynamoDB applies each conditional
+    # write atomically: DynamoDB calls are serialized for the tests with concurrent writers
+    make_api_call = botocore.client.BaseClient._make_api_call
+    lock = threading.Lock()
+    def atomic_make_api_call(client, operation_name, api_params):
+        if client.meta.service_model.service_name != 'dynamodb':
+            return make_api_call(client, operation_name, api_params)
+        with lock:
+            return make_api_call(client, operation_name, api_params)
+    monkeypatch.setattr(botocore.client.BaseClient, '_make_api_call', atomic_make_api_call)
+    ddb = boto3.client('dynamodb')
+    ddb.create_table(TableName=PII_TABLE,
+                     KeySchema=[{'AttributeName': 'part_key', 'KeyType': 'HASH'}, {'AttributeName': 'sort_key', 'KeyType': 'RANGE'}],
+                     AttributeDefinitions=[{'AttributeName': 'part_key', 'AttributeType': 'S'}, {'AttributeName': 'sort_key', 'AttributeType': 'S'}],
+                     BillingMode='PAY_PER_REQUEST')
+    return PII_TABLE
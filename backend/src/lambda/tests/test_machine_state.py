@@ -0,0 +1,145 @@
+import json
+import re
+from collections import Counter
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+import SQSFunctions
+from conftest import PII_TABLE, load_lambda
+
+WORKFLOW_ID = 'wf-1'
+DOCUMENTS = [f"doc-{idx}.pdf" for idx in range(25)]
+
+class FakePartiQL:
+    """
+    The PartiQL statements of machine-state on an in-memory table, moto does not bind statement
+    parameters. INSERT fails on an existing item and the UPDATE of the cursor is conditional, like DynamoDB.
+    """
+    def __init__(self):
+        self.items = {}
+
+    def execute_statement(self, Statement, Parameters, ConsistentRead=False):
+        key = (Parameters[0]['S'], Parameters[1]['S']) if not Statement.startswith('UPDATE') else (Parameters[1]['S'], Parameters[2]['S'])
+        if Statement.startswith('INSERT'):
+            if key in self.items:
+                raise ClientError({'Error': {'Code': 'DuplicateItemException', 'Message': 'Duplicate primary key exists in table'}}, 'ExecuteStatement')
+            names = re.findall(r"'(\w+)' : \?", Statement)
+            self.items[key] = dict(zip(names, Parameters), enqueue_cursor={'N': '0'})
+            return {}
+        if Statement.startswith('SELECT'):
+            assert ConsistentRead
+            return {'Items': [{'enqueue_cursor': self.items[key]['enqueue_cursor']}]}
+        if Statement.startswith('UPDATE'):
+            if self.items[key]['enqueue_cursor'] != Parameters[3]:
+                raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, 'ExecuteStatement')
+            self.items[key]['enqueue_cursor'] = Parameters[0]
+            return {}
+        raise AssertionError(f"Unexpected statement {Statement}")
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def start_execution(self, **kwargs):
+        self.calls.append(kwargs)
+        return dict(executionArn='arn:execution')
+
+    def invoke(self, **kwargs):
+        self.calls.append(kwargs)
+
+class Context:
+    """Lambda context whose remaining time drops below the margin after the given number of checks"""
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:machine-state'
+
+    def __init__(self, checks_before_timeout: int = None):
+        self.checks = 0
+        self.checks_before_timeout = checks_before_timeout
+
+    def get_remaining_time_in_millis(self):
+        self.checks += 1
+        if self.checks_before_timeout is not None and self.checks > self.checks_before_timeout:
+            return 1000
+        return 600000
+
+@pytest.fixture
+def machine_state(aws, monkeypatch):
+    module = load_lambda('machine-state')
+    sqs = boto3.client('sqs')
+    queue_url = sqs.create_queue(QueueName='pii-queue')['QueueUrl']
+    config = [{'S': WORKFLOW_ID}, {'S': f"input/{WORKFLOW_ID}/"}, {'S': 'processing'},
+              {'M': {doc: {'S': 'queued'} for doc in DOCUMENTS}}, {'N': '1'}, {'N': str(len(DOCUMENTS))},
+              {'S': 'true'}, {'S': 'true'}, {'S': 'pending'}]
+
+    class ConfigS3:
+        def __init__(self, bucket, log_level):
+            pass
+        def get_object_content(self, key):
+            return json.dumps(config).encode('utf-8')
+
+    monkeypatch.setattr(SQSFunctions, 'sqs', sqs)
+    monkeypatch.setattr(module, 'S3', ConfigS3)
+    monkeypatch.setattr(module, 'ddb', FakePartiQL())
+    monkeypatch.setattr(module, 'sfn', Recorder())
+    monkeypatch.setattr(module, 'lambda_client', Recorder())
+    monkeypatch.setattr(module, 'FANOUT_CHUNK_SIZE', 10)
+    monkeypatch.setenv('PII_TABLE', PII_TABLE)
+    monkeypatch.setenv('PII_QUEUE', queue_url)
+    monkeypatch.setenv('STATE_MACHINE', 'arn:aws:states:us-east-1:123456789012:stateMachine:pii')
+    module.queue_url = queue_url
+    return module
+
+def get_event() -> dict:
+    return {'Records': [{'s3': {'bucket': {'name': 'pii-input'}, 'object': {'key': f"workflows/{WORKFLOW_ID}.json"}}}]}
+
+def get_queued_documents(queue_url: str) -> Counter:
+    sqs = boto3.client('sqs')
+    queued = Counter()
+    while True:
+        messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, VisibilityTimeout=300).get('Messages', [])
+        if not messages:
+            return queued
+        queued.update(json.loads(message['Body'])['document_name'] for message in messages)
+
+def get_cursor(machine_state) -> int:
+    return int(machine_state.ddb.items[(WORKFLOW_ID, f"input/{WORKFLOW_ID}/")]['enqueue_cursor']['N'])
+
+def test_fanout_resumes_from_the_checkpoint(machine_state):
+    # The invocation runs out of time after its first chunk and invokes itself
+    assert machine_state.lambda_handler(get_event(), Context(checks_before_timeout=1)) == dict(Success=True, Queued=10)
+    assert get_cursor(machine_state) == 10
+    assert [call['FunctionName'] for call in machine_state.lambda_client.calls] == [Context.invoked_function_arn]
+    assert json.loads(machine_state.lambda_client.calls[0]['Payload']) == get_event()
+    assert machine_state.sfn.calls == []
+
+    # The continuation queues the remaining documents and starts the state machine
+    assert machine_state.lambda_handler(get_event(), Context()) == dict(Success=True)
+    assert get_cursor(machine_state) == len(DOCUMENTS)
+    assert get_queued_documents(machine_state.queue_url) == Counter(DOCUMENTS)
+    assert [call['name'] for call in machine_state.sfn.calls] == [f"workflow-{WORKFLOW_ID}"]
+
+def test_retry_of_a_finished_fanout_queues_nothing(machine_state):
+    machine_state.lambda_handler(get_event(), Context())
+    machine_state.lambda_handler(get_event(), Context())
+    assert get_queued_documents(machine_state.queue_url) == Counter(DOCUMENTS)
+    # Starting the execution again with the same name and input is idempotent
+    assert len(machine_state.sfn.calls) == 2
+
+def test_stale_invocation_stops_when_the_cursor_moved(machine_state, monkeypatch):
+    machine_state.lambda_handler(get_event(), Context(checks_before_timeout=1))
+    # Both the continuation and a retry of the first invocation resume from the checkpoint
+    register_workflow = machine_state.register_workflow
+    monkeypatch.setattr(machine_state, 'register_workflow', lambda table, params: 10)
+    machine_state.lambda_handler(get_event(), Context(checks_before_timeout=1))
+    assert get_cursor(machine_state) == 20
+    # The stale invocation sends its chunk again but cannot checkpoint it, and stops
+    assert machine_state.lambda_handler(get_event(), Context()) == dict(Success=True, Queued=10)
+    assert machine_state.sfn.calls == []
+
+    monkeypatch.setattr(machine_state, 'register_workflow', register_workflow)
+    machine_state.lambda_handler(get_event(), Context())
+    queued = get_queued_documents(machine_state.queue_url)
+    assert set(queued) == set(DOCUMENTS)
+    # Only the chunk sent by the stale invocation is queued twice
+    assert [doc for doc, count in queued.items() if count > 1] == DOCUMENTS[10:20]
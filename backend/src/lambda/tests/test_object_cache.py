@@ -0,0 +1,114 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import S3Functions
+from S3Functions import S3, ObjectCache
+from StorageBackends import MemoryBackend
+
+BUCKET = 'pii-input'
+MANIFEST = 'public/output/wf-1/Manifest'
+OUTPUTS = 'public/output/wf-1/'
+
+@pytest.fixture
+def backend(monkeypatch):
+    # every test starts with an empty cache
+    monkeypatch.setattr(S3Functions, 'object_cache', ObjectCache(max_bytes=1024))
+    backend = MemoryBackend()
+    backend.put_object(bucket=BUCKET, key=MANIFEST, body=b'v1')
+    backend.put_object(bucket=BUCKET, key=f"{OUTPUTS}a/redacted-doc/a.pdf", body=b'a')
+    return backend
+
+class CountingBackend:
+    """Counts the requests reaching the storage backend"""
+    def __init__(self, backend):
+        self.backend = backend
+        self.gets = 0
+        self.listings = 0
+
+    def get_object(self, **kwargs):
+        self.gets += 1
+        return self.backend.get_object(**kwargs)
+
+    def list_pages(self, **kwargs):
+        self.listings += 1
+        return self.backend.list_pages(**kwargs)
+
+def cached_s3(backend) -> tuple:
+    counting = CountingBackend(backend)
+    return S3(bucket=BUCKET, cache=True, backend=counting), counting
+
+def list_outputs(s3: S3, etag: str) -> list:
+    return s3.list_objects_cached(prefix=OUTPUTS, validator_etag=etag, search=["/redacted-doc/"])
+
+def test_cached_object_is_revalidated_by_etag(backend):
+    s3, counting = cached_s3(backend)
+    assert s3.get_object_content(key=MANIFEST) == b'v1'
+    assert s3.get_object_content(key=MANIFEST) == b'v1'
+    assert s3.cache_stats()['hits'] == 1
+    # every read is a conditional GET, a changed object is read again
+    backend.put_object(bucket=BUCKET, key=MANIFEST, body=b'v2')
+    assert s3.get_object_content(key=MANIFEST) == b'v2'
+    assert counting.gets == 3
+    assert s3.cache_stats()['misses'] == 2
+
+def test_deleted_object_is_dropped_from_the_cache(backend):
+    s3, _ = cached_s3(backend)
+    s3.get_object_content(key=MANIFEST)
+    backend.delete_object(bucket=BUCKET, key=MANIFEST)
+    with pytest.raises(ClientError):
+        s3.get_object_content(key=MANIFEST)
+    assert s3.cache_stats()['entries'] == 0
+
+def test_listing_is_cached_while_the_manifest_is_unchanged(backend):
+    s3, counting = cached_s3(backend)
+    _, etag = s3.get_object_content_and_etag(key=MANIFEST)
+    assert list_outputs(s3, etag) == [f"{OUTPUTS}a/redacted-doc/a.pdf"]
+    assert list_outputs(s3, etag) == [f"{OUTPUTS}a/redacted-doc/a.pdf"]
+    assert counting.listings == 1
+
+    # the listing is only as fresh as its validator: an output written without a new manifest is not seen
+    backend.put_object(bucket=BUCKET, key=f"{OUTPUTS}b/redacted-doc/b.pdf", body=b'b')
+    assert list_outputs(s3, etag) == [f"{OUTPUTS}a/redacted-doc/a.pdf"]
+
+    # outputs come with a new manifest, whose ETag invalidates the listing
+    backend.put_object(bucket=BUCKET, key=MANIFEST, body=b'v2')
+    _, new_etag = s3.get_object_content_and_etag(key=MANIFEST)
+    assert new_etag != etag
+    assert list_outputs(s3, new_etag) == [f"{OUTPUTS}a/redacted-doc/a.pdf", f"{OUTPUTS}b/redacted-doc/b.pdf"]
+    assert counting.listings == 2
+
+def test_stale_manifest_etag_is_never_served_a_cached_listing(backend):
+    s3, counting = cached_s3(backend)
+    _, stale_etag = s3.get_object_content_and_etag(key=MANIFEST)
+    backend.put_object(bucket=BUCKET, key=MANIFEST, body=b'v2')
+    _, etag = s3.get_object_content_and_etag(key=MANIFEST)
+    list_outputs(s3, etag)
+    # a caller holding the ETag of an older manifest lists the prefix again
+    list_outputs(s3, stale_etag)
+    assert counting.listings == 2
+    # and its listing replaced the cached one
+    list_outputs(s3, etag)
+    assert counting.listings == 3
+
+def test_cache_evicts_the_least_recently_used_bodies():
+    cache = ObjectCache(max_bytes=10)
+    cache.put(('b', 'k1'), etag='1', content=b'12345', size=5)
+    cache.put(('b', 'k2'), etag='2', content=b'12345', size=5)
+    assert cache.get(('b', 'k1'))
+    cache.put(('b', 'k3'), etag='3', content=b'12345', size=5)
+    assert cache.get(('b', 'k2')) is None
+    assert cache.get(('b', 'k1')) and cache.get(('b', 'k3'))
+    # a body larger than the cache is never stored
+    cache.put(('b', 'k4'), etag='4', content=b'x' * 11, size=11)
+    assert cache.get(('b', 'k4')) is None
+    assert cache.stats()['evictions'] == 1
+
+def test_uncached_helper_always_reads_through(backend):
+    counting = CountingBackend(backend)
+    s3 = S3(bucket=BUCKET, backend=counting)
+    s3.get_object_content(key=MANIFEST)
+    s3.get_object_content(key=MANIFEST)
+    list_outputs(s3, 'etag')
+    list_outputs(s3, 'etag')
+    assert (counting.gets, counting.listings) == (2, 2)
+    assert s3.cache_stats() == {}
@@ -0,0 +1,348 @@
+import io
+import os
+import random
+import threading
+import time
+
+import fitz
+import pytest
+from PIL import Image
+
+import redact
+from redact import RedactedDocumentWriter, RedactionBox, redact_pdf_raster
+
+PAGE_COUNT = 4
+HIT_PAGES = (2, 3)
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    """PDF with one line of PHI text per page"""
+    path = str(tmp_path / "doc.pdf")
+    with fitz.open() as pdf_document:
+        for page_num in range(1, PAGE_COUNT + 1):
+            page = pdf_document.new_page(width=300, height=200)
+            page.insert_text((20, 50), f"Patient secret page {page_num}")
+        pdf_document.save(path)
+    return path
+
+def get_page_redactions() -> dict:
+    return {page_num: [RedactionBox(page_num, 0, 0, 600, 400, f"page {page_num}")] for page_num in HIT_PAGES}
+
+def get_page_texts(path: str) -> list:
+    with fitz.open(path) as pdf_document:
+        return [page.get_text("text") for page in pdf_document]
+
+def fail_page(monkeypatch, failed_page: int):
+    """Makes rendering a page fail, in the Lambda process and in render workers, which are forked
+    from the test process so they inherit the patch"""
+    monkeypatch.setattr(redact, "RENDER_START_METHOD", "fork")
+    get_pixmap = fitz.Page.get_pixmap
+    def broken_get_pixmap(page, *args, **kwargs):
+        if page.number + 1 == failed_page:
+            raise RuntimeError("corrupt page")
+        return get_pixmap(page, *args, **kwargs)
+    monkeypatch.setattr(fitz.Page, "get_pixmap", broken_get_pixmap)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_raster_redacts_hit_pages_and_copies_the_others(pdf_path, tmp_path, workers):
+    output = str(tmp_path / "doc-redacted.pdf")
+    with RedactedDocumentWriter(local_path=output, file_mime="application/pdf") as writer:
+        redact_pdf_raster(file_path=pdf_path, page_redactions=get_page_redactions(), writer=writer, workers=workers)
+
+    texts = get_page_texts(output)
+    assert len(texts) == PAGE_COUNT
+    for page_num, text in enumerate(texts, start=1):
+        assert ("secret" in text) == (page_num not in HIT_PAGES)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_raster_fails_when_a_hit_page_does_not_render(pdf_path, tmp_path, monkeypatch, workers):
+    fail_page(monkeypatch, failed_page=3)
+    output = tmp_path / "doc-redacted.pdf"
+    with pytest.raises(Exception):
+        with RedactedDocumentWriter(local_path=str(output), file_mime="application/pdf") as writer:
+            redact_pdf_raster(file_path=pdf_path, page_redactions=get_page_redactions(), writer=writer, workers=workers)
+    # The unredacted page never reaches an output file
+    assert not output.exists()
+
+def test_parallel_render_reports_worker_errors(pdf_path, caplog):
+    # the worker of page 99 fails to load it from the 4 page document
+    rendered = redact.iter_pdf_pages_parallel(file_path=pdf_path, page_numbers=[1, 99, 3], workers=2, dpi_factor=1.0)
+    assert next(rendered)[0] == 1
+    with pytest.raises(Exception, match="page 99"):
+        next(rendered)
+    assert any(record.getMessage().startswith("Error rendering page 99") for record in caplog.records)
+
+def test_render_workers_are_not_forked_from_the_lambda_process(pdf_path, monkeypatch):
+    start_methods = []
+    get_context = redact.multiprocessing.get_context
+    def recording_get_context(method=None):
+        start_methods.append(method)
+        return get_context(method)
+    monkeypatch.setattr(redact.multiprocessing, "get_context", recording_get_context)
+    pages = [page_num for page_num, _ in redact.iter_pdf_pages_parallel(file_path=pdf_path, page_numbers=[1, 2, 3, 4], workers=2, dpi_factor=1.0)]
+    assert pages == [1, 2, 3, 4]
+    assert start_methods == ["forkserver"]
+
+def test_parallel_render_raises_on_failed_page(pdf_path, monkeypatch):
+    fail_page(monkeypatch, failed_page=2)
+    rendered = redact.iter_pdf_pages_parallel(file_path=pdf_path, page_numbers=[1, 2, 3], workers=2, dpi_factor=1.0)
+    assert next(rendered)[0] == 1
+    with pytest.raises(Exception, match="page 2"):
+        next(rendered)
+
+@pytest.mark.parametrize("compression", [None, "tiff_lzw", "group4"])
+def test_tiff_pages_are_appended_with_the_compression(tmp_path, compression, caplog):
+    output = str(tmp_path / "doc-redacted.tif")
+    sizes = [(300, 200), (200, 300), (250, 250)]
+    options = redact.RedactionOptions(tiff_compression=compression)
+    with RedactedDocumentWriter(local_path=output, file_mime="image/tiff", options=options) as writer:
+        for size in sizes:
+            writer.add_page(Image.new("RGB", size, "white"))
+    with Image.open(output) as img:
+        assert img.n_frames == len(sizes)
+        for idx, size in enumerate(sizes):
+            img.seek(idx)
+            assert img.size == size
+            assert img.info["compression"] == (compression or "raw")
+            assert img.mode == ("1" if compression == "group4" else "RGB")
+    # RGB pages are thresholded for CCITT compression, once logged per document
+    thresholded = [record for record in caplog.records if "Thresholding" in record.getMessage()]
+    assert len(thresholded) == (1 if compression == "group4" else 0)
+
+@pytest.mark.parametrize("prefetch", [0, 1, 2])
+def test_prefetch_bounds_the_documents_in_flight(monkeypatch, prefetch):
+    docs = [dict(doc=f"public/workflows/wf-1/orig-doc/doc-{idx}.pdf") for idx in range(6)]
+    lock = threading.Lock()
+    in_flight = []
+    peak = [0]
+    def track(doc: str, delta: int):
+        with lock:
+            if delta > 0:
+                in_flight.append(doc)
+            else:
+                in_flight.remove(doc)
+            peak[0] = max(peak[0], len(in_flight))
+
+    # A document is in flight from the start of its download until its upload completes
+    def fetch_document(doc, s3):
+        track(doc['doc'], 1)
+        time.sleep(0.01)
+        return dict(work_dir=doc['doc'], temp_file=doc['doc'], lines=None, words=None, comprehend_json={}, fetch_time=0.01)
+    def redact_doc(temp_file, **kwargs):
+        time.sleep(0.03)
+        return "application/pdf", temp_file
+    def store_document(doc, work_dir, **kwargs):
+        time.sleep(0.02)
+        track(doc['doc'], -1)
+        return work_dir, 0.02
+    monkeypatch.setattr(redact, "fetch_document", fetch_document)
+    monkeypatch.setattr(redact, "redact_doc", redact_doc)
+    monkeypatch.setattr(redact, "store_document", store_document)
+
+    results = redact.redact_documents(docs=docs, s3=None, retain_docs=True, prefetch=prefetch)
+    assert [(result['doc'], result['status']) for result in results] == [(doc['doc'], 'redacted') for doc in docs]
+    assert peak[0] == prefetch + 1
+
+def test_render_settings_fit_one_memory_budget():
+    # a letter page at 300 DPI, ~24 MB of RGB pixels
+    dimensions = [redact.DocumentDimensions(doc_width=2550, doc_height=3300)] * 8
+    page_mb = 2550 * 3300 * 3 / (1024 * 1024)
+    assert redact.fit_render_settings(document_dimensions=dimensions, dpi_factor=300 / 72, workers="4", memory_mb=1024) == (300 / 72, 4)
+    # workers are dropped first, each holds two pages on top of the two of the Lambda process
+    dpi_factor, workers = redact.fit_render_settings(document_dimensions=dimensions, dpi_factor=300 / 72, workers="4", memory_mb=200)
+    assert (dpi_factor, workers) == (300 / 72, 3)
+    assert page_mb * (2 + 2 * workers) <= 200
+    # then the resolution is lowered, not below 72 DPI
+    dpi_factor, workers = redact.fit_render_settings(document_dimensions=dimensions, dpi_factor=300 / 72, workers="4", memory_mb=30)
+    assert workers == 1
+    assert dpi_factor == pytest.approx(300 / 72 * (30 / (2 * page_mb)) ** 0.5)
+    assert redact.fit_render_settings(document_dimensions=dimensions, dpi_factor=300 / 72, workers="auto", memory_mb=1)[0] == redact.MIN_DPI_FACTOR
+
+def matches_by_nested_loop(text: str, entities: list) -> bool:
+    """Line matching of the nested entity loop the matcher replaced"""
+    text = text.lower()
+    return any(entity.lower() in text or text in entity.lower() for entity in entities)
+
+@pytest.mark.parametrize("entities, text, expected", [
+    # overlapping terms sharing prefixes and suffixes, found through the failure links
+    (["he", "she", "his", "hers"], "ushers", True),
+    (["abcd", "bcx"], "zabcxz", True),
+    (["abcd", "bc"], "xbcx", True),
+    (["abcd", "bcx"], "abcabd", False),
+    # case folding of the line and the entities
+    (["John Smith"], "PATIENT: JOHN SMITH", True),
+    (["MRN 12345"], "mrn 12345", True),
+    # a line inside an entity, never across two entities
+    (["John Smith MD"], "Smith", True),
+    (["ab", "cd"], "b", True),
+    (["ab", "cd"], "bc", False),
+    # word boundaries: the entity at the start or end of the line or spanning words, and inside a
+    # longer word like the nested loop
+    (["Smith"], "Smith, John", True),
+    (["Smith"], "Dr. Smith", True),
+    (["Jane Doe"], "Seen by Jane Doe today", True),
+    (["Ann"], "Annual visit", True),
+    (["Jane Doe"], "Jane  Doe", False),
+    (["Jane Doe"], "Doe, Jane", False),
+    # no entities, or an empty entity which every line contains
+    ([], "John Smith", False),
+    ([""], "John Smith", True),
+])
+def test_entity_matcher(entities, text, expected):
+    assert redact.EntityMatcher(entities=entities).matches(text) == expected
+    assert matches_by_nested_loop(text, entities) == expected
+
+def test_entity_matcher_matches_the_nested_loop():
+    rng = random.Random(7)
+    def random_text(size: int) -> str:
+        return "".join(rng.choice("abAB c") for _ in range(size))
+    for _ in range(300):
+        entities = [random_text(rng.randint(1, 5)) for _ in range(rng.randint(0, 6))]
+        matcher = redact.EntityMatcher(entities=entities)
+        for _ in range(20):
+            text = random_text(rng.randint(0, 10))
+            # twice, the second result is memoized
+            assert matcher.matches(text) == matcher.matches(text) == matches_by_nested_loop(text, entities), (entities, text)
+
+def box(xmin: int, ymin: int, xmax: int, ymax: int, text: str = "phi") -> RedactionBox:
+    return RedactionBox(1, xmin, ymin, xmax, ymax, text)
+
+def covered_pixels(boxes: list) -> set:
+    return {(x, y) for b in boxes for x in range(b.xmin, b.xmax) for y in range(b.ymin, b.ymax)}
+
+def test_merge_boxes_joins_touching_words_of_a_line():
+    merged = redact.merge_boxes([box(50, 10, 80, 30, "Smith"), box(10, 12, 40, 30, "John"), box(40, 10, 49, 28, ",")])
+    assert merged == [box(10, 10, 80, 30, "John , Smith")]
+
+def test_merge_boxes_keeps_gaps_and_lines_apart():
+    words = [box(10, 10, 40, 30), box(42, 10, 60, 30),      # 2 px apart on the first line
+             box(10, 35, 40, 55), box(38, 36, 70, 54)]      # overlapping on the second line
+    merged = redact.merge_boxes(words)
+    assert merged == [box(10, 10, 40, 30), box(42, 10, 60, 30), box(10, 35, 70, 55, "phi phi")]
+
+def test_merge_boxes_needs_half_the_height_to_share_a_line():
+    # a subscript overlapping the word by half of its own height joins the line, a box overlapping less does not
+    assert redact.merge_boxes([box(10, 10, 40, 30), box(40, 25, 50, 35)]) == [box(10, 10, 50, 35, "phi phi")]
+    assert redact.merge_boxes([box(10, 10, 40, 30), box(40, 26, 50, 36)]) == [box(10, 10, 40, 30), box(40, 26, 50, 36)]
+
+def test_merge_boxes_never_uncovers_a_pixel():
+    rng = random.Random(5)
+    for _ in range(200):
+        boxes = []
+        for _ in range(rng.randint(0, 8)):
+            xmin, ymin = rng.randint(0, 40), rng.randint(0, 40)
+            boxes.append(box(xmin, ymin, xmin + rng.randint(1, 15), ymin + rng.randint(1, 10)))
+        merged = redact.merge_boxes(boxes)
+        assert len(merged) <= len(boxes)
+        assert covered_pixels(boxes) <= covered_pixels(merged)
+
+def test_redactions_are_grouped_and_merged_by_page():
+    redactions = [RedactionBox(2, 10, 10, 40, 30, "John"), RedactionBox(1, 10, 10, 40, 30, "MRN"), RedactionBox(2, 41, 10, 70, 30, "Smith")]
+    assert redact.group_redactions_by_page(redactions) == {1: [RedactionBox(1, 10, 10, 40, 30, "MRN")],
+                                                           2: [RedactionBox(2, 10, 10, 70, 30, "John Smith")]}
+
+@pytest.mark.parametrize("rotation", [0, 90])
+def test_vector_redaction_removes_the_text(tmp_path, rotation):
+    path = str(tmp_path / "notes.pdf")
+    with fitz.open() as pdf_document:
+        page = pdf_document.new_page(width=400, height=300)
+        page.insert_text((20, 50), "Patient John Smith")
+        page.insert_text((20, 100), "Visit notes follow")
+        page.set_rotation(rotation)
+        # the boxes are in pixels of the rendered, rotated, page like the Textract boxes
+        rect = page.search_for("John Smith")[0] * page.rotation_matrix * redact.PDF_DPI_FACTOR
+        pdf_document.save(path)
+    boxes = {1: [RedactionBox(1, int(rect.x0), int(rect.y0), int(rect.x1) + 1, int(rect.y1) + 1, "John Smith")]}
+
+    output = str(tmp_path / "notes-redacted.pdf")
+    with RedactedDocumentWriter(local_path=output, file_mime="application/pdf") as writer:
+        redact.redact_pdf(file_path=path, page_redactions=boxes, writer=writer)
+
+    with fitz.open(output) as pdf_document:
+        assert len(pdf_document) == 1
+        page = pdf_document[0]
+        text = page.get_text("text")
+        # the PHI is gone from the text layer, the rest of the page stays text
+        assert "John" not in text and "Smith" not in text
+        assert "Patient" in text and "Visit notes follow" in text
+        assert page.rotation == rotation
+
+def test_vector_redaction_rasterizes_scanned_pages(tmp_path):
+    path = str(tmp_path / "scan.pdf")
+    scan = Image.new("RGB", (400, 300), "white")
+    buffer = io.BytesIO()
+    scan.save(buffer, format="PNG")
+    with fitz.open() as pdf_document:
+        pdf_document.new_page(width=400, height=300).insert_image(fitz.Rect(0, 0, 400, 300), stream=buffer.getvalue())
+        pdf_document.new_page(width=400, height=300).insert_text((20, 50), "No PHI here")
+        pdf_document.save(path)
+    box_px = RedactionBox(1, 100, 100, 300, 200, "scanned PHI")
+
+    output = str(tmp_path / "scan-redacted.pdf")
+    with RedactedDocumentWriter(local_path=output, file_mime="application/pdf") as writer:
+        redact.redact_pdf(file_path=path, page_redactions={1: [box_px]}, writer=writer)
+
+    with fitz.open(output) as pdf_document:
+        assert len(pdf_document) == 2
+        assert pdf_document[1].get_text("text").strip() == "No PHI here"
+        pix = pdf_document[0].get_pixmap(matrix=fitz.Matrix(redact.PDF_DPI_FACTOR, redact.PDF_DPI_FACTOR), alpha=False)
+        # the redacted area of the scan is black, the rest stays white
+        assert pix.pixel(200, 150)[:3] == (0, 0, 0)
+        assert pix.pixel(20, 20)[:3] == (255, 255, 255)
+
+@pytest.fixture
+def tiff_path(tmp_path):
+    """Three page TIFF, every page filled with its own gray level"""
+    path = str(tmp_path / "scan.tif")
+    pages = [Image.new("L", (60, 40), level) for level in (10, 120, 230)]
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+    return path
+
+def test_pil_images_of_every_frame(tiff_path):
+    file_mime, images = redact.get_pil_img(tiff_path)
+    assert file_mime == "image/tiff"
+    # every frame is its own image, not the reused frame of the TIFF iterator
+    assert [img.getpixel((0, 0)) for img in images] == [10, 120, 230]
+    assert len({id(img) for img in images}) == 3
+
+def test_pages_are_streamed_one_at_a_time(tiff_path):
+    pages = redact.iter_pil_img(tiff_path, file_mime="image/tiff")
+    page_num, first = next(pages)
+    assert (page_num, first.getpixel((0, 0))) == (1, 10)
+    # a yielded page stays valid while the next ones are read
+    assert [(page_num, img.getpixel((0, 0))) for page_num, img in pages] == [(2, 120), (3, 230)]
+    assert first.getpixel((0, 0)) == 10
+
+@pytest.mark.parametrize("pdf_image_format", ["jpeg", "png"])
+def test_writer_streams_pages_into_a_pdf(tmp_path, pdf_image_format):
+    output = str(tmp_path / "doc-redacted.pdf")
+    options = redact.RedactionOptions(pdf_image_format=pdf_image_format)
+    with RedactedDocumentWriter(local_path=output, file_mime="application/pdf", dpi_factor=2.0, options=options) as writer:
+        writer.add_page(Image.new("RGB", (400, 300), "white"))
+        writer.add_page(Image.new("RGB", (300, 400), "black"))
+        # nothing is written before the document is complete
+        assert not os.path.exists(output)
+    assert writer.page_count == 2
+    with fitz.open(output) as pdf_document:
+        # the physical page size of the original document is kept
+        assert [tuple(page.rect)[2:] for page in pdf_document] == [(200, 150), (150, 200)]
+        assert pdf_document[0].get_images()[0][8] == ("DCTDecode" if pdf_image_format == "jpeg" else "FlateDecode")
+
+def test_writer_discards_a_failed_pdf(tmp_path):
+    output = tmp_path / "doc-redacted.pdf"
+    with pytest.raises(RuntimeError):
+        with RedactedDocumentWriter(local_path=str(output), file_mime="application/pdf") as writer:
+            writer.add_page(Image.new("RGB", (100, 100), "white"))
+            raise RuntimeError("redaction failed")
+    assert not output.exists()
+
+@pytest.mark.parametrize("file_mime, suffix", [("image/jpeg", ".jpg"), ("image/png", ".png")])
+def test_writer_saves_single_page_images(tmp_path, file_mime, suffix):
+    output = str(tmp_path / f"photo-redacted{suffix}")
+    with RedactedDocumentWriter(local_path=output, file_mime=file_mime) as writer:
+        writer.add_page(Image.new("RGB", (80, 60), "white"))
+        with pytest.raises(Exception, match="more than one page"):
+            writer.add_page(Image.new("RGB", (80, 60), "white"))
+    with Image.open(output) as img:
+        assert img.size == (80, 60)
+        assert img.format == ("JPEG" if file_mime == "image/jpeg" else "PNG")
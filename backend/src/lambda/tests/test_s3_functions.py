@@ -0,0 +1,73 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import S3Functions
+from StorageBackends import MemoryBackend
+
+BUCKET = 'pii-input'
+
+def client_error(code: str, status: int = 400) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'CopyObject')
+
+class FlakyBackend(MemoryBackend):
+    """Memory backend whose requests fail, or whose DeleteObjects reports keys as failed"""
+    def __init__(self, copy_error: Exception = None, delete_error: Exception = None, key_errors: list = None):
+        super().__init__()
+        self.copy_error = copy_error
+        self.delete_error = delete_error
+        self.key_errors = list(key_errors or [])
+        self.copies, self.deletes = [], []
+
+    def copy_object(self, bucket: str, source_key: str, destination_key: str, managed: bool = False):
+        self.copies.append(source_key)
+        if self.copy_error:
+            raise self.copy_error
+        super().copy_object(bucket=bucket, source_key=source_key, destination_key=destination_key, managed=managed)
+
+    def delete_objects(self, bucket: str, keys: list) -> list:
+        self.deletes.append(list(keys))
+        if self.delete_error:
+            raise self.delete_error
+        errors = self.key_errors.pop(0) if self.key_errors else {}
+        for key in keys:
+            if key not in errors:
+                self.delete_object(bucket=bucket, key=key)
+        return [dict(Key=key, Code=code, Message=code) for key, code in errors.items() if key in keys]
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(S3Functions, 'backoff', lambda attempt: None)
+
+def get_s3(backend: MemoryBackend, keys: list) -> S3Functions.S3:
+    for key in keys:
+        backend.put_object(bucket=BUCKET, key=key, body=key.encode('utf-8'))
+    return S3Functions.S3(bucket=BUCKET, backend=backend)
+
+def test_failed_copy_is_not_retried_by_the_helper():
+    # Throttled requests are already retried by the client, up to S3_MAX_ATTEMPTS
+    backend = FlakyBackend(copy_error=client_error('SlowDown', 503))
+    report = get_s3(backend, ['a.pdf']).copy_objects_bulk(pairs=[('a.pdf', 'b.pdf')])
+    assert report['a.pdf']['status'] == 'failed'
+    assert backend.copies == ['a.pdf']
+
+def test_failed_delete_request_is_not_retried_by_the_helper():
+    backend = FlakyBackend(delete_error=client_error('SlowDown', 503))
+    report = get_s3(backend, ['a.pdf', 'b.pdf']).delete_objects_bulk(keys=['a.pdf', 'b.pdf'])
+    assert {result['status'] for result in report.values()} == {'failed'}
+    assert len(backend.deletes) == 1
+
+def test_keys_reported_failed_are_retried(monkeypatch):
+    monkeypatch.setattr(S3Functions, 'BULK_ATTEMPTS', 3)
+    backend = FlakyBackend(key_errors=[{'b.pdf': 'SlowDown', 'c.pdf': 'AccessDenied'}, {'b.pdf': 'InternalError'}])
+    report = get_s3(backend, ['a.pdf', 'b.pdf', 'c.pdf']).delete_objects_bulk(keys=['a.pdf', 'b.pdf', 'c.pdf'])
+    assert report['a.pdf'] == dict(status='deleted')
+    assert report['b.pdf'] == dict(status='deleted')
+    assert report['c.pdf'] == dict(status='failed', error='AccessDenied: AccessDenied')
+    assert backend.deletes == [['a.pdf', 'b.pdf', 'c.pdf'], ['b.pdf'], ['b.pdf']]
+
+def test_key_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(S3Functions, 'BULK_ATTEMPTS', 2)
+    backend = FlakyBackend(key_errors=[{'a.pdf': 'SlowDown'}] * 5)
+    report = get_s3(backend, ['a.pdf']).delete_objects_bulk(keys=['a.pdf'])
+    assert report['a.pdf'] == dict(status='failed', error='SlowDown: SlowDown')
+    assert len(backend.deletes) == 2
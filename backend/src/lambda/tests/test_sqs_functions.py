@@ -0,0 +1,102 @@
+import threading
+
+import boto3
+import pytest
+
+import SQSFunctions
+
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/pii-queue'
+
+class FakeSQS:
+    """Records the batch requests and fails the entries asked for, by entry Id and attempt"""
+    def __init__(self, failures: dict = None, sender_fault: set = ()):
+        self.failures = failures or {}
+        self.sender_fault = set(sender_fault)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def batch(self, QueueUrl, Entries):
+        with self.lock:
+            self.requests.append([dict(entry) for entry in Entries])
+            failed = []
+            for entry in Entries:
+                if entry['Id'] in self.sender_fault:
+                    failed.append(dict(Id=entry['Id'], SenderFault=True, Code='ReceiptHandleIsInvalid', Message='invalid'))
+                elif self.failures.get(entry['Id'], 0) > 0:
+                    self.failures[entry['Id']] -= 1
+                    failed.append(dict(Id=entry['Id'], SenderFault=False, Code='InternalError', Message='retry'))
+        return dict(Successful=[dict(Id=entry['Id']) for entry in Entries if entry['Id'] not in {f['Id'] for f in failed}], Failed=failed)
+
+    send_message_batch = delete_message_batch = change_message_visibility_batch = batch
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(SQSFunctions, 'backoff', lambda attempt: None)
+
+@pytest.fixture
+def fake_sqs(monkeypatch):
+    def install(**kwargs):
+        fake = FakeSQS(**kwargs)
+        monkeypatch.setattr(SQSFunctions, 'sqs', fake)
+        return fake
+    return install
+
+def test_messages_are_sent_in_batches_of_ten(fake_sqs):
+    fake = fake_sqs()
+    bodies = [f"doc-{idx}" for idx in range(25)]
+    assert SQSFunctions.send_messages(QUEUE_URL, bodies, workers=3) == []
+    assert sorted(len(request) for request in fake.requests) == [5, 10, 10]
+    assert sorted(entry['MessageBody'] for request in fake.requests for entry in request) == sorted(bodies)
+
+def test_only_failed_entries_are_resent(fake_sqs):
+    # entry 3 fails once, entry 7 twice
+    fake = fake_sqs(failures={'3': 1, '7': 2})
+    assert SQSFunctions.send_messages(QUEUE_URL, [f"doc-{idx}" for idx in range(10)], workers=1) == []
+    assert [[entry['Id'] for entry in request] for request in fake.requests] == [[str(idx) for idx in range(10)], ['3', '7'], ['7']]
+
+def test_entries_stop_after_the_batch_attempts(fake_sqs):
+    fake = fake_sqs(failures={'1': 10})
+    handles = [f"handle-{idx}" for idx in range(4)]
+    assert SQSFunctions.delete_messages(QUEUE_URL, handles, workers=1) == ['handle-1']
+    assert len(fake.requests) == SQSFunctions.SQS_BATCH_ATTEMPTS
+    assert fake.requests[1:] == [[dict(Id='1', ReceiptHandle='handle-1')]] * (SQSFunctions.SQS_BATCH_ATTEMPTS - 1)
+
+def test_sender_faults_are_not_retried(fake_sqs):
+    fake = fake_sqs(sender_fault={'0'})
+    assert SQSFunctions.change_message_visibility(QUEUE_URL, ['handle-0', 'handle-1'], [60, 120], workers=1) == ['handle-0']
+    assert fake.requests == [[dict(Id='0', ReceiptHandle='handle-0', VisibilityTimeout=60), dict(Id='1', ReceiptHandle='handle-1', VisibilityTimeout=120)]]
+
+def test_failed_requests_are_retried_as_a_whole():
+    calls = []
+    def operation(QueueUrl, Entries):
+        calls.append(len(Entries))
+        if len(calls) == 1:
+            raise ConnectionError("connection reset")
+        return dict(Successful=[dict(Id=entry['Id']) for entry in Entries], Failed=[])
+    assert SQSFunctions.run_batch(operation, QUEUE_URL, [dict(Id=str(idx)) for idx in range(3)]) == []
+    assert calls == [3, 3]
+
+def test_group_ids_are_passed_through(fake_sqs):
+    fake = fake_sqs()
+    assert SQSFunctions.send_messages(QUEUE_URL, ['a', 'b', 'c'], group_ids=['wf-1', 'wf-2', 'wf-1']) == []
+    assert [(entry['MessageBody'], entry['MessageGroupId']) for entry in fake.requests[0]] == [('a', 'wf-1'), ('b', 'wf-2'), ('c', 'wf-1')]
+    assert SQSFunctions.send_messages(QUEUE_URL, ['d']) == []
+    assert 'MessageGroupId' not in fake.requests[1][0]
+
+def test_round_trip_on_a_queue(aws, monkeypatch):
+    sqs = boto3.client('sqs')
+    monkeypatch.setattr(SQSFunctions, 'sqs', sqs)
+    queue_url = sqs.create_queue(QueueName='pii-queue')['QueueUrl']
+    bodies = [f"doc-{idx}" for idx in range(23)]
+    assert SQSFunctions.send_messages(queue_url, bodies, group_ids=[f"wf-{idx % 2}" for idx in range(23)]) == []
+
+    received = []
+    while len(received) < len(bodies):
+        received += sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, VisibilityTimeout=30).get('Messages', [])
+    assert sorted(message['Body'] for message in received) == sorted(bodies)
+
+    handles = [message['ReceiptHandle'] for message in received]
+    assert SQSFunctions.change_message_visibility(queue_url, handles[:12], [0] * 12) == []
+    assert SQSFunctions.delete_messages(queue_url, handles[12:]) == []
+    remaining = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['ApproximateNumberOfMessages'])['Attributes']
+    assert remaining['ApproximateNumberOfMessages'] == '12'
@@ -0,0 +1,93 @@
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+import StorageBackends
+from StorageBackends import LocalBackend, MemoryBackend, S3Backend, StorageBackend
+
+BUCKET = 'pii-input'
+KEYS = ['public/output/wf-1/a.json', 'public/output/wf-1/b/c.json', 'public/output/wf-1/b/d.json', 'public/output/wf-2/e.json', 'public/temp/f.json']
+
+@pytest.fixture(params=['s3', 'local', 'memory'])
+def backend(request, tmp_path):
+    if request.param == 's3':
+        request.getfixturevalue('aws')
+        client = boto3.client('s3')
+        client.create_bucket(Bucket=BUCKET)
+        backend = S3Backend(client=client)
+    elif request.param == 'local':
+        backend = LocalBackend(root=str(tmp_path))
+    else:
+        backend = MemoryBackend()
+    for key in KEYS:
+        backend.put_object(bucket=BUCKET, key=key, body=key.encode('utf-8'))
+    return backend
+
+def read(stored) -> bytes:
+    with stored.body as body:
+        return body.read()
+
+def error_code(error: ClientError) -> str:
+    return error.response['Error']['Code']
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class ListOnlyBackend(StorageBackend):
+        def list_pages(self, bucket, prefix, start_after=None, page_size=1000):
+            yield []
+    with pytest.raises(TypeError):
+        ListOnlyBackend()
+
+def test_list_pages(backend):
+    pages = list(backend.list_pages(bucket=BUCKET, prefix='public/output/', page_size=2))
+    assert [len(page) for page in pages] == [2, 2]
+    assert [key for page in pages for key in page] == KEYS[:4]
+    assert [key for page in backend.list_pages(bucket=BUCKET, prefix='public/output/', start_after=KEYS[1]) for key in page] == KEYS[2:4]
+
+def test_list_common_prefixes(backend):
+    assert list(backend.list_common_prefixes(bucket=BUCKET, prefix='public/output/')) == ['public/output/wf-1/', 'public/output/wf-2/']
+    assert list(backend.list_common_prefixes(bucket=BUCKET, prefix='public/output/wf-1/')) == ['public/output/wf-1/b/']
+
+def test_get_object_and_ranges(backend):
+    stored = backend.get_object(bucket=BUCKET, key=KEYS[0])
+    assert read(stored) == KEYS[0].encode('utf-8')
+    assert stored.size == len(KEYS[0])
+    assert read(backend.get_object(bucket=BUCKET, key=KEYS[0], byte_range=(7, 12))) == b'output'
+    assert read(backend.get_object(bucket=BUCKET, key=KEYS[0], byte_range=(19, None))) == b'a.json'
+
+def test_etags_and_conditional_get(backend):
+    etag = backend.get_object(bucket=BUCKET, key=KEYS[0]).etag
+    with pytest.raises(ClientError) as error:
+        backend.get_object(bucket=BUCKET, key=KEYS[0], if_none_match=etag)
+    assert error_code(error.value) in ('304', 'NotModified')
+
+    new_etag = backend.put_object(bucket=BUCKET, key=KEYS[0], body=b'changed')
+    assert new_etag != etag
+    assert read(backend.get_object(bucket=BUCKET, key=KEYS[0], if_none_match=etag)) == b'changed'
+
+def test_missing_object(backend):
+    with pytest.raises(ClientError) as error:
+        backend.get_object(bucket=BUCKET, key='public/missing.json')
+    assert error_code(error.value) == 'NoSuchKey'
+
+def test_copy_and_delete(backend, tmp_path):
+    backend.copy_object(bucket=BUCKET, source_key=KEYS[0], destination_key='public/copy.json')
+    assert read(backend.get_object(bucket=BUCKET, key='public/copy.json')) == KEYS[0].encode('utf-8')
+
+    backend.delete_object(bucket=BUCKET, key='public/copy.json')
+    # missing objects are ignored
+    backend.delete_object(bucket=BUCKET, key='public/copy.json')
+    assert backend.delete_objects(bucket=BUCKET, keys=KEYS[:2]) == []
+    assert [key for page in backend.list_pages(bucket=BUCKET, prefix='public/') for key in page] == KEYS[2:]
+
+def test_file_transfers(backend, tmp_path):
+    source = tmp_path / 'upload.bin'
+    source.write_bytes(b'\x00\x01' * 1024)
+    backend.upload_file(source_file=str(source), bucket=BUCKET, key='public/upload.bin')
+    destination = tmp_path / 'download.bin'
+    backend.download_file(bucket=BUCKET, key='public/upload.bin', destination_file=str(destination))
+    assert destination.read_bytes() == source.read_bytes()
+
+def test_get_storage_backend():
+    assert isinstance(StorageBackends.get_storage_backend('memory'), MemoryBackend)
+    with pytest.raises(ValueError):
+        StorageBackends.get_storage_backend('ftp')
@@ -0,0 +1,87 @@
+import json
+import threading
+
+import boto3
+import pytest
+
+import TextractSubmitter
+from conftest import PII_TABLE
+
+def get_doc(idx: int) -> dict:
+    return dict(workflow_id='wf-1', input_path='input/wf-1/', document_name=f"doc-{idx}.pdf")
+
+@pytest.fixture
+def submitter(pii_table, monkeypatch):
+    monkeypatch.setattr(TextractSubmitter, 'rate_limiter', TextractSubmitter.TokenBucket(rate=1000))
+    monkeypatch.setattr(TextractSubmitter, 'TEXTRACT_SHARED_RATE_LIMIT', False)
+    monkeypatch.setattr(TextractSubmitter.acquire_account_rate, '__defaults__', (TextractSubmitter.TEXTRACT_TPS, False))
+    started = []
+    lock = threading.Lock()
+    def start_document_analysis(doc, env_vars):
+        if doc['document_name'] == 'doc-bad.pdf':
+            raise RuntimeError('invalid document')
+        with lock:
+            started.append(doc['document_name'])
+        return f"job-{doc['document_name']}"
+    monkeypatch.setattr(TextractSubmitter, 'start_document_analysis', start_document_analysis)
+    TextractSubmitter.started = started
+    return TextractSubmitter
+
+@pytest.fixture
+def queue(aws):
+    sqs = boto3.client('sqs')
+    return sqs.create_queue(QueueName='pii-queue')['QueueUrl']
+
+def get_ledger(doc: dict) -> dict:
+    return boto3.client('dynamodb').get_item(TableName=PII_TABLE, Key=TextractSubmitter.get_submission_key(doc), ConsistentRead=True)['Item']
+
+def test_duplicate_delivery_is_skipped(submitter):
+    env_vars = dict(PII_TABLE=PII_TABLE)
+    first = submitter.submit_document(doc=get_doc(1), env_vars=env_vars)
+    second = submitter.submit_document(doc=get_doc(1), env_vars=env_vars)
+    assert first == dict(status='submitted', job_id='job-doc-1.pdf')
+    assert second == dict(status='duplicate', job_id='job-doc-1.pdf')
+    assert submitter.started == ['doc-1.pdf']
+    assert get_ledger(get_doc(1))['job_id'] == {'S': 'job-doc-1.pdf'}
+
+def test_document_being_submitted_is_left_for_its_consumer(submitter):
+    assert submitter.claim_submission(table=PII_TABLE, doc=get_doc(1), claim_id='other')['status'] == 'claimed'
+    assert submitter.submit_document(doc=get_doc(1), env_vars=dict(PII_TABLE=PII_TABLE)) == dict(status='in_progress')
+    assert submitter.started == []
+
+def test_concurrent_consumers_submit_each_document_once(submitter, queue):
+    sqs = boto3.client('sqs')
+    # Every document is delivered three times
+    for _ in range(3):
+        for idx in range(20):
+            sqs.send_message(QueueUrl=queue, MessageBody=json.dumps(get_doc(idx)))
+    env_vars = dict(PII_TABLE=PII_TABLE, PII_QUEUE=queue)
+
+    def consumer():
+        while submitter.get_msg_submit({}, env_vars, 10) or int(sqs.get_queue_attributes(QueueUrl=queue, AttributeNames=['ApproximateNumberOfMessages'])['Attributes']['ApproximateNumberOfMessages']):
+            pass
+    threads = [threading.Thread(target=consumer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(submitter.started) == sorted(f"doc-{idx}.pdf" for idx in range(20))
+
+def test_failed_document_stays_queued_until_its_last_receive(submitter, queue, monkeypatch):
+    monkeypatch.setattr(submitter, 'TEXTRACT_SUBMIT_MAX_RECEIVES', 2)
+    monkeypatch.setattr(submitter.defer_messages, '__defaults__', (0,))
+    sqs = boto3.client('sqs')
+    bad = dict(workflow_id='wf-1', input_path='input/wf-1/', document_name='doc-bad.pdf')
+    sqs.send_message(QueueUrl=queue, MessageBody=json.dumps(bad))
+    env_vars = dict(PII_TABLE=PII_TABLE, PII_QUEUE=queue)
+
+    submitter.get_msg_submit({}, env_vars, 10)
+    assert get_ledger(bad)['submission_status'] == {'S': 'released'}
+    assert sqs.get_queue_attributes(QueueUrl=queue, AttributeNames=['ApproximateNumberOfMessages'])['Attributes']['ApproximateNumberOfMessages'] == '1'
+
+    submitter.get_msg_submit({}, env_vars, 10)
+    assert get_ledger(bad)['submission_status'] == {'S': 'failed'}
+    attributes = sqs.get_queue_attributes(QueueUrl=queue, AttributeNames=['All'])['Attributes']
+    assert attributes['ApproximateNumberOfMessages'] == '0'
+    assert attributes['ApproximateNumberOfMessagesNotVisible'] == '0'
@@ -0,0 +1,71 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+
+from conftest import load_lambda
+
+WORKFLOW_ID = 'wf-1'
+
+@pytest.fixture
+def bulk(pii_table):
+    module = load_lambda('textract-bulk')
+    module.ddb.put_item(TableName=pii_table,
+                        Item=dict(module.get_workflow_key(WORKFLOW_ID),
+                                  total_files={'N': '3'},
+                                  submit_ts={'N': '1'},
+                                  workflow_token={'S': 'token-1'}))
+    return module
+
+def get_workflow(bulk, table):
+    return boto3.client('dynamodb').get_item(TableName=table, Key=bulk.get_workflow_key(WORKFLOW_ID), ConsistentRead=True)['Item']
+
+def test_redelivered_job_is_counted_once(bulk, pii_table):
+    assert bulk.count_completed_job(table=pii_table, workflow_id=WORKFLOW_ID, job_id='job-1')
+    assert not bulk.count_completed_job(table=pii_table, workflow_id=WORKFLOW_ID, job_id='job-1')
+    assert bulk.count_completed_job(table=pii_table, workflow_id=WORKFLOW_ID, job_id='job-2')
+
+    item = get_workflow(bulk, pii_table)
+    assert item['completed_files'] == {'N': '2'}
+    # The workflow item does not keep the job IDs
+    assert 'completed_jobs' not in item
+
+def test_job_of_unknown_workflow_is_not_counted(bulk, pii_table):
+    assert not bulk.count_completed_job(table=pii_table, workflow_id='missing', job_id='job-1')
+
+def test_completion_is_claimed_once_after_the_last_job(bulk, pii_table):
+    for job_id in ('job-1', 'job-2'):
+        bulk.count_completed_job(table=pii_table, workflow_id=WORKFLOW_ID, job_id=job_id)
+    assert bulk.claim_workflow_completion(table=pii_table, workflow_id=WORKFLOW_ID) is None
+
+    bulk.count_completed_job(table=pii_table, workflow_id=WORKFLOW_ID, job_id='job-3')
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        tokens = list(pool.map(lambda _: bulk.claim_workflow_completion(table=pii_table, workflow_id=WORKFLOW_ID), range(4)))
+    assert tokens.count('token-1') == 1
+    assert tokens.count(None) == 3
+
+def test_released_completion_can_be_claimed_again(bulk, pii_table):
+    for job_id in ('job-1', 'job-2', 'job-3'):
+        bulk.count_completed_job(table=pii_table, workflow_id=WORKFLOW_ID, job_id=job_id)
+    assert bulk.claim_workflow_completion(table=pii_table, workflow_id=WORKFLOW_ID) == 'token-1'
+    bulk.release_workflow_completion(table=pii_table, workflow_id=WORKFLOW_ID)
+    assert bulk.claim_workflow_completion(table=pii_table, workflow_id=WORKFLOW_ID) == 'token-1'
+
+def test_completion_waits_for_the_callback_token(bulk, pii_table):
+    ddb = boto3.client('dynamodb')
+    ddb.update_item(TableName=pii_table, Key=bulk.get_workflow_key(WORKFLOW_ID), UpdateExpression="REMOVE workflow_token")
+    for job_id in ('job-1', 'job-2', 'job-3'):
+        bulk.count_completed_job(table=pii_table, workflow_id=WORKFLOW_ID, job_id=job_id)
+    # Without a token the completion stays unclaimed instead of being claimed and never resumed
+    assert bulk.claim_workflow_completion(table=pii_table, workflow_id=WORKFLOW_ID) is None
+    assert 'textract_done' not in get_workflow(bulk, pii_table)
+
+    ddb.update_item(TableName=pii_table, Key=bulk.get_workflow_key(WORKFLOW_ID), UpdateExpression="SET workflow_token = :token",
+                    ExpressionAttributeValues={':token': {'S': 'token-1'}})
+    assert bulk.claim_workflow_completion(table=pii_table, workflow_id=WORKFLOW_ID) == 'token-1'
+
+def test_workflow_with_job_set_serializes():
+    get_workflows = load_lambda('get-workflows')
+    document = {'completed_files': get_workflows.decimal.Decimal(2), 'completed_jobs': {'job-2', 'job-1'}}
+    assert json.loads(json.dumps(document, cls=get_workflows.DecimalEncoder)) == {'completed_files': '2', 'completed_jobs': ['job-1', 'job-2']}
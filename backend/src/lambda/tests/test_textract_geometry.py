@@ -0,0 +1,122 @@
+import io
+import json
+
+import pytest
+from textractoverlayer.t_overlay import DocumentDimensions
+
+import TextractGeometry
+from TextractGeometry import TextBlock, TextGeometry, pack_geometry
+from conftest import load_lambda
+from redact import get_offset_redactions
+
+# Lines of every page, words are split on spaces
+PAGES = [["Patient John Smith", "DOB 01/02/1970"],
+         ["Seen by Dr. Jane Doe"],
+         ["Address 1 Main Street, Springfield"]]
+
+def geometry(left: float, top: float, width: float, height: float) -> dict:
+    return {'BoundingBox': {'Left': left, 'Top': top, 'Width': width, 'Height': height},
+            'Polygon': [{'X': left, 'Y': top}, {'X': left + width, 'Y': top},
+                        {'X': left + width, 'Y': top + height}, {'X': left, 'Y': top + height}]}
+
+def get_textract_json() -> dict:
+    """Textract JSON with one PAGE block per page, its LINE blocks and their WORD blocks"""
+    blocks = []
+    for page_num, lines in enumerate(PAGES, start=1):
+        page = {'BlockType': 'PAGE', 'Id': f'page-{page_num}', 'Page': page_num, 'Geometry': geometry(0, 0, 1, 1),
+                'Relationships': [{'Type': 'CHILD', 'Ids': []}]}
+        blocks.append(page)
+        for line_num, line_text in enumerate(lines):
+            top = 0.1 + 0.1 * line_num
+            line_id = f'line-{page_num}-{line_num}'
+            page['Relationships'][0]['Ids'].append(line_id)
+            line = {'BlockType': 'LINE', 'Id': line_id, 'Page': page_num, 'Text': line_text, 'Confidence': 99.0,
+                    'Geometry': geometry(0.1, top, 0.02 * len(line_text), 0.05), 'Relationships': [{'Type': 'CHILD', 'Ids': []}]}
+            blocks.append(line)
+            left = 0.1
+            for word_num, word_text in enumerate(line_text.split(" ")):
+                word_id = f'{line_id}-{word_num}'
+                line['Relationships'][0]['Ids'].append(word_id)
+                blocks.append({'BlockType': 'WORD', 'Id': word_id, 'Page': page_num, 'Text': word_text, 'Confidence': 99.0,
+                               'TextType': 'PRINTED', 'Geometry': geometry(left, top, 0.02 * len(word_text), 0.05)})
+                left += 0.02 * (len(word_text) + 1)
+    return {'DocumentMetadata': {'Pages': len(PAGES)}, 'Blocks': blocks}
+
+def get_entity(text: str, phrase: str, entity_type: str = 'NAME') -> dict:
+    begin = text.index(phrase)
+    return {'Text': phrase, 'Type': entity_type, 'BeginOffset': begin, 'EndOffset': begin + len(phrase)}
+
+@pytest.fixture
+def textract_json():
+    return get_textract_json()
+
+@pytest.fixture
+def text_geometry(textract_json):
+    return load_lambda('textract-output').get_text_geometry(textract_json)
+
+def test_stream_reader_matches_the_parsed_json(textract_json):
+    stream = io.BytesIO(json.dumps(textract_json).encode('utf-8'))
+    # a tiny chunk size makes values straddle the read boundaries
+    assert TextractGeometry.read_text_blocks(stream, chunk_size=7) == TextractGeometry.get_text_blocks(textract_json)
+
+def test_sidecar_round_trip(textract_json):
+    blocks = TextractGeometry.get_text_blocks(textract_json)
+    lines = [block for block in blocks if block.block_type == 'LINE']
+    words = [block for block in blocks if block.block_type == 'WORD']
+    sidecar = TextGeometry(pack_geometry(lines=lines, words=words, page_count=len(PAGES)))
+    assert (sidecar.page_count, sidecar.line_count, sidecar.word_count) == (len(PAGES), len(lines), len(words))
+
+    for block_type, expected in (('LINE', lines), ('WORD', words)):
+        unpacked = sidecar.blocks(block_type)
+        assert [(block.block_type, block.page_number, block.text, block.begin, block.end) for block in unpacked] == \
+               [(block.block_type, block.page_number, block.text, block.begin, block.end) for block in expected]
+        # coordinates are stored in single precision
+        for block, original in zip(unpacked, expected):
+            assert (block.left, block.top, block.width, block.height) == \
+                   pytest.approx((original.left, original.top, original.width, original.height), rel=1e-6)
+
+    assert [block.text for block in sidecar.blocks('LINE', first_page=2, last_page=2)] == PAGES[1]
+    assert [block.text for block in sidecar.blocks('LINE', first_page=3)] == PAGES[2]
+    records = sidecar.records('WORD', first_page=2, last_page=3)
+    assert records.records['page'].tolist() == [block.page_number for block in words if block.page_number >= 2]
+    assert records.texts == [block.text for block in words if block.page_number >= 2]
+    assert sidecar.records('WORD', with_text=False).texts is None
+
+def test_unknown_sidecar_is_rejected():
+    with pytest.raises(ValueError):
+        TextGeometry(b"\x00" * TextractGeometry.GEOMETRY_HEADER.size)
+
+def test_word_offsets_follow_the_plain_text(text_geometry):
+    text, sidecar = text_geometry
+    assert text == "".join(f"{line}\n" for lines in PAGES for line in lines)
+    for word in TextGeometry(sidecar).blocks('WORD'):
+        assert text[word.begin:word.end] == word.text
+
+def test_offset_redactions(text_geometry):
+    text, sidecar = text_geometry
+    words = TextGeometry(sidecar).records('WORD', with_text=False)
+    dimensions = [DocumentDimensions(doc_width=1000, doc_height=2000) for _ in PAGES]
+    comprehend_json = {'Entities': [
+        get_entity(text, 'John Smith'),
+        # entity inside a word, the whole word is redacted
+        get_entity(text, '1970', 'DATE'),
+        get_entity(text, 'Jane Doe'),
+        # overlaps the entity before, the shared word is redacted once
+        get_entity(text, 'Dr. Jane'),
+        get_entity(text, '1 Main Street', 'ADDRESS'),
+        # no offsets, or offsets on the line break between words, are left to text matching
+        {'Text': 'Springfield', 'Type': 'ADDRESS'},
+        {'Text': '\n', 'Type': 'NAME', 'BeginOffset': text.index('\n'), 'EndOffset': text.index('\n') + 1},
+    ]}
+    redactions, unresolved = get_offset_redactions(words=words, comprehend_json=comprehend_json, document_dimensions=dimensions)
+
+    assert [(box.page_number, box.text) for box in redactions] == [
+        (1, 'John Smith'), (1, 'John Smith'), (1, '1970'),
+        (2, 'Dr. Jane'), (2, 'Jane Doe'), (2, 'Jane Doe'),
+        (3, '1 Main Street'), (3, '1 Main Street'), (3, '1 Main Street')]
+    assert [entity['Text'] for entity in unresolved] == ['Springfield', '\n']
+
+    # boxes are the WORD boxes scaled to the page size
+    john = redactions[0]
+    # "John" starts after "Patient ", 0.02 wide per character
+    assert (john.xmin, john.ymin, john.xmax, john.ymax) == (260, 200, 340, 300)
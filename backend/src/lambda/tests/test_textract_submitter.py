@@ -0,0 +1,93 @@
+import threading
+import time
+
+import boto3
+import pytest
+
+import TextractSubmitter
+
+DOC = dict(workflow_id='wf-1', input_path='input/wf-1/', document_name='a.pdf')
+
+@pytest.fixture
+def submitter(pii_table, monkeypatch):
+    # The budget is bound as the default argument of the slot functions at import
+    monkeypatch.setattr(TextractSubmitter, 'TEXTRACT_MAX_CONCURRENT_JOBS', 2)
+    monkeypatch.setattr(TextractSubmitter.acquire_job_slot, '__defaults__', (2,))
+    monkeypatch.setattr(TextractSubmitter.release_job_slot, '__defaults__', (2,))
+    monkeypatch.setattr(TextractSubmitter, 'rate_limiter', TextractSubmitter.TokenBucket(rate=100))
+    started = []
+    def start_document_analysis(doc, env_vars):
+        started.append(doc['document_name'])
+        # the ClientRequestToken returns the same job for the same document
+        return f"job-{TextractSubmitter.get_client_request_token(doc)[:8]}"
+    monkeypatch.setattr(TextractSubmitter, 'start_document_analysis', start_document_analysis)
+    TextractSubmitter.started = started
+    return TextractSubmitter
+
+def get_jobs_in_progress(table) -> int:
+    item = boto3.client('dynamodb').get_item(TableName=table, Key=TextractSubmitter.JOB_BUDGET_KEY, ConsistentRead=True).get('Item', {})
+    return int(item.get('jobs_in_progress', {}).get('N', '0'))
+
+def test_job_budget_is_never_exceeded(submitter, pii_table):
+    assert submitter.acquire_job_slot(table=pii_table, budget=2)
+    assert submitter.acquire_job_slot(table=pii_table, budget=2)
+    assert not submitter.acquire_job_slot(table=pii_table, budget=2)
+    submitter.release_job_slot(table=pii_table, budget=2)
+    assert submitter.acquire_job_slot(table=pii_table, budget=2)
+    assert get_jobs_in_progress(pii_table) == 2
+
+def test_released_slots_do_not_go_below_zero(submitter, pii_table):
+    submitter.release_job_slot(table=pii_table, budget=2)
+    assert submitter.acquire_job_slot(table=pii_table, budget=2)
+    submitter.release_job_slot(table=pii_table, budget=2)
+    submitter.release_job_slot(table=pii_table, budget=2)
+    assert get_jobs_in_progress(pii_table) == 0
+
+def test_account_rate_is_shared_across_containers(submitter, pii_table, monkeypatch):
+    calls = []
+    seen = threading.local()
+    clock = time.time
+    def observed_time():
+        # The second read last by a thread is the window its call was counted in
+        seen.second = int(clock())
+        return seen.second
+    monkeypatch.setattr(submitter.time, 'time', observed_time)
+    def container():
+        for _ in range(3):
+            submitter.acquire_account_rate(table=pii_table, tps=4, enabled=True)
+            calls.append(seen.second)
+    # Every thread stands for a Lambda container with its own token bucket
+    threads = [threading.Thread(target=container) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    per_second = {}
+    for call in calls:
+        per_second[call] = per_second.get(call, 0) + 1
+    assert len(calls) == 12
+    assert max(per_second.values()) <= 4
+
+def test_stale_claim_takes_over_the_job_slot(submitter, pii_table, monkeypatch):
+    env_vars = dict(PII_TABLE=pii_table)
+    # A consumer claims the document and takes a slot, then stalls past the lease
+    assert submitter.claim_submission(table=pii_table, doc=DOC, claim_id='stalled')['status'] == 'claimed'
+    assert submitter.acquire_job_slot(table=pii_table)
+    assert submitter.hold_job_slot(table=pii_table, doc=DOC, claim_id='stalled')
+    monkeypatch.setattr(submitter, 'SUBMISSION_LEASE_SECONDS', -1)
+
+    result = submitter.submit_document(doc=DOC, env_vars=env_vars)
+    assert result['status'] == 'submitted'
+    # The job holds the slot of the stalled claim, not a second one
+    assert get_jobs_in_progress(pii_table) == 1
+    # The stalled consumer failing later does not give the slot back either
+    assert not submitter.release_submission(table=pii_table, doc=DOC, claim_id='stalled', error='late')
+    assert get_jobs_in_progress(pii_table) == 1
+
+def test_failed_submission_gives_back_its_slot(submitter, pii_table, monkeypatch):
+    def start_document_analysis(doc, env_vars):
+        raise RuntimeError('invalid document')
+    monkeypatch.setattr(submitter, 'start_document_analysis', start_document_analysis)
+    result = submitter.submit_document(doc=DOC, env_vars=dict(PII_TABLE=pii_table))
+    assert result['status'] == 'failed'
+    assert get_jobs_in_progress(pii_table) == 0
@@ -3,144 +3,169 @@ import boto3
 import json
 import logging
 import os
+import time
 from boto3.dynamodb.types import TypeDeserializer
-from botocore.config import Config
-
-# Disable Boto3 retries since the message will be processed
-# via notification channel
-retry_config = Config(
-   retries = {
-      'max_attempts': 0,
-      'mode': 'standard'
-   }
-)
+from S3Functions import S3
+from TextractSubmitter import get_msg_submit, release_job_slot
 
 deserializer = TypeDeserializer()
 sfn = boto3.client('stepfunctions')
-sqs = boto3.client('sqs')
-textract = boto3.client('textract', config=retry_config)
 ddb = boto3.client('dynamodb')
-s3 = boto3.client('s3')
-s3r = boto3.resource('s3')
 lambda_client = boto3.client('lambda')
 logger = logging.getLogger(__name__)
 
-def get_msg_submit(event, env_vars, num_msgs):
+def get_workflow_key(workflow_id: str) -> dict:
+    """Key of the workflow item in the PII table
+    """
+    return {'part_key': {'S': workflow_id}, 'sort_key': {'S': f"input/{workflow_id}/"}}
+
+def is_condition_failed(error: Exception) -> bool:
+    return isinstance(error, botocore.exceptions.ClientError) and error.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+def count_completed_job(table: str, workflow_id: str, job_id: str) -> bool:
+    """
+    Atomically counts a finished Textract job: a completion item is put for the job
+    (sort_key completion/<job_id>) and completed_files is incremented on the workflow item in a
+    single transaction, unless the completion item already exists. The workflow item itself does
+    not grow with the number of jobs.
+
+    Returns:
+        bool: False when the job was already counted, e.g. for a redelivered SNS notification
+    """
     try:
-        logger.debug("Getting messages from SQS Queue")
-        sqsresponse = sqs.receive_message(QueueUrl=env_vars['PII_QUEUE'],
-                                          MaxNumberOfMessages=num_msgs,
-                                          VisibilityTimeout=10,
-                                          WaitTimeSeconds=5)   # Long poll to get as many messages as possible (max 10)
-        logger.debug(json.dumps(sqsresponse))
-
-        messages = [{"doc": json.loads(msg['Body']), "ReceiptHandle": msg['ReceiptHandle']} for msg in sqsresponse['Messages']]
-        logger.debug(json.dumps(messages))
-
-        jobs=[]
-        for message in messages:
-            doc = message['doc']
-            msg_handle = message['ReceiptHandle']
-
-            logger.debug(f"Starting Async Textract job for workflow: {doc['workflow_id']}, document: {doc['document_name']}")
-            try:
-                txrct_response = textract.start_document_analysis(
-                                        DocumentLocation={
-                                            'S3Object': {
-                                                'Bucket': env_vars['INPUT_BKT'],
-                                                'Name': f"public/{doc['input_path']}{doc['document_name']}",
-                                            }
-                                        },
-                                        FeatureTypes=['TABLES','FORMS'],
-                                        JobTag=doc['workflow_id'],
-                                        NotificationChannel={
-                                            'SNSTopicArn': env_vars['SNS_TOPIC'],
-                                            'RoleArn': env_vars['SNS_ROLE']
-                                        },
-                                        OutputConfig={
-                                            'S3Bucket': env_vars['INPUT_BKT'],
-                                            'S3Prefix': f"public/output/{doc['workflow_id']}"
-                                        }
-                                    )
-                logger.debug(json.dumps(txrct_response))            
-                jobs.append(txrct_response['JobId'])                
-            except botocore.exceptions.ClientError as error:
-                if (error.response['Error']['Code'] == 'LimitExceededException'
-                    or error.response['Error']['Code'] == 'ThrottlingException'
-                    or error.response['Error']['Code'] == 'ProvisionedThroughputExceededException'
-                    ):
-                    logger.warn('API call limit exceeded; backing off...')
-                    raise error
-                else:
-                    pass
-
-            # delete SQS Messages here
-            sqs.delete_message(QueueUrl=env_vars['PII_QUEUE'], ReceiptHandle=msg_handle)
-            logger.debug(f"Textract Analyze document job submitted with job id : {txrct_response['JobId']}, and SQS Message deleted.")
-        
-        return jobs
-    except Exception as error:
-        raise error
+        ddb.transact_write_items(TransactItems=[
+            {'Put': {'TableName': table,
+                     'Item': {'part_key': {'S': workflow_id},
+                              'sort_key': {'S': f"completion/{job_id}"},
+                              'completed_ts': {'N': str(int(time.time()))}},
+                     'ConditionExpression': "attribute_not_exists(part_key)"}},
+            {'Update': {'TableName': table,
+                        'Key': get_workflow_key(workflow_id),
+                        'UpdateExpression': "ADD completed_files :one",
+                        'ConditionExpression': "attribute_exists(part_key)",
+                        'ExpressionAttributeValues': {':one': {'N': '1'}}}}
+        ])
+        return True
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'TransactionCanceledException':
+            raise e
+        reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+        if reasons and reasons[0] == 'ConditionalCheckFailed':
+            logger.info(f"Textract job {job_id} of workflow {workflow_id} already counted")
+            return False
+        if len(reasons) > 1 and reasons[1] == 'ConditionalCheckFailed':
+            logger.error(f"Workflow {workflow_id} of Textract job {job_id} not found")
+            return False
+        raise e
 
-def sns_invoked(event, env_vars):
-    #sns_invoked function
-    message = json.loads(event['Records'][0]['Sns']['Message'])
+def claim_workflow_completion(table: str, workflow_id: str) -> str:
+    """
+    Claims the completion of the Textract step of a workflow once every document is counted. The
+    conditional write succeeds for exactly one caller, whichever notification counted the last job.
+    A workflow whose callback token is not stored yet is not claimed, it could not be resumed.
+
+    Returns:
+        str: Step Functions callback token of the workflow for the caller that claimed the completion, otherwise None
+    """
+    try:
+        response = ddb.update_item(TableName=table,
+                                   Key=get_workflow_key(workflow_id),
+                                   UpdateExpression="SET textract_done = :done",
+                                   ConditionExpression="completed_files >= total_files AND attribute_exists(workflow_token) AND attribute_not_exists(textract_done)",
+                                   ExpressionAttributeValues={':done': {'BOOL': True}},
+                                   ReturnValues='ALL_NEW')
+        return deserializer.deserialize(response['Attributes']['workflow_token'])
+    except Exception as e:
+        if is_condition_failed(e):
+            return None
+        raise e
+
+def release_workflow_completion(table: str, workflow_id: str):
+    """Releases a completion claim whose callback could not be sent, so a retry can claim it again
+    """
+    ddb.update_item(TableName=table, Key=get_workflow_key(workflow_id), UpdateExpression="REMOVE textract_done")
+
+def process_notification(record: dict, event, env_vars) -> dict:
+    """
+    Handles the SNS notification of a finished Textract job: starts its post processing, records
+    its status, counts it on the workflow item and resumes the state machine once every document
+    of the workflow is done. Otherwise more queued documents are submitted to Textract.
+
+    Returns:
+        dict: Job ID, workflow ID and the submitted job IDs or the callback response
+    """
+    message = json.loads(record['Sns']['Message'])
     jobId = message['JobId']    
     workflow_id = message['JobTag']
     status= message['Status'].lower() # Status of the Async Job      
     bucket = message['DocumentLocation']['S3Bucket']
     root_prefix = message['DocumentLocation']['S3ObjectName'].split("/")[0]
     document = os.path.basename(message['DocumentLocation']['S3ObjectName'])
+    result = dict(job_id=jobId, workflow_id=workflow_id)
+
+    # Post processing and the temp processing file are idempotent, they are redone for redelivered
+    # notifications so a retry after a failure in between never skips them
+    logger.debug(f"Invoking post processing for JobId {jobId} asynchronously")
+    lambda_payload = {"workflow_id": workflow_id, "output_path": f"{root_prefix}/output/{workflow_id}/{jobId}", "doc_name": document}
+    lambda_client.invoke(FunctionName=env_vars['LAMBDA_POST_PROCESS'], 
+                        InvocationType='Event',
+                        Payload=json.dumps(lambda_payload))
+    
+    file_to_process = {}
+    file_to_process[document] = {"S":f"{status}:{jobId}"}
+          
+    s3 = S3(bucket=bucket, log_level=env_vars.get('LOG_LEVEL', 'INFO'))
+    s3.put_object(key=f"{root_prefix}/temp/{workflow_id}/{document}.json", body=json.dumps(file_to_process))
+    logger.debug(f"Updated temp processing file {root_prefix}/temp/{workflow_id}/{document}.json")
 
+    if count_completed_job(table=env_vars['PII_TABLE'], workflow_id=workflow_id, job_id=jobId):
+        # The job no longer counts against the concurrent Textract job budget
+        release_job_slot(table=env_vars['PII_TABLE'])
+
+    # Redelivered notifications also try to claim the completion, in case the invocation that counted
+    # the last job failed before resuming the state machine
+    sm_token = claim_workflow_completion(table=env_vars['PII_TABLE'], workflow_id=workflow_id)
+    if not sm_token:
+        # Documents remained to be processed or are being processed
+        event["bucket"] = bucket            
+        jobs = get_msg_submit(event, env_vars, 10)
+        logger.debug(f"Submitted Jobs : {json.dumps(jobs)}")
+        result['jobs'] = jobs
+        return result
+
+    #Post to state machine that workflow is done
     try:
-        logger.debug(f"Invoking post processing for JobId {jobId} asynchronously")
-        lambda_payload = {"workflow_id": workflow_id, "output_path": f"{root_prefix}/output/{workflow_id}/{jobId}", "doc_name": document}
-        lambda_client.invoke(FunctionName=env_vars['LAMBDA_POST_PROCESS'], 
-                            InvocationType='Event',
-                            Payload=json.dumps(lambda_payload))
-        
-        file_to_process = {}
-        file_to_process[document] = {"S":f"{status}:{jobId}"}
-              
-        s3.put_object(Body=json.dumps(file_to_process),Bucket=bucket,Key=f"{root_prefix}/temp/{workflow_id}/{document}.json")
-        logger.debug(f"Updated temp processing file {root_prefix}/temp/{workflow_id}/{document}.json")
-
-        pii_bucket = s3r.Bucket(bucket)
-        processed_files = [obj.key for obj in pii_bucket.objects.filter(Prefix=f"{root_prefix}/temp/{workflow_id}") if not obj.key.endswith("/")]
-        files = [obj.key for obj in pii_bucket.objects.filter(Prefix=f"{root_prefix}/input/{workflow_id}") if not obj.key.endswith("/")]
-        
-
-        # Some documents remain to be submitted to Textract
-        if len(processed_files) < len(files):
-            # Documents remained to be processed or are being processed
-            event["bucket"] = bucket            
-            jobs = get_msg_submit(event, env_vars, 10)
-            logger.debug(f"Submitted Jobs : {json.dumps(jobs)}")
-            return jobs
-        else:            
-            #Post to state machine that workflow is done
-            select = f"SELECT \"workflow_token\" FROM \"{env_vars['PII_TABLE']}\" WHERE part_key=? AND sort_key=?"
-            ddb_response = ddb.execute_statement(Statement=select, Parameters=[
-                                                            {'S': workflow_id},
-                                                            {'S': f"input/{workflow_id}/"}
-                                                        ])
-            deserialized_document = {k: deserializer.deserialize(v) for k, v in ddb_response['Items'][0].items()}
-            sm_token = deserialized_document['workflow_token']
-            smresponse = sfn.send_task_success(taskToken=sm_token, 
-                                               output=json.dumps({
-                                                                    "Payload": { 
-                                                                            "workflow_id": workflow_id, 
-                                                                            "bucket": bucket, 
-                                                                            "tmp_process_dir": f"{root_prefix}/temp/{workflow_id}",
-                                                                            "phi_input_dir": f"{root_prefix}/phi-input/{workflow_id}"
-                                                                        }
-                                                                }))
-            logger.debug(smresponse)
-
-            return smresponse
-    except Exception as e:                
-        logger.error(e)
-        return event
+        smresponse = sfn.send_task_success(taskToken=sm_token, 
+                                           output=json.dumps({
+                                                                "Payload": { 
+                                                                        "workflow_id": workflow_id, 
+                                                                        "bucket": bucket, 
+                                                                        "tmp_process_dir": f"{root_prefix}/temp/{workflow_id}",
+                                                                        "phi_input_dir": f"{root_prefix}/phi-input/{workflow_id}"
+                                                                    }
+                                                            }))
+    except Exception as e:
+        release_workflow_completion(table=env_vars['PII_TABLE'], workflow_id=workflow_id)
+        raise e
+    logger.debug(smresponse)
+    result['callback'] = smresponse
+    return result
+
+def sns_invoked(event, env_vars):
+    """
+    Handles every SNS record of the invocation. Records are counted idempotently, so a failed
+    invocation is raised for the Lambda retry to process its records again.
+    """
+    results, errors = [], []
+    for record in event['Records']:
+        try:
+            results.append(process_notification(record, event, env_vars))
+        except Exception as e:
+            logger.error(e)
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return results
 
 
 def lambda_handler(event, context):
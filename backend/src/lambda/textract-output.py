@@ -1,17 +1,33 @@
-import boto3
 import os
 import json
 import logging
 from trp import Document
-from textractprettyprinter.t_pretty_print import Textract_Pretty_Print, get_string
-from textractcaller import get_full_json_from_output_config
-from textractcaller.t_call import OutputConfig
+from textractcaller.t_call import remove_none
 import xlsxwriter
+from TextractGeometry import TextBlock, pack_geometry
+from S3Functions import S3
 
-s3 = boto3.client('s3')
-s3_resource = boto3.resource('s3')
 logger = logging.getLogger(__name__)
 bucket = os.environ.get('BKT')
+s3 = S3(bucket=bucket, log_level=os.environ.get('LOG_LEVEL', 'INFO'))
+
+def get_full_json_from_output(s3: S3, s3_prefix: str, job_id: str) -> dict:
+    """
+    Merges the numbered result files Textract writes to the OutputConfig prefix of a job into one
+    response, like textractcaller get_full_json_from_output_config but through the S3 helper so it
+    works on every storage backend.
+    """
+    keys = [key for key in s3.iter_objects(prefix=f"{s3_prefix.strip('/')}/{job_id}") if key.split("/")[-1].isnumeric()]
+    result_value = dict()
+    for key in sorted(keys, key=lambda item: int(item.split("/")[-1])):
+        logger.info(f"found keys: {key}")
+        response = json.loads(s3.get_object_content(key=key))
+        if "Blocks" in result_value:
+            result_value["Blocks"].extend(response["Blocks"])
+        else:
+            result_value = response
+    result_value.pop("NextToken", None)
+    return remove_none(result_value)
 
 
 # Find Textract Async ouputs and merge them together into 1 json
@@ -25,8 +41,7 @@ def get_textract_json(event):
     result={}
     try:
         logger.debug(f"Merging Amazon Textract output JSON")
-        op_config = OutputConfig(s3_bucket=bucket, s3_prefix=s3Prefix)
-        result = get_full_json_from_output_config(output_config=op_config, job_id=job_id, s3_client=s3)        
+        result = get_full_json_from_output(s3=s3, s3_prefix=s3Prefix, job_id=job_id)
 
         if(result):
             logger.debug(f"Merging json Done...")
@@ -37,9 +52,8 @@ def get_textract_json(event):
             """            
             logger.debug(f"Writing JSON to S3")
             s3.put_object(
-                    Body=json.dumps(result),
-                    Bucket=bucket,
-                    Key=f'{prefix}/{doc_name}.json'
+                    key=f'{prefix}/{doc_name}.json',
+                    body=json.dumps(result)
                 )
         else:
             logger.debug("Unable to process Textract Output JSON...")
@@ -141,14 +155,47 @@ def gen_excel(textract_j, event):
         For example, for document my_doc.pdf the corresponding Excel file will be named my_doc.pdf-report.xlsx
         """
         logger.debug(f"Writing Excel report {doc_name}-report.xlsx to S3...")
-        s3_resource.meta.client.upload_file('/tmp/output_report.xlsx', bucket, f'{prefix}/{doc_name}-report.xlsx')
+        s3.upload_file(source_file='/tmp/output_report.xlsx', destination_object=f'{prefix}/{doc_name}-report.xlsx')
         logger.debug("Upload Excel report to S3 complete...")
         return {"Payload": "done"}
     except Exception as e:
         logger.error(e)
         raise e
     
+def get_text_geometry(textract_j):
+    """
+    Generates the plain text of the document (one LINE per row, same as the Textract pretty printer LINES output)
+    along with the geometry sidecar of its LINE and WORD blocks.
+
+    Every record carries its character range in the plain text, WORD records are in plain text order so the
+    redaction Lambda can resolve Amazon Comprehend Medical BeginOffset/EndOffset to word boxes with a binary search.
+    See TextractGeometry for the sidecar layout.
+    """
+    doc = Document(textract_j)
+    rows = []
+    lines, words = [], []
+    position = 0
+    for page_num, page in enumerate(doc.pages, start=1):
+        for line in page.lines:
+            line_text = line.text
+            box = line.geometry.boundingBox
+            lines.append(TextBlock("LINE", page_num, line_text, box.left, box.top, box.width, box.height, position, position + len(line_text)))
+            cursor = 0
+            for word in line.words:
+                word_start = line_text.find(word.text, cursor) if word.text else -1
+                if word_start < 0:
+                    logger.debug(f"Word {word.id} not found in line text, skipping offset")
+                    continue
+                cursor = word_start + len(word.text)
+                box = word.geometry.boundingBox
+                words.append(TextBlock("WORD", page_num, word.text, box.left, box.top, box.width, box.height, position + word_start, position + cursor))
+            rows.append(f"{line_text}\n")
+            position += len(line_text) + 1
+    text = "".join(rows)
+    return text, pack_geometry(lines=lines, words=words, page_count=len(doc.pages))
+
 def gen_plain_text(textract_j, event):
+    prefix = event['output_path']
     dirs = event['output_path'].split("/")
     root_dir = dirs[0]
     job_id = dirs[-1]
@@ -156,7 +203,7 @@ def gen_plain_text(textract_j, event):
     wf_id = event["workflow_id"]
 
     logger.debug("Generating text file...")
-    text = get_string(textract_json=textract_j, output_type=[Textract_Pretty_Print.LINES])    
+    text, geometry = get_text_geometry(textract_j)
 
     logger.debug(f"Writing plaintext file to S3...")
     try:
@@ -174,9 +221,20 @@ def gen_plain_text(textract_j, event):
         update the post processing logic in idp-process-phi-output.py Lambda function
         """        
         s3.put_object(
-                Body=text,
-                Bucket=bucket,
-                Key=f'{root_dir}/phi-input/{wf_id}/{job_id}/{doc_name}.txt'
+                key=f'{root_dir}/phi-input/{wf_id}/{job_id}/{doc_name}.txt',
+                body=text
+            )
+
+        """
+        Write the binary geometry sidecar to S3. This file will be of naming convention <document_name>.geometry.
+        For example, for document my_doc.pdf the corresponding sidecar will be named my_doc.pdf.geometry.
+        The redaction Lambda reads the LINE/WORD boxes from it instead of the Textract JSON and uses the text
+        offsets to map PHI entity offsets in the plain text file back to Textract WORD boxes.
+        """
+        logger.debug(f"Writing geometry sidecar to S3...")
+        s3.put_object(
+                key=f'{prefix}/{doc_name}.geometry',
+                body=geometry
             )
     except Exception as e:
         logger.error(e)
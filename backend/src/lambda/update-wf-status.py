@@ -31,12 +31,9 @@ def lambda_handler(event, context):
         processed_files = s3.list_objects(prefix=tmp_process_dir)
         processed_docs = {}
         for file in processed_files:            
-            content = s3.get_object_content(key=file)
-            logger.debug(content)            
-            obj = json.loads(content)
-            logger.debug(obj)
-            processed_docs = {**processed_docs, **obj}
-            logger.debug(processed_docs)
+            obj = json.load(s3.get_object_stream(key=file))
+            processed_docs.update(obj)
+        logger.debug(f"Loaded status of {len(processed_docs)} documents from {len(processed_files)} temp files")
 
         logger.info("Updating workflow status...")
         update = f"UPDATE \"{env_vars['PII_TABLE']}\" SET docs=? SET status=? set phi_input=? WHERE part_key=? AND sort_key=? RETURNING ALL NEW *"